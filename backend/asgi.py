@@ -0,0 +1,5 @@
+# ASGI entry point of the API, serve it from this directory
+# with an ASGI server, e.g. `uvicorn asgi:app --workers 4`
+from flaskr.asgi import create_asgi_app
+
+app = create_asgi_app()
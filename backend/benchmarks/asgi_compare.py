@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from urllib import request as urlrequest
+
+from benchmarks.run import SCENARIOS, percentile, start_server
+
+# Scenarios of routes the ASGI app doesn't serve
+WSGI_ONLY = ('POST /questions/bulk', 'GET /questions/export',
+             'GET /questions/suggest', 'GET /questions/duplicates')
+
+
+# Just enough of the Flask test client API
+# for the scenarios that prepare requests with it
+class HTTPClient:
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def get(self, path):
+        return self.open('GET', path)
+
+    def post(self, path, json=None):
+        return self.open('POST', path, json)
+
+    def open(self, method, path, data=None):
+        req = urlrequest.Request(self.base_url + path, method=method)
+        if data is not None:
+            req.data = json.dumps(data).encode()
+            req.add_header('Content-Type', 'application/json')
+        with urlrequest.urlopen(req) as res:
+            return HTTPResponse(json.loads(res.read().decode()))
+
+
+class HTTPResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def get_json(self):
+        return self.data
+
+
+# Runs the ASGI app under uvicorn in a background thread
+def start_asgi_server(app):
+    import uvicorn
+
+    class ThreadedServer(uvicorn.Server):
+        # Signals can only be handled by the main thread
+        def install_signal_handlers(self):
+            pass
+
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = ThreadedServer(uvicorn.Config(
+        app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError('the ASGI server failed to start')
+        time.sleep(0.01)
+    return server, thread, f'http://127.0.0.1:{port}'
+
+
+# Sends one request on a new connection, returns (latency in ms, failed)
+async def send(host, port, spec):
+    method, path, body, content_type = spec
+    body = body or b''
+    begin = time.perf_counter()
+    reader, writer = await asyncio.open_connection(host, port)
+    head = [f'{method} {path} HTTP/1.1', f'Host: {host}:{port}',
+            'Connection: close', f'Content-Length: {len(body)}']
+    if content_type:
+        head.append(f'Content-Type: {content_type}')
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status = int(response.split(b' ', 2)[1])
+    return (time.perf_counter() - begin) * 1000, status >= 400
+
+
+# Sends the requests with at most "concurrency" of them in flight,
+# from a single event loop so the client itself isn't thread bound
+async def drive(base_url, specs, concurrency):
+    host, port = base_url.rsplit('//', 1)[1].split(':')
+    slots = asyncio.Semaphore(concurrency)
+
+    async def limited(spec):
+        async with slots:
+            return await send(host, int(port), spec)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(limited(spec) for spec in specs))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, failed in results)
+    return {
+        'requests': len(results),
+        'errors': sum(failed for latency, failed in results),
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'throughput_rps': len(results) / elapsed if elapsed else None
+    }
+
+
+def print_report(report):
+    print('\n{:34}{:>12}{:>12}{:>12}{:>12}{:>8}'.format(
+        'endpoint', 'wsgi rps', 'asgi rps', 'wsgi p95', 'asgi p95', 'x'))
+    for name, stats in report['results']['wsgi'].items():
+        asgi_stats = report['results']['asgi'][name]
+        ratio = asgi_stats['throughput_rps'] / stats['throughput_rps']
+        print('{:34}{:>12.1f}{:>12.1f}{:>12.2f}{:>12.2f}{:>8.2f}'.format(
+            name, stats['throughput_rps'], asgi_stats['throughput_rps'],
+            stats['p95_ms'], asgi_stats['p95_ms'], ratio))
+        errors = stats['errors'] + asgi_stats['errors']
+        if errors:
+            print(f'  {errors} failed requests')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Compares the throughput of the WSGI (Flask) and '
+                    'ASGI apps under concurrent load')
+    parser.add_argument(
+        '--database-url', default='sqlite:///benchmark.db',
+        help='database to seed and benchmark, use a throwaway one')
+    parser.add_argument('--questions', type=int, default=10000,
+                        help='size of the question corpus to seed')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=200,
+                        help='requests in flight at once')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', action='append', default=[],
+                        help='only run endpoints containing this text')
+    parser.add_argument('--response-cache', action='store_true',
+                        help='let the WSGI app serve reads from its cache')
+    parser.add_argument('--save', help='write the results as JSON')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The database is chosen before the app reads its settings
+    os.environ['DATABASE_URL'] = args.database_url
+    from flaskr import create_app
+    from flaskr.asgi import create_asgi_app
+    from flaskr.caching import LRUBackend
+    from fixtures import seed
+    from benchmarks.run import git_commit, unlimited_config
+
+    # The ASGI app has no admission control either
+    app = create_app(unlimited_config())
+    # The ASGI app has no response cache, so by default neither app has one
+    if not args.response_cache:
+        app.extensions['response_cache'].backend = LRUBackend(0)
+    with app.app_context():
+        print(f'Seeding {args.questions} questions...')
+        total = seed(args.questions, args.seed)
+
+    scenarios = [scenario for scenario in SCENARIOS
+                 if scenario[0] not in WSGI_ONLY and (not args.only or any(
+                     text in scenario[0] for text in args.only))]
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'questions': total,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'response_cache': args.response_cache
+        },
+        'results': {'wsgi': {}, 'asgi': {}}
+    }
+
+    wsgi_server, wsgi_url = start_server(app)
+    asgi_server, asgi_thread, asgi_url = start_asgi_server(
+        create_asgi_app(args.database_url))
+    try:
+        for name, prepare, cap in scenarios:
+            n = min(args.requests, cap or args.requests)
+            for target, base_url in (('wsgi', wsgi_url), ('asgi', asgi_url)):
+                ctx = {'rand': random.Random(args.seed), 'total': total,
+                       'client': HTTPClient(base_url)}
+                with app.app_context():
+                    specs = prepare(ctx, n)
+                report['results'][target][name] = asyncio.run(
+                    drive(base_url, specs, args.concurrency))
+    finally:
+        wsgi_server.shutdown()
+        asgi_server.should_exit = True
+        asgi_thread.join()
+
+    print_report(report)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nSaved results to {args.save}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
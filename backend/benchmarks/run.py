@@ -0,0 +1,585 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib import error as urlerror
+from urllib import request as urlrequest
+
+JSON = 'application/json'
+NDJSON = 'application/x-ndjson'
+
+# Ratio above the baseline that counts as a regression, and the smallest
+# absolute slowdown (in ms) worth reporting so noise isn't flagged
+DEFAULT_TOLERANCE = 0.10
+NOISE_FLOOR_MS = 0.5
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold start of the app in a fresh interpreter: importing it, creating it
+# and answering its first request (which opens the first connection)
+STARTUP_SCRIPT = '''
+import json, time
+started = time.perf_counter()
+from flaskr import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+app.test_client().get('/categories')
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'create_app_ms': (created - imported) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'total_ms': (served - started) * 1000
+}))
+'''
+
+
+# Settings of create_app turning the admission limits off, the load
+# generators send every request from one address and would mostly
+# measure refused requests
+def unlimited_config():
+    from flaskr import ADMISSION_LIMITS
+    return {name.upper() + suffix: 0 for name in ADMISSION_LIMITS
+            for suffix in ('_CONCURRENCY', '_RATE')}
+
+
+# Counts the SQL statements sent to the database
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def request_spec(method, path, body=None, content_type=None):
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+        content_type = content_type or JSON
+    return method, path, body, content_type
+
+
+# Scenarios, each prepares "n" requests against one route of create_app
+
+
+def categories(ctx, n):
+    return [request_spec('GET', '/categories')] * n
+
+
+def questions_page(ctx, n):
+    pages = max(ctx['total'] // 10, 1)
+    return [request_spec('GET', f"/questions?page={ctx['rand'].randint(1, pages)}")
+            for _ in range(n)]
+
+
+# The question list as a mobile client asks for it: questions only,
+# without answers nor the categories it already has
+def questions_projected(ctx, n):
+    pages = max(ctx['total'] // 10, 1)
+    return [request_spec('GET', '/questions?page={}&fields=question'
+                         '&include_categories=false'.format(
+                             ctx['rand'].randint(1, pages)))
+            for _ in range(n)]
+
+
+# Walks the keyset pages from the start so deep cursors are measured too
+def questions_cursor(ctx, n):
+    specs = [request_spec('GET', '/questions?cursor=')]
+    cursor = ''
+    while len(specs) < n:
+        data = ctx['client'].get(f'/questions?cursor={cursor}').get_json()
+        cursor = data.get('next_cursor')
+        if not cursor:
+            break
+        specs.append(request_spec('GET', f'/questions?cursor={cursor}'))
+    return specs
+
+
+def category_questions(ctx, n):
+    return [request_spec('GET', f"/categories/{ctx['rand'].randint(1, 6)}/questions")
+            for _ in range(n)]
+
+
+def search(ctx, n):
+    from fixtures import SUBJECTS
+    return [request_spec('POST', '/questions', {
+                'searchTerm': ctx['rand'].choice(SUBJECTS)[:4]})
+            for _ in range(n)]
+
+
+# Prefixes as typed in the search box, one to five letters of a subject
+def suggest(ctx, n):
+    from fixtures import SUBJECTS
+    return [request_spec('GET', '/questions/suggest?prefix={}'.format(
+                ctx['rand'].choice(SUBJECTS)[:ctx['rand'].randint(1, 5)]))
+            for _ in range(n)]
+
+
+# The similarity index is built beforehand, the first added question
+# would otherwise be timed building it
+def add_question(ctx, n):
+    from flaskr.duplicates import duplicate_index
+    duplicate_index.build()
+    return [request_spec('POST', '/questions', {
+                'question': f'Benchmark question {i}?',
+                'answer': 'Benchmark',
+                'category': ctx['rand'].randint(1, 6),
+                'difficulty': ctx['rand'].randint(1, 5)})
+            for i in range(n)]
+
+
+# Each request has its own limit so none is served from the cache
+def duplicate_questions(ctx, n):
+    return [request_spec('GET', f'/questions/duplicates?limit={i + 1}')
+            for i in range(n)]
+
+
+# Deletes questions inserted just for this scenario
+def delete_question(ctx, n):
+    from fixtures import synthetic_questions
+    from models import Question, db
+    marker = f'Benchmark deletion {time.time()}'
+    rows = list(synthetic_questions(n, seed=ctx['rand'].random()))
+    for row in rows:
+        row['question'] = marker
+    db.session.execute(Question.__table__.insert(), rows)
+    db.session.commit()
+    quest_ids = [quest_id for quest_id, in db.session.query(
+        Question.id).filter(Question.question == marker)]
+    db.session.remove()
+    return [request_spec('DELETE', f'/questions/{quest_id}')
+            for quest_id in quest_ids]
+
+
+def bulk_add_questions(ctx, n):
+    from fixtures import synthetic_questions
+    body = '\n'.join(json.dumps(row) for row in synthetic_questions(
+        100, seed=ctx['rand'].random())).encode()
+    return [request_spec('POST', '/questions/bulk', body, NDJSON)] * n
+
+
+def export_questions(ctx, n):
+    return [request_spec('GET', '/questions/export')] * n
+
+
+def quiz_start(ctx, n):
+    return [request_spec('POST', '/quizzes', {
+                'previous_questions': [],
+                'quiz_category': {'id': ctx['rand'].randint(0, 6)}})
+            for _ in range(n)]
+
+
+# Draws from quiz sessions started beforehand
+def quiz_next(ctx, n):
+    sessions = []
+    for _ in range(max(n // 5, 1)):
+        data = ctx['client'].post('/quizzes', json={
+            'previous_questions': [],
+            'quiz_category': {'id': ctx['rand'].randint(1, 6)}}).get_json()
+        sessions.append(data['quiz_session'])
+    return [request_spec('POST', '/quizzes', {
+                'quiz_session': sessions[i % len(sessions)]})
+            for i in range(n)]
+
+
+# (name, prepare, most requests to send), routes that return
+# whole categories or tables are capped as each call scales with the table
+SCENARIOS = [
+    ('GET /categories', categories, None),
+    ('GET /questions?page', questions_page, None),
+    ('GET /questions?page&fields', questions_projected, None),
+    ('GET /questions?cursor', questions_cursor, None),
+    ('GET /categories/<id>/questions', category_questions, 20),
+    ('POST /questions (search)', search, None),
+    ('GET /questions/suggest', suggest, None),
+    ('POST /questions (add)', add_question, None),
+    ('GET /questions/duplicates', duplicate_questions, 5),
+    ('DELETE /questions/<id>', delete_question, None),
+    ('POST /questions/bulk', bulk_add_questions, 10),
+    ('GET /questions/export', export_questions, 3),
+    ('POST /quizzes (start)', quiz_start, 50),
+    ('POST /quizzes (next)', quiz_next, None),
+]
+
+
+# Returns the value below which "ratio" of the sorted values fall
+def percentile(values, ratio):
+    if not values:
+        return None
+    index = min(int(round(ratio * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summarize(latencies, errors, elapsed, queries, sizes=()):
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'mean_ms': sum(latencies) / count if count else None,
+        'throughput_rps': count / elapsed if elapsed else None,
+        'queries_per_request': queries / count if count else None,
+        'bytes_per_request': sum(sizes) / count if count else None
+    }
+
+
+# Sends the requests one at a time through the Flask test client
+def drive_client(app, counter, specs):
+    client = app.test_client()
+    latencies = []
+    sizes = []
+    errors = 0
+    queries = counter.count
+    started = time.perf_counter()
+    for method, path, body, content_type in specs:
+        begin = time.perf_counter()
+        res = client.open(path, method=method, data=body,
+                          content_type=content_type)
+        sizes.append(len(res.get_data()))
+        latencies.append((time.perf_counter() - begin) * 1000)
+        errors += res.status_code >= 400
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, errors, elapsed, counter.count - queries,
+                     sizes)
+
+
+# Sends the requests over HTTP from "threads" concurrent clients
+# to a threaded server running the app, accepting gzip like browsers do
+# so the bytes per request are the ones sent over the wire
+def drive_http(base_url, counter, specs, threads):
+    def send(spec):
+        method, path, body, content_type = spec
+        req = urlrequest.Request(base_url + path, data=body, method=method)
+        if content_type:
+            req.add_header('Content-Type', content_type)
+        req.add_header('Accept-Encoding', 'gzip')
+        begin = time.perf_counter()
+        try:
+            with urlrequest.urlopen(req) as res:
+                size = len(res.read())
+            failed = False
+        except urlerror.HTTPError as e:
+            size = len(e.read())
+            failed = True
+        return (time.perf_counter() - begin) * 1000, failed, size
+
+    queries = counter.count
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(send, specs))
+    elapsed = time.perf_counter() - started
+    return summarize([latency for latency, failed, size in results],
+                     sum(failed for latency, failed, size in results),
+                     elapsed, counter.count - queries,
+                     [size for latency, failed, size in results])
+
+
+# Frontend screens as the (method, path, body) requests they make on load
+VIEWS = [
+    ('question list', lambda ctx: [
+        ('GET', '/questions?page={}'.format(
+            ctx['rand'].randint(1, max(ctx['total'] // 10, 1))), None),
+        ('GET', '/categories/stats', None)]),
+    ('quiz start', lambda ctx: [
+        ('GET', '/categories', None),
+        ('POST', '/quizzes', {
+            'previous_questions': [],
+            'quiz_category': {'id': ctx['rand'].randint(1, 6)}})])
+]
+
+
+# Times loading every view "runs" times with one request per route sent
+# in sequence, then with a single POST /batch, through the test client or
+# over HTTP when "base_url" is given, the response cache is cleared before
+# each load so both ways do the same work
+# Returns the median milliseconds per view and way
+def measure_batches(app, ctx, runs, base_url=None):
+    client = app.test_client()
+
+    def send(method, path, body):
+        spec = request_spec(method, path, body)
+        if base_url is None:
+            client.open(path, method=method, data=spec[2],
+                        content_type=spec[3]).get_data()
+            return
+        req = urlrequest.Request(base_url + path, data=spec[2],
+                                 method=method)
+        if spec[3]:
+            req.add_header('Content-Type', spec[3])
+        with urlrequest.urlopen(req) as res:
+            res.read()
+
+    results = {}
+    for name, view in VIEWS:
+        timings = {'sequential_ms': [], 'batch_ms': []}
+        for _ in range(runs):
+            with app.app_context():
+                requests = view(ctx)
+            batch = {'requests': [{'method': method, 'path': path,
+                                   'body': body}
+                                  for method, path, body in requests]}
+            for way in timings:
+                app.extensions['response_cache'].backend.clear()
+                begin = time.perf_counter()
+                if way == 'batch_ms':
+                    send('POST', '/batch', batch)
+                else:
+                    for method, path, body in requests:
+                        send(method, path, body)
+                timings[way].append((time.perf_counter() - begin) * 1000)
+        results[name] = {way: statistics.median(values)
+                         for way, values in timings.items()}
+        results[name]['requests'] = len(requests)
+    return results
+
+
+# Runs the startup script "runs" times, returns the median of each step
+def measure_startup(runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', STARTUP_SCRIPT], cwd=BACKEND_DIR)
+        samples.append(json.loads(output.decode().splitlines()[-1]))
+    return {step: statistics.median(sample[step] for sample in samples)
+            for step in samples[0]}
+
+
+def start_server(app):
+    from werkzeug.serving import make_server
+    # One access log line per request would drown the report
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report):
+    if report.get('startup'):
+        print('\n[startup]')
+        for step, ms in report['startup'].items():
+            print(f'{step:34}{ms:10.2f}')
+    columns = ('requests', 'errors', 'p50_ms', 'p95_ms', 'p99_ms',
+               'throughput_rps', 'queries_per_request', 'bytes_per_request')
+    for driver, views in (report.get('batch') or {}).items():
+        print(f'\n[batch, {driver}]')
+        print('{:34}{:>10}{:>15}{:>10}'.format(
+            'view', 'requests', 'sequential_ms', 'batch_ms'))
+        for name, stats in views.items():
+            print('{:34}{:>10}{:>15.2f}{:>10.2f}'.format(
+                name, stats['requests'], stats['sequential_ms'],
+                stats['batch_ms']))
+    for driver, results in report['results'].items():
+        print(f'\n[{driver}]')
+        widths = [max(len(column) + 2, 10) for column in columns]
+        print('{:34}'.format('endpoint') + ''.join(
+            column.rjust(width) for column, width in zip(columns, widths)))
+        for name, stats in results.items():
+            print('{:34}'.format(name) + ''.join(
+                str('-' if stats.get(column) is None else
+                    round(stats[column], 2)).rjust(width)
+                for column, width in zip(columns, widths)))
+
+
+# Prints the latency change of every endpoint against a saved baseline
+# Returns the regressions as (driver, endpoint, metric, old, new)
+def compare(report, baseline, tolerance):
+    regressions = []
+    print(f"\nCompared to baseline of commit {baseline['meta'].get('commit')}:")
+    for step, new in (report.get('startup') or {}).items():
+        old = (baseline.get('startup') or {}).get(step)
+        if not old:
+            continue
+        change = (new - old) / old
+        flag = ''
+        if change > tolerance and new - old > NOISE_FLOOR_MS:
+            flag = '  REGRESSION'
+            regressions.append(('startup', step, 'median_ms', old, new))
+        print(f'  [startup] {step:33} median_ms '
+              f'{old:9.2f} -> {new:9.2f} ({change:+.1%}){flag}')
+    for driver, views in (report.get('batch') or {}).items():
+        for name, stats in views.items():
+            old = ((baseline.get('batch') or {}).get(driver, {})
+                   .get(name, {}).get('batch_ms'))
+            new = stats['batch_ms']
+            if not old:
+                continue
+            change = (new - old) / old
+            flag = ''
+            if change > tolerance and new - old > NOISE_FLOOR_MS:
+                flag = '  REGRESSION'
+                regressions.append(('batch', name, 'batch_ms', old, new))
+            print(f'  [batch, {driver}] {name:26} batch_ms '
+                  f'{old:9.2f} -> {new:9.2f} ({change:+.1%}){flag}')
+    for driver, results in report['results'].items():
+        for name, stats in results.items():
+            old_stats = baseline['results'].get(driver, {}).get(name)
+            if not old_stats:
+                continue
+            for metric in ('p50_ms', 'p95_ms'):
+                old, new = old_stats[metric], stats[metric]
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                flag = ''
+                if change > tolerance and new - old > NOISE_FLOOR_MS:
+                    flag = '  REGRESSION'
+                    regressions.append((driver, name, metric, old, new))
+                print(f'  [{driver}] {name:34} {metric} '
+                      f'{old:9.2f} -> {new:9.2f} ({change:+.1%}){flag}')
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks every route of the trivia API')
+    parser.add_argument(
+        '--database-url', default='sqlite:///benchmark.db',
+        help='database to seed and benchmark, use a throwaway one')
+    parser.add_argument('--questions', type=int, default=10000,
+                        help='size of the question corpus to seed')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per endpoint')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='concurrent clients of the HTTP load generator')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', action='append', default=[],
+                        help='only run endpoints containing this text')
+    parser.add_argument('--startup-runs', type=int, default=5,
+                        help='cold starts to time, 0 to skip them')
+    parser.add_argument('--batch-runs', type=int, default=20,
+                        help='page loads to time batched and sequential, '
+                             '0 to skip them')
+    parser.add_argument('--skip-http', action='store_true',
+                        help='only drive the Flask test client')
+    parser.add_argument('--no-response-cache', action='store_true',
+                        help='measure read endpoints without the cache')
+    parser.add_argument('--admission-control', action='store_true',
+                        help='keep the admission limits of the routes')
+    parser.add_argument('--save', help='write the results as JSON baseline')
+    parser.add_argument('--compare', help='baseline JSON to compare with')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The database is chosen before the app reads its settings
+    os.environ['DATABASE_URL'] = args.database_url
+    from sqlalchemy import event
+    from flaskr import create_app
+    from flaskr.caching import LRUBackend
+    from models import db
+    from fixtures import seed
+
+    app = create_app(None if args.admission_control else unlimited_config())
+    if args.no_response_cache:
+        app.extensions['response_cache'].backend = LRUBackend(0)
+    admission = app.extensions['admission']
+    counter = QueryCounter()
+    ctx = {'rand': random.Random(args.seed), 'client': app.test_client()}
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', counter)
+        print(f'Seeding {args.questions} questions...')
+        ctx['total'] = seed(args.questions, args.seed)
+        dialect = db.engine.dialect.name
+
+    scenarios = [scenario for scenario in SCENARIOS if not args.only
+                 or any(text in scenario[0] for text in args.only)]
+    drivers = ['client'] if args.skip_http else ['client', 'http']
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'database': dialect,
+            'questions': ctx['total'],
+            'requests': args.requests,
+            'threads': args.threads,
+            'response_cache': not args.no_response_cache,
+            'admission_control': args.admission_control
+        },
+        'results': {driver: {} for driver in drivers}
+    }
+    # Timed on the seeded database, which the child processes
+    # find through DATABASE_URL
+    if args.startup_runs > 0:
+        print('Timing startup...')
+        report['startup'] = measure_startup(args.startup_runs)
+
+    server, base_url = start_server(app) if 'http' in drivers else (None, None)
+    try:
+        for driver in drivers:
+            for name, prepare, cap in scenarios:
+                n = min(args.requests, cap or args.requests)
+                # Requests made while preparing aren't limited
+                limiters = admission.limiters
+                admission.limiters = {}
+                try:
+                    with app.app_context():
+                        specs = prepare(ctx, n)
+                finally:
+                    admission.limiters = limiters
+                # Requests made while preparing mustn't warm the cache
+                app.extensions['response_cache'].backend.clear()
+                if driver == 'client':
+                    stats = drive_client(app, counter, specs)
+                else:
+                    stats = drive_http(base_url, counter, specs, args.threads)
+                report['results'][driver][name] = stats
+        # Views load the same requests batched and not, whatever
+        # the admission limits
+        if args.batch_runs > 0:
+            print('Timing batched page loads...')
+            limiters = admission.limiters
+            admission.limiters = {}
+            try:
+                report['batch'] = {
+                    driver: measure_batches(
+                        app, ctx, args.batch_runs,
+                        base_url if driver == 'http' else None)
+                    for driver in drivers}
+            finally:
+                admission.limiters = limiters
+    finally:
+        if server:
+            server.shutdown()
+
+    print_report(report)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nSaved baseline to {args.save}')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
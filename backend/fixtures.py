@@ -0,0 +1,147 @@
+import os
+import random
+import re
+
+from sqlalchemy import func
+
+from models import Category, Question, db, migrate_db, category_registry, \
+    notify_question_change
+
+# Data of the trivia database as dumped by pg_dump
+TRIVIA_PSQL = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'trivia.psql')
+
+# Start of the data of a table in a dump, its rows follow one per line
+# with tab separated values until a line holding only \.
+COPY_RE = re.compile(r'^COPY (?:\w+\.)?(\w+) \(([^)]*)\) FROM stdin;$')
+COPY_ESCAPE_RE = re.compile(r'\\(.)')
+COPY_ESCAPES = {'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+                'v': '\v'}
+
+# Same categories as trivia.psql
+CATEGORIES = ['Science', 'Art', 'Geography', 'History',
+              'Entertainment', 'Sports']
+
+# Vocabulary the synthetic questions are made of, so that searches
+# and prefix lookups hit realistic numbers of rows
+SUBJECTS = ['river', 'painter', 'planet', 'empire', 'actor', 'team',
+            'element', 'mountain', 'composer', 'battle', 'novel', 'city',
+            'island', 'scientist', 'festival', 'athlete', 'language',
+            'ocean', 'queen', 'invention']
+QUALIFIERS = ['largest', 'oldest', 'first', 'most famous', 'smallest',
+              'last', 'fastest', 'tallest', 'richest', 'deepest']
+PLACES = ['Africa', 'Europe', 'Asia', 'the Americas', 'the 19th century',
+          'ancient Rome', 'the Pacific', 'Hollywood', 'the Olympics',
+          'the Renaissance']
+ANSWERS = ['Nile', 'Picasso', 'Jupiter', 'Ottoman', 'Chaplin', 'Brazil',
+           'Hydrogen', 'Everest', 'Mozart', 'Hastings', 'Ulysses', 'Paris',
+           'Greenland', 'Curie', 'Carnival', 'Bolt', 'Latin', 'Atlantic',
+           'Victoria', 'Telephone']
+
+INSERT_BATCH_SIZE = 10000
+
+
+# A value of a COPY row, None for \N (NULL)
+def _copy_value(value):
+    if value == '\\N':
+        return None
+    return COPY_ESCAPE_RE.sub(
+        lambda match: COPY_ESCAPES.get(match.group(1), match.group(1)), value)
+
+
+# Reads the rows of every COPY block of a pg_dump file into
+# {table: [row dicts]}, values are the strings of the dump or None
+def parse_psql(path=TRIVIA_PSQL):
+    tables = {}
+    rows = None
+    with open(path, encoding='utf-8') as dump:
+        for line in dump:
+            line = line.rstrip('\r\n')
+            if rows is None:
+                match = COPY_RE.match(line)
+                if match:
+                    columns = [column.strip()
+                               for column in match.group(2).split(',')]
+                    rows = tables.setdefault(match.group(1), [])
+            elif line == '\\.':
+                rows = None
+            else:
+                rows.append(dict(zip(
+                    columns, map(_copy_value, line.split('\t')))))
+    return tables
+
+
+# Inserts rows into a table in batched executemany inserts
+def _insert(table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+
+
+# Loads the categories and questions of a pg_dump file (trivia.psql by
+# default) into the bound database, whose schema must be up to date
+# Values are converted to the types of the model columns so the same
+# rows load into SQLite, and Postgres sequences continue after the
+# loaded IDs
+# Returns the number of rows loaded per table
+def load_psql(path=TRIVIA_PSQL):
+    tables = parse_psql(path)
+    loaded = {}
+    # Categories first, questions reference them
+    for model in (Category, Question):
+        table = model.__table__
+        rows = [{key: None if value is None
+                 else table.c[key].type.python_type(value)
+                 for key, value in row.items()}
+                for row in tables.get(table.name, [])]
+        _insert(table, rows)
+        if rows and db.engine.dialect.name == 'postgresql':
+            db.session.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', "
+                f"'id'), (SELECT max(id) FROM {table.name}))")
+        loaded[table.name] = len(rows)
+    db.session.commit()
+    # Rows were written behind the models' back
+    category_registry.invalidate()
+    notify_question_change('reset', [])
+    return loaded
+
+
+# Yields "count" synthetic question rows, the same seed yields the same rows
+def synthetic_questions(count, seed=0):
+    rand = random.Random(seed)
+    for _ in range(count):
+        subject = rand.randrange(len(SUBJECTS))
+        yield {
+            'question': 'What is the {} {} of {}?'.format(
+                rand.choice(QUALIFIERS), SUBJECTS[subject],
+                rand.choice(PLACES)),
+            'answer': ANSWERS[subject],
+            'category': rand.randint(1, len(CATEGORIES)),
+            'difficulty': rand.randint(1, 5)
+        }
+
+
+# Seeds the categories and tops the questions table up to "count" rows,
+# in batched executemany inserts, after bringing the schema up to date
+# as the init-db command does
+# Returns the number of questions in the table
+def seed(count, seed=0):
+    migrate_db()
+    if not Category.query.count():
+        db.session.execute(Category.__table__.insert(), [
+            {'id': cat_id, 'type': cat_type}
+            for cat_id, cat_type in enumerate(CATEGORIES, start=1)])
+        db.session.commit()
+
+    existing = db.session.query(func.count(Question.id)).scalar()
+    _insert(Question.__table__,
+            synthetic_questions(max(count - existing, 0), seed))
+    db.session.commit()
+    notify_question_change('reset', [])
+    return db.session.query(func.count(Question.id)).scalar()
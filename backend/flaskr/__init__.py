@@ -3,44 +3,258 @@
 # are marked as "unused variable" which I find really annoying
 # pylint: disable=unused-variable
 
-import os
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
+import click
+from flask import Flask, request, abort, g, Response, stream_with_context
 from flask_cors import CORS
-import random
 from werkzeug.exceptions import NotFound
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-from models import setup_db, Question, Category, db
+from models import setup_db, Question, db, category_registry, \
+    question_counts, pool_status, config_value, migrate_db
+from .quiz import QuizSessionStore
+from .answers import answer_index
+from .leaderboard import Leaderboard, parse_result
+from .pagination import keyset_page
+from .search import full_text_search
+from .suggest import suggestion_index, SUGGESTIONS_PER_PREFIX
+from .bulk import parse_question, import_questions, export_questions, \
+    parse_ids, parse_question_update, delete_questions, update_questions, \
+    MAX_BATCH_WRITE, DIFFICULTIES
+from .admission import AdmissionControl, retry_after_headers
+from .batch import parse_batch, run_batch
+from .caching import ResponseCache, LRUBackend, redis_backend
+from .duplicates import duplicate_index, DuplicateQuestion
+from .compression import ResponseCompression
+from .metrics import RequestMetrics
+from .services import questions_page, category_questions, get_question, \
+    parse_fields, question_categories
+from .serialization import jsonify
 
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+QUIZ_SESSION_TTL = 3600
+BULK_BATCH_SIZE = 1000
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TIMEOUT = 60
+SLOW_QUERY_MS = 500
+QUIZ_MAX_SESSIONS = 10000
+LEADERBOARD_SIZE = 100
+LEADERBOARD_PAGE_SIZE = 10
+COMPRESSION_MIN_SIZE = 500
+# Admission limits of the expensive routes: requests handled at once,
+# requests per second and burst per client, rates are off by default
+# since behind a reverse proxy every client has the proxy's address
+# unless TRUSTED_PROXIES is set
+ADMISSION_LIMITS = {
+    'play_quiz': {'concurrency': 10, 'rate': 0, 'burst': 20},
+    'search_questions': {'concurrency': 5, 'rate': 0, 'burst': 10}
+}
+ADMISSION_QUEUE_TIMEOUT = 0.5
+# What adding a question much like existing ones does: "warn" lists them
+# in the response, "reject" refuses the question and "off" doesn't look
+DUPLICATE_MODE = 'warn'
+MAX_DUPLICATE_GROUPS = 100
+
+
+# Whether a flag argument of the request is on, e.g. ?include_total=true
+def flag_arg(name, default=False):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true')
 
 
 def create_app(test_config=None):
     # Create and configure the app
     app = Flask(__name__)
+    # Settings given here (e.g. by the tests) win over the environment,
+    # see models.engine_options for the database ones
+    if test_config is not None:
+        app.config.update(test_config)
+    # Nothing connects to the database until the first query,
+    # the schema is created and upgraded by the init-db command
     setup_db(app)
 
+    # Behind TRUSTED_PROXIES reverse proxies (e.g. nginx in front of
+    # gunicorn) the client address and scheme are read from their
+    # X-Forwarded-For and X-Forwarded-Proto headers
+    trusted_proxies = config_value(app.config, 'TRUSTED_PROXIES', 0, int)
+    if trusted_proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies,
+                                x_proto=trusted_proxies)
+
+    # Command that creates or upgrades the database schema by running
+    # the migrations: flask init-db
+    @app.cli.command('init-db')
+    @click.option('--revision', default='head',
+                  help='Schema revision to upgrade to.')
+    def init_db(revision):
+        migrate_db(revision)
+        click.echo('Upgraded the database schema to {}'.format(revision))
+
+    # Command that loads the questions of trivia.psql, or synthetic ones,
+    # into a database without them, e.g. a local SQLite one: flask seed-db
+    @app.cli.command('seed-db')
+    @click.option('--questions', type=int,
+                  help='Seed this many synthetic questions instead.')
+    def seed_db(questions):
+        # The fixtures are only needed by this command
+        from fixtures import load_psql, seed
+        if questions:
+            click.echo('Seeded {} questions'.format(seed(questions)))
+        else:
+            loaded = load_psql()
+            click.echo('Seeded {} categories and {} questions'.format(
+                loaded['categories'], loaded['questions']))
+
     # Setup CORS to accept requests from any origin (*)
     cors = CORS(app, origins=['*'])
 
+    # Caches read-only responses in-process, or in Redis when
+    # RESPONSE_CACHE_REDIS_URL is set, where the writes of every process
+    # bump the shared generation
+    redis_url = config_value(app.config, 'RESPONSE_CACHE_REDIS_URL')
+    if redis_url:
+        cache_backend = redis_backend(redis_url)
+    else:
+        cache_backend = LRUBackend(RESPONSE_CACHE_SIZE)
+    response_cache = ResponseCache(cache_backend, RESPONSE_CACHE_TIMEOUT)
+    app.extensions['response_cache'] = response_cache
+
+    # Server-held state of the quizzes being played, which draw from
+    # the in-memory (category, difficulty) buckets of question IDs
+    quiz_sessions = QuizSessionStore(QUIZ_SESSION_TTL, QUIZ_MAX_SESSIONS)
+
+    # Quiz results are written behind in batches and the leaderboard is
+    # served from a periodically materialized top of the players
+    leaderboard = Leaderboard(
+        app,
+        size=config_value(app.config, 'LEADERBOARD_SIZE',
+                          LEADERBOARD_SIZE, int),
+        batch_size=config_value(app.config, 'LEADERBOARD_BATCH_SIZE',
+                                500, int),
+        flush_interval=config_value(app.config, 'LEADERBOARD_FLUSH_INTERVAL',
+                                    1.0, float),
+        refresh_interval=config_value(
+            app.config, 'LEADERBOARD_REFRESH_INTERVAL', 10.0, float))
+    app.extensions['leaderboard'] = leaderboard
+
+    # Routes that can pile up on the database are limited per route and
+    # per client, e.g. PLAY_QUIZ_CONCURRENCY, PLAY_QUIZ_RATE and
+    # PLAY_QUIZ_BURST override the limits of play_quiz (0 for no limit)
+    admission = AdmissionControl()
+    queue_timeout = config_value(app.config, 'ADMISSION_QUEUE_TIMEOUT',
+                                 ADMISSION_QUEUE_TIMEOUT, float)
+    for name, limits in ADMISSION_LIMITS.items():
+        admission.configure(
+            name,
+            concurrency=config_value(app.config, name.upper() + '_CONCURRENCY',
+                                     limits['concurrency'], int),
+            rate=config_value(app.config, name.upper() + '_RATE',
+                              limits['rate'], float),
+            burst=config_value(app.config, name.upper() + '_BURST',
+                               limits['burst'], int),
+            queue_timeout=queue_timeout)
+    app.extensions['admission'] = admission
+
+    # Records SQL queries and handler time of every request,
+    # reported in a Server-Timing header and aggregated on /metrics
+    metrics = RequestMetrics(config_value(
+        app.config, 'SLOW_QUERY_MS', SLOW_QUERY_MS, float))
+    metrics.init_app(app)
+    metrics.add_metric(
+        'trivia_category_cache_hits_total', 'counter',
+        'Category registry lookups served from memory',
+        lambda: category_registry.hits)
+    metrics.add_metric(
+        'trivia_category_cache_misses_total', 'counter',
+        'Category registry lookups that loaded the categories',
+        lambda: category_registry.misses)
+    metrics.add_metric(
+        'trivia_response_cache_hits_total', 'counter',
+        'Read requests served from the response cache',
+        lambda: response_cache.hits)
+    metrics.add_metric(
+        'trivia_response_cache_misses_total', 'counter',
+        'Read requests that ran their handler',
+        lambda: response_cache.misses)
+    metrics.add_metric(
+        'trivia_quiz_sessions', 'gauge', 'Quiz sessions being played',
+        lambda: len(quiz_sessions))
+    metrics.add_metric(
+        'trivia_quiz_results_pending', 'gauge',
+        'Quiz results waiting to be written',
+        lambda: len(leaderboard.pending))
+    metrics.add_metric(
+        'trivia_quiz_results_written_total', 'counter',
+        'Quiz results written to the database',
+        lambda: leaderboard.written)
+    metrics.add_metric(
+        'trivia_admission_in_flight', 'gauge',
+        'Requests being handled per limited route',
+        lambda: admission.samples('in_flight'))
+    metrics.add_metric(
+        'trivia_admission_waiting', 'gauge',
+        'Requests waiting for a slot per limited route',
+        lambda: admission.samples('waiting'))
+    metrics.add_metric(
+        'trivia_admission_admitted_total', 'counter',
+        'Requests admitted per limited route',
+        lambda: admission.samples('admitted'))
+    metrics.add_metric(
+        'trivia_admission_rejected_total', 'counter',
+        'Requests refused per limited route and reason (rate or concurrency)',
+        lambda: admission.rejected_samples())
+    metrics.add_metric(
+        'trivia_db_pool_connections', 'gauge',
+        'Database pool connections per bind and state',
+        lambda: [({'bind': bind, 'state': state}, count)
+                 for bind, states in pool_status(app).items()
+                 for state, count in states.items()])
+
+    # Compresses responses of at least COMPRESSION_MIN_SIZE bytes with the
+    # encoding the client accepts (brotli when installed, else gzip)
+    compression = ResponseCompression(config_value(
+        app.config, 'COMPRESSION_MIN_SIZE', COMPRESSION_MIN_SIZE, int))
+    compression.init_app(app)
+    metrics.add_metric(
+        'trivia_compressed_responses_total', 'counter',
+        'Responses sent compressed',
+        lambda: compression.compressed)
+    metrics.add_metric(
+        'trivia_compression_saved_bytes_total', 'counter',
+        'Bytes saved by compressing responses',
+        lambda: compression.saved_bytes)
+
+    # The typeahead index is built before the first request is served
+    # rather than when the app is created, which doesn't touch the database
+    @app.before_first_request
+    def build_suggestion_index():
+        suggestion_index.build()
+
     # Enumerates accepted headers and methods
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Allow-Control-Headers',
                              'Content-Type,Authorization,true')
         response.headers.add('Access-Allow-Control-Methods',
-                             'GET,POST,DELETE,OPTIONS')
+                             'GET,POST,PATCH,DELETE,OPTIONS')
         return response
 
+    # GET route that returns the request and database metrics
+    # in the Prometheus text format
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(metrics.render(),
+                        mimetype='text/plain; version=0.0.4')
+
     # GET route that queries, formats and returns all categories
     @app.route('/categories', methods=['GET'])
+    @response_cache.cached
     def get_categories():
         try:
-            rawCats = Category.query.all()
-            cats = {}
-            for rawCat in rawCats:
-                cat = rawCat.format()
-                cats[cat['id']] = cat['type']
+            # Categories are served from the in-process registry
+            cats = category_registry.all()
 
             return jsonify({
                 'success': True,
@@ -50,41 +264,63 @@ def create_app(test_config=None):
         except Exception:
             abort(400)
 
+    # GET route that returns the number of questions of every category,
+    # how many there are of each difficulty and when one was last modified,
+    # served from the maintained question summary instead of counting
+    @app.route('/categories/stats', methods=['GET'])
+    @response_cache.cached
+    def get_category_stats():
+        stats = question_counts.stats()
+        cats = {}
+        for cat_id, cat_type in category_registry.all().items():
+            cat_stats = stats.get(cat_id, {})
+            # Every difficulty is listed, the ones without questions as 0
+            difficulties = dict.fromkeys(DIFFICULTIES, 0)
+            difficulties.update(cat_stats.get('difficulties', {}))
+            last_modified = cat_stats.get('last_modified')
+            cats[cat_id] = {
+                'type': cat_type,
+                'total_questions': cat_stats.get('total_questions', 0),
+                'difficulties': difficulties,
+                'last_modified': last_modified and last_modified.isoformat()
+            }
+        return jsonify({
+            'success': True,
+            'categories': cats,
+            'total_questions': question_counts.total()
+        })
+
     # GET route to retrieve paginated questions and categories
     # as well as total number of questions
+    # "fields" selects the question keys returned (e.g. ?fields=question)
+    # and ?include_categories=false leaves the categories out
     @app.route('/questions', methods=['GET'])
+    @response_cache.cached
     def get_questions():
         try:
+            # The "cursor" argument opts into keyset pagination
+            if request.args.get('cursor') is not None:
+                return get_questions_by_cursor()
+
             # get current page, defaults to 1 if not present
             page = request.args.get('page', default=1, type=int)
+            fields = parse_fields(request.args.get('fields'))
 
-            # Query one page of questions then format them
-            # and extract total number of questions
-            quests_query = Question.query.order_by(
-                Question.category.asc()).paginate(page, QUESTIONS_PER_PAGE)
-            total_quests = quests_query.total
-            rawQuests = quests_query.items
-            quests = [rawQuest.format() for rawQuest in rawQuests]
-
-            # Query and format all categories
-            rawCats = Category.query.all()
-            cats = {}
-            for rawCat in rawCats:
-                cat = rawCat.format()
-                cats[cat['id']] = cat['type']
-
-            current_cats = []
-            for quest in quests:
-                cat = quest['category']
-                if cat not in current_cats:
-                    current_cats.append(cat)
-            return jsonify({
+            # Query the selected columns of one page of questions straight
+            # into dicts and get the maintained total number of questions
+            quests = questions_page(page, QUESTIONS_PER_PAGE, fields)
+            total_quests = question_counts.total()
+
+            body = {
                 'success': True,
                 'questions': quests,
                 'total_questions': total_quests,
-                'current_category': current_cats,
-                'categories': cats
-            })
+                'current_category': question_categories(quests)
+            }
+            # Get all categories from the in-process registry
+            if flag_arg('include_categories', True):
+                body['categories'] = category_registry.all()
+            return jsonify(body)
         # In case of page being out of range
         except NotFound:
             abort(404)
@@ -92,19 +328,88 @@ def create_app(test_config=None):
         except Exception:
             abort(400)
 
+    # GET function that pages questions by their (category, id) keyset,
+    # which costs the same on every page unlike OFFSET pagination
+    def get_questions_by_cursor():
+        cursor = request.args.get('cursor')
+        # Page size is chosen by the caller but capped
+        limit = request.args.get(
+            'limit', default=QUESTIONS_PER_PAGE, type=int)
+        if limit < 1:
+            abort(400)
+        limit = min(limit, MAX_QUESTIONS_PER_PAGE)
+        fields = parse_fields(request.args.get('fields'))
+
+        quests, next_cursor, prev_cursor = keyset_page(cursor, limit, fields)
+        # The total is opt-in, read from the maintained question summary
+        total_quests = None
+        if flag_arg('include_total'):
+            total_quests = question_counts.total()
+
+        body = {
+            'success': True,
+            'questions': quests,
+            'total_questions': total_quests,
+            'current_category': question_categories(quests),
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor
+        }
+        if flag_arg('include_categories', True):
+            body['categories'] = category_registry.all()
+        return jsonify(body)
+
+    # GET route that suggests questions for the text typed so far in the
+    # search box, from the in-memory prefix index of question and answer
+    # words, returns the ID and text of at most "limit" questions
+    @app.route('/questions/suggest', methods=['GET'])
+    def suggest_questions():
+        prefix = request.args.get('prefix')
+        limit = request.args.get(
+            'limit', default=SUGGESTIONS_PER_PREFIX, type=int)
+        # In case of a missing prefix returns 400 (bad request)
+        if prefix is None or limit < 1:
+            abort(400)
+        return jsonify({
+            'success': True,
+            'prefix': prefix,
+            'suggestions': suggestion_index.suggest(prefix, limit)
+        })
+
+    # GET route that reports the groups of near-duplicate questions of the
+    # whole table found through the similarity index, largest first,
+    # "complete" is false when the report was cut short on a large table
+    @app.route('/questions/duplicates', methods=['GET'])
+    @response_cache.cached
+    def get_duplicate_questions():
+        limit = request.args.get(
+            'limit', default=MAX_DUPLICATE_GROUPS, type=int)
+        if limit < 1:
+            abort(400)
+        groups, complete = duplicate_index.groups()
+        return jsonify({
+            'success': True,
+            'groups': groups[:min(limit, MAX_DUPLICATE_GROUPS)],
+            'total_groups': len(groups),
+            'duplicate_questions': sum(
+                len(group['questions']) - 1 for group in groups),
+            'complete': complete
+        })
+
     # DELETE route that accepts a question ID in the URL
-    # retrieves and deletes said question
+    # and deletes said question
     @app.route('/questions/<quest_id>', methods=['DELETE'])
     def delete_question(quest_id):
         try:
-            # Queries question by ID then uses delete function
-            Question.query.get(quest_id).delete()
+            # Deletes the question with a single DELETE statement
+            deleted, missing = delete_questions([int(quest_id)])
+            if missing:
+                raise LookupError
             return jsonify({
                 'success': True,
                 'question': quest_id
             })
         # If question does not exist we rollback
-        except (NameError, AttributeError):
+        except LookupError:
             Question.rollback(Question)
             abort(404)
         # If question ID is not valid return 400 (bad request) and rollback
@@ -112,6 +417,48 @@ def create_app(test_config=None):
             Question.rollback(Question)
             abort(400)
 
+    # DELETE route that deletes the questions of a JSON list of IDs
+    # ({"ids": [...]}) in one statement and one transaction,
+    # IDs without a question are reported as missing
+    @app.route('/questions', methods=['DELETE'])
+    def delete_many_questions():
+        try:
+            quest_ids = parse_ids(request.get_json()['ids'])
+            deleted, missing = delete_questions(quest_ids)
+            return jsonify({
+                'success': True,
+                'deleted': deleted,
+                'missing': missing
+            })
+        # On malformed requests rollsback and returns 400 (bad request)
+        except Exception:
+            Question.rollback(Question)
+            abort(400)
+
+    # PATCH route that applies partial updates to questions
+    # ({"questions": [{"id": 1, "difficulty": 2}, ...]}) with a bulk update
+    # in one transaction, an invalid update rejects the whole request
+    # and IDs without a question are reported as missing
+    @app.route('/questions', methods=['PATCH'])
+    def update_many_questions():
+        try:
+            updates = request.get_json()['questions']
+            if not isinstance(updates, list) or not updates:
+                abort(400)
+            if len(updates) > MAX_BATCH_WRITE:
+                abort(400)
+            updated, missing = update_questions(
+                [parse_question_update(update) for update in updates])
+            return jsonify({
+                'success': True,
+                'updated': updated,
+                'missing': missing
+            })
+        # On malformed requests rollsback and returns 400 (bad request)
+        except Exception:
+            Question.rollback(Question)
+            abort(400)
+
     # POST route handles post requests to /questions
     # Contains 2 functions, as shown below
     @app.route('/questions', methods=['POST'])
@@ -132,7 +479,15 @@ def create_app(test_config=None):
         try:
             # Extract JSON data from request,
             # create question object then insert it into the DB
-            data = request.get_json()
+            data = parse_question(request.get_json())
+            # Looks up questions much like it in the similarity index,
+            # when duplicates are rejected returns 409 (conflict)
+            duplicates = []
+            mode = config_value(app.config, 'DUPLICATE_MODE', DUPLICATE_MODE)
+            if mode != 'off':
+                duplicates = duplicate_index.find(data['question'])
+            if duplicates and mode == 'reject':
+                raise DuplicateQuestion(duplicates)
             question = Question(
               question=data['question'],
               answer=data['answer'],
@@ -142,8 +497,11 @@ def create_app(test_config=None):
             question.insert()
             return jsonify({
                 'success': True,
-                'question': question.format()
+                'question': question.format(),
+                'duplicates': duplicates
             })
+        except DuplicateQuestion:
+            raise
         # On malformed requests,
         # rollsback and returns 400 (bad request) response
         except Exception:
@@ -152,51 +510,87 @@ def create_app(test_config=None):
 
     # POST function that searches questions
     # using a JSON searchTerm sent with the request
+    @admission.limited('search_questions')
     def search_questions():
         try:
-            searchTerm = request.get_json()['searchTerm']
-            # Queries questions that contain the search term
-            # case insensitive via ilike()
-            rawResultQuests = Question.query.filter(
-                Question.question.ilike(f"%{searchTerm}%"))
-            # Formats the questions
-            resultQuests = [rRQuest.format() for rRQuest in rawResultQuests]
-            # Gets total_questions count
-            total_quests = Question.query.count()
-
-            current_cats = []
-            for quest in resultQuests:
-                cat = quest['category']
-                if cat not in current_cats:
-                    current_cats.append(cat)
+            data = request.get_json()
+            searchTerm = data['searchTerm']
+            # Answers are only searched when asked for
+            searchAnswers = bool(data.get('searchAnswers', False))
+            # Results are paginated, with a caller-chosen but capped limit
+            page = int(data.get('page', 1))
+            limit = min(int(data.get('limit', QUESTIONS_PER_PAGE)),
+                        MAX_QUESTIONS_PER_PAGE)
+            if page < 1 or limit < 1:
+                abort(400)
+            # "fields" of the URL selects the question keys returned
+            fields = parse_fields(request.args.get('fields'))
+            # Queries one page of ranked questions through the
+            # full-text search index along with the number of matches
+            total_results, resultQuests = full_text_search(
+                searchTerm, searchAnswers, (page - 1) * limit, limit,
+                fields)
+            # Gets the maintained total_questions count
+            total_quests = question_counts.total()
 
             return jsonify({
                 'success': True,
                 'questions': resultQuests,
                 'total_questions': total_quests,
-                'current_category': current_cats
+                'total_results': total_results,
+                'page': page,
+                'current_category': question_categories(resultQuests)
             })
         # In case of a malformed request we abort with status 400 (bad request)
         except Exception:
             abort(400)
 
+    # POST route that imports questions from a JSON Lines body
+    # (one question object per line), the body is read as a stream and
+    # inserted in batches, invalid lines are reported instead of inserted
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulk_add_questions():
+        try:
+            inserted, total_errors, errors = import_questions(
+                request.stream, BULK_BATCH_SIZE)
+            return jsonify({
+                'success': True,
+                'inserted': inserted,
+                'total_errors': total_errors,
+                'errors': errors
+            })
+        # On a broken stream rollsback and returns 400 (bad request)
+        except Exception:
+            Question.rollback(Question)
+            abort(400)
+
+    # GET route that streams all questions as JSON Lines
+    @app.route('/questions/export', methods=['GET'])
+    def export_all_questions():
+        return Response(
+            stream_with_context(export_questions(BULK_BATCH_SIZE)),
+            mimetype='application/x-ndjson')
+
     # GET route that takes category id (cat_id) and
     # returns all questions that fall into that category
     @app.route('/categories/<cat_id>/questions', methods=['GET'])
+    @response_cache.cached
     def get_questions_by_category(cat_id):
         try:
-            if not Category.query.get(cat_id):
+            if not category_registry.exists(cat_id):
                 raise KeyError
-            # Retrieve questions that have a category id
-            # equal to cat_id and formats them
-            rawCatQuests = Question.query.filter(Question.category == cat_id)
-            catQuests = [rCQuest.format() for rCQuest in rawCatQuests]
-            # gets total_questions count
-            total_quests = Question.query.count()
+            # "fields" selects the question keys returned
+            fields = parse_fields(request.args.get('fields'))
+            # Retrieve the formatted questions that have
+            # a category id equal to cat_id
+            catQuests = category_questions(cat_id, fields)
+            # gets the maintained total_questions count
+            total_quests = question_counts.total()
             return jsonify({
                 'success': True,
                 'questions': catQuests,
                 'total_questions': total_quests,
+                'total_results': len(catQuests),
                 'current_category': cat_id
             })
         # If category does not exist returns 404 (not found)
@@ -207,42 +601,154 @@ def create_app(test_config=None):
             abort(400)
 
     # POST route that takes previous questions (if any)
-    # and quiz category (or 0 for all categories) and
-    # returns a random question of that category that was not asked before
+    # and quiz category (or 0 for all categories), optionally several
+    # categories, a difficulty range and adaptive mode, and returns
+    # a random question of those that was not asked before
     @app.route('/quizzes', methods=['POST'])
+    @admission.limited('play_quiz')
     def play_quiz():
         try:
-            # Gets previous questions' IDs and the quiz category
             data = request.get_json()
-            prevQuests_id = data['previous_questions']
-            quizCat = data['quiz_category']
-            # When selecting "ALL" the value 0 is sent,
-            # here we handle this condition
-            if quizCat['id'] == 0:
-                rawCatQuests = Question.query.all()
-            else:
-                rawCatQuests = Question.query.filter(
-                    Question.category == quizCat['id'])
-            # Formats questions of that category and extracts
-            # the questions that were not asked before
-            catQuests = [rCQuest.format() for rCQuest in rawCatQuests]
-            quizQuest = [catQuest for catQuest in catQuests
-                         if catQuest['id'] not in prevQuests_id]
+            # The first call starts a quiz session (sending a null
+            # quiz_session), later calls send back its ID and draw the
+            # next question of the session, clients that only send the
+            # previous questions are served without one
+            session = quiz_sessions.play(data)
             # Here randQuizQuest is defaulted to None in the case
-            # of there being no more questions in that category to ask
+            # of there being no more questions in that category to ask,
+            # IDs of questions deleted by other processes are skipped
             randQuizQuest = None
-            # If there are questions that were not asked yet,
-            # select a random question of that list
-            if quizQuest:
-                randQuizQuest = random.choice(quizQuest)
+            quest_id = session.draw()
+            while quest_id is not None:
+                randQuizQuest = get_question(quest_id)
+                if randQuizQuest:
+                    break
+                quest_id = session.draw()
+            # A finished quiz keeps its session until its result is posted
+            # to /quizzes/results or it expires
+            # Clients checking answers with /quizzes/answer
+            # don't need to be sent the answer
+            if randQuizQuest is not None and data.get('hide_answer'):
+                del randQuizQuest['answer']
             return jsonify({
                 'success': True,
-                'question': randQuizQuest
+                'question': randQuizQuest,
+                'quiz_session': session.id,
+                'remaining_questions': session.remaining
             })
         # In case of a malformed request returns 400 (bad request)
         except Exception:
             abort(400)
 
+    # POST route that checks the answer given to a quiz question against
+    # its normalized answer (case, punctuation and articles don't matter,
+    # a few typos are forgiven unless "fuzzy" is false) and returns the
+    # expected answer, the answer of the question just drawn in a quiz
+    # session counts for its score and adaptive difficulty
+    @app.route('/quizzes/answer', methods=['POST'])
+    def check_answer():
+        try:
+            data = request.get_json()
+            quest_id = int(data['question_id'])
+            if not isinstance(data['answer'], str):
+                abort(400)
+            # A quiz_session is an ID string, or left out
+            if not isinstance(data.get('quiz_session') or '', str):
+                abort(400)
+            result = answer_index.check(
+                quest_id, data['answer'], bool(data.get('fuzzy', True)))
+        # In case of a malformed request returns 400 (bad request)
+        except Exception:
+            abort(400)
+        # If question does not exist returns 404 (not found)
+        if result is None:
+            abort(404)
+        correct, answer = result
+
+        score = None
+        if data.get('quiz_session'):
+            session = quiz_sessions.get(data['quiz_session'])
+            if session is not None:
+                session.record_answer(quest_id, correct)
+                score = session.score
+        return jsonify({
+            'success': True,
+            'question_id': quest_id,
+            'correct': correct,
+            'answer': answer,
+            'score': score
+        })
+
+    # POST route that records the final score of a quiz played in a
+    # quiz session for the leaderboard
+    @app.route('/quizzes/results', methods=['POST'])
+    def post_quiz_result():
+        data = request.get_json()
+        try:
+            # Only quiz sessions are scored, never scores of the client
+            if not isinstance(data.get('quiz_session'), str):
+                abort(400)
+            session = quiz_sessions.get(data['quiz_session'])
+            # If the quiz session expired returns 404 (not found)
+            if session is None:
+                abort(404)
+            result = parse_result(data, session)
+        # In case of a malformed request returns 400 (bad request)
+        except (AttributeError, ValueError):
+            abort(400)
+
+        # In case too many results wait to be written
+        # returns 503 (service unavailable)
+        if not leaderboard.record(result):
+            abort(503)
+        # A quiz session is scored only once
+        quiz_sessions.discard(session.id)
+        # The result is written behind, so it is accepted not created yet
+        return jsonify({
+            'success': True,
+            'result': result
+        }), 202
+
+    # GET route that returns the top players by total score,
+    # of all quizzes or of the quizzes of one category
+    @app.route('/leaderboard', methods=['GET'])
+    def get_leaderboard():
+        cat_id = request.args.get('category', default=0, type=int)
+        limit = request.args.get(
+            'limit', default=LEADERBOARD_PAGE_SIZE, type=int)
+        if limit < 1:
+            abort(400)
+        # If category does not exist returns 404 (not found)
+        if cat_id and not category_registry.exists(cat_id):
+            abort(404)
+
+        entries, refreshed_at = leaderboard.top(cat_id, limit)
+        return jsonify({
+            'success': True,
+            'category': cat_id,
+            'leaderboard': entries,
+            'refreshed_at': refreshed_at and refreshed_at.isoformat()
+        })
+
+    # POST route that runs a JSON list of read requests to the other routes
+    # (GET requests, searches and quiz requests) in one round trip, in this
+    # request's app context and database transaction, identical GET requests
+    # run once and the categories map is sent once for all of them
+    @app.route('/batch', methods=['POST'])
+    def batch():
+        try:
+            subrequests = parse_batch(request.get_json())
+        # In case of a malformed batch returns 400 (bad request)
+        except ValueError:
+            abort(400)
+        # Every sub-request reads through the same transaction,
+        # on Postgres a snapshot of the database when it starts
+        g.read_only = True
+        if db.engine.dialect.name == 'postgresql':
+            db.session.connection(
+                execution_options={'isolation_level': 'REPEATABLE READ'})
+        return jsonify(run_batch(subrequests, request.remote_addr))
+
     # Error handler for status 400 (bad request)
     @app.errorhandler(400)
     def bad_request(e):
@@ -267,6 +773,16 @@ def create_app(test_config=None):
             'message': 'Method Not Allowed'
         }), 405
 
+    # Error handler for status 409 (conflict), which lists the
+    # existing questions a rejected question duplicates
+    @app.errorhandler(409)
+    def conflict(e):
+        return jsonify({
+            'success': False,
+            'message': 'Conflict',
+            'duplicates': getattr(e, 'duplicates', [])
+        }), 409
+
     # Error handler for status 422 (unprocessable entity)
     @app.errorhandler(422)
     def unprocessable_entity(e):
@@ -275,6 +791,22 @@ def create_app(test_config=None):
             'message': 'Unprocessable Entity'
         }), 422
 
+    # Error handler for status 429 (too many requests)
+    @app.errorhandler(429)
+    def too_many_requests(e):
+        return jsonify({
+            'success': False,
+            'message': 'Too Many Requests'
+        }), 429, retry_after_headers(e)
+
+    # Error handler for status 503 (service unavailable)
+    @app.errorhandler(503)
+    def service_unavailable(e):
+        return jsonify({
+            'success': False,
+            'message': 'Service Unavailable'
+        }), 503, retry_after_headers(e)
+
     # Error handler for status 500 (internal server error)
     @app.errorhandler(500)
     def internal_error(e):
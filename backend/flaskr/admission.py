@@ -0,0 +1,166 @@
+import functools
+import math
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from flask import request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+
+
+# Raised when a client sent more requests than its rate allows
+class RateLimited(TooManyRequests):
+    def __init__(self, retry_after):
+        super().__init__()
+        self.retry_after = retry_after
+
+
+# Raised when a route is at its concurrency limit
+# and no slot freed up within the queue timeout
+class Overloaded(ServiceUnavailable):
+    def __init__(self, retry_after):
+        super().__init__()
+        self.retry_after = retry_after
+
+
+# Retry-After header of a RateLimited or Overloaded error,
+# none for other errors
+def retry_after_headers(error):
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is None:
+        return {}
+    return {'Retry-After': str(max(int(math.ceil(retry_after)), 1))}
+
+
+# Allows "rate" requests per second on average and bursts of up to
+# "burst" requests, tokens are refilled lazily when taking one
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    # Takes a token, returns 0 on success or else
+    # the seconds until a token is available
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+# Limits of one route: at most "concurrency" requests are handled at once
+# (0 for no limit) and others wait up to "queue_timeout" seconds for a
+# slot, each client may send "rate" requests per second with bursts of
+# "burst" (a rate of 0 for no limit)
+class RouteLimiter:
+    def __init__(self, concurrency=0, queue_timeout=0.5, rate=0, burst=None):
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = burst or max(int(rate), 1)
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = defaultdict(int)
+        self._slots = threading.Semaphore(concurrency) if concurrency \
+            else None
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self._slots is not None:
+            with self._lock:
+                self.waiting += 1
+            try:
+                acquired = self._slots.acquire(timeout=self.queue_timeout)
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+            if not acquired:
+                with self._lock:
+                    self.rejected['concurrency'] += 1
+                raise Overloaded(self.queue_timeout)
+        with self._lock:
+            self.in_flight += 1
+            self.admitted += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+        if self._slots is not None:
+            self._slots.release()
+
+
+# Admission control of expensive routes, so a spike of them fails fast
+# instead of piling up on the database pool and slowing every route down
+# Each limited route has a RouteLimiter, requests over a client's rate
+# are refused with 429 and requests that find the route at its concurrency
+# limit for longer than the queue timeout with 503, both with Retry-After
+# Token buckets are kept per (route, client) for the "max_clients" most
+# recently seen clients so memory stays bounded
+class AdmissionControl:
+    def __init__(self, max_clients=10000):
+        self.max_clients = max_clients
+        self.limiters = {}
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, name, **limits):
+        self.limiters[name] = RouteLimiter(**limits)
+
+    # Clients are told apart by address, set TRUSTED_PROXIES when
+    # running behind a reverse proxy so it is the client's
+    @staticmethod
+    def client_key():
+        return request.remote_addr or 'unknown'
+
+    def _take_token(self, name, limiter):
+        key = (name, self.client_key())
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(limiter.rate, limiter.burst)
+                self._buckets[key] = bucket
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            wait = bucket.take()
+        if wait:
+            with limiter._lock:
+                limiter.rejected['rate'] += 1
+            raise RateLimited(wait)
+
+    # Decorates a handler with the limits configured under "name",
+    # handlers without limits are left as they are
+    def limited(self, name):
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                limiter = self.limiters.get(name)
+                if limiter is None:
+                    return view(*args, **kwargs)
+                if limiter.rate:
+                    self._take_token(name, limiter)
+                limiter.acquire()
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    limiter.release()
+            return wrapper
+        return decorator
+
+    # Samples of one RouteLimiter attribute per route for /metrics
+    def samples(self, attribute):
+        return [({'route': name}, getattr(limiter, attribute))
+                for name, limiter in sorted(self.limiters.items())]
+
+    def rejected_samples(self):
+        return [({'route': name, 'reason': reason}, count)
+                for name, limiter in sorted(self.limiters.items())
+                for reason, count in sorted(limiter.rejected.items())]
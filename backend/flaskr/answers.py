@@ -0,0 +1,123 @@
+import re
+import threading
+import time
+import unicodedata
+
+from models import Question, db, on_question_change
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Words left out when comparing answers
+ARTICLES = frozenset(['a', 'an', 'the'])
+
+# Most typos forgiven by fuzzy matching, short answers get fewer
+MAX_EDITS = 2
+
+
+# Normal form answers are compared in: lower case, accents and
+# punctuation removed and articles dropped ("The Liver!" -> "liver")
+def normalize_answer(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    words = WORD_RE.findall(text.lower())
+    # An answer made of articles only keeps them
+    return ' '.join([word for word in words if word not in ARTICLES]
+                    or words)
+
+
+# Typos forgiven in an answer of that normal form
+def allowed_edits(normalized):
+    if len(normalized) < 4:
+        return 0
+    if len(normalized) < 8:
+        return 1
+    return MAX_EDITS
+
+
+# Levenshtein distance of two strings, computed only in the band of
+# "max_distance" around the diagonal, any distance above it is
+# returned as max_distance + 1 as soon as it is certain
+def edit_distance(a, b, max_distance):
+    over = max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return over
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [over] * (len(b) + 1)
+        if i <= max_distance:
+            current[0] = i
+        for j in range(max(1, i - max_distance),
+                       min(len(b), i + max_distance) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (char_a != b[j - 1]))
+        if min(current) > max_distance:
+            return over
+        previous = current
+    return min(previous[-1], over)
+
+
+# Returns whether a submitted answer matches the normal form of the
+# expected one, up to allowed_edits() typos when "fuzzy"
+def answer_matches(normalized, submitted, fuzzy=True):
+    submitted = normalize_answer(submitted)
+    if submitted == normalized:
+        return True
+    if not fuzzy:
+        return False
+    max_distance = allowed_edits(normalized)
+    return (max_distance > 0 and
+            edit_distance(submitted, normalized, max_distance)
+            <= max_distance)
+
+
+# Cache of the answers and their normal forms per question ID, so an
+# answer check is one lookup, answers are loaded from the questions
+# table on first check, kept current by the question change listeners
+# and loaded again after "ttl" seconds to pick up other processes' writes
+class AnswerIndex:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._answers = {}
+        self._lock = threading.Lock()
+
+    def put(self, quest_id, answer):
+        with self._lock:
+            self._answers[quest_id] = (
+                answer, normalize_answer(answer), time.monotonic())
+
+    def cached(self, quest_id):
+        entry = self._answers.get(quest_id)
+        return (entry is not None
+                and time.monotonic() - entry[2] <= self.ttl)
+
+    def _load(self, quest_id):
+        row = db.session.query(Question.answer).filter(
+            Question.id == quest_id).first()
+        if row is not None:
+            self.put(quest_id, row.answer)
+
+    # Returns (correct, expected answer) of a submitted answer,
+    # None if there is no question with that ID
+    def check(self, quest_id, submitted, fuzzy=True):
+        if not self.cached(quest_id):
+            self._load(quest_id)
+        entry = self._answers.get(quest_id)
+        if entry is None:
+            return None
+        answer, normalized, loaded_at = entry
+        return answer_matches(normalized, submitted, fuzzy), answer
+
+    def question_changed(self, action, quests):
+        with self._lock:
+            if action == 'reset':
+                self._answers = {}
+            elif action == 'delete':
+                for quest in quests:
+                    self._answers.pop(quest['id'], None)
+        if action == 'insert':
+            for quest in quests:
+                self.put(quest['id'], quest['answer'])
+
+
+answer_index = AnswerIndex()
+on_question_change(answer_index.question_changed)
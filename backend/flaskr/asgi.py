@@ -0,0 +1,567 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from urllib.parse import parse_qs
+
+from models import get_database_path, config_value
+from . import QUESTIONS_PER_PAGE, MAX_QUESTIONS_PER_PAGE, QUIZ_SESSION_TTL, \
+    QUIZ_MAX_SESSIONS, DUPLICATE_MODE
+from .asyncdb import database_from_url
+from .bulk import parse_question
+from .duplicates import DuplicateIndex
+from .pagination import keyset_segments, cursor_page
+from .quiz import QuizSessionStore, QuestionBuckets
+from .answers import AnswerIndex
+from .search import QuestionIndex, tokenize, ANSWER_WEIGHT
+from .serialization import dumps
+from .services import QUESTION_KEYS, parse_fields, question_categories
+
+logger = logging.getLogger(__name__)
+
+# Bodies of the error responses, same as the Flask error handlers
+ERROR_MESSAGES = {
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    409: 'Conflict',
+    422: 'Unprocessable Entity',
+    500: 'Internal Server Error'
+}
+
+
+# Raised by handlers to answer with one of the JSON error responses,
+# "extra" keys are added to its body
+class HTTPError(Exception):
+    def __init__(self, status, **extra):
+        super().__init__(status)
+        self.status = status
+        self.extra = extra
+
+
+# What handlers get to know about an HTTP request
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {name: values[0] for name, values in parse_qs(
+            scope['query_string'].decode('latin-1'),
+            keep_blank_values=True).items()}
+        self.headers = {name.decode('latin-1').lower(): value.decode(
+            'latin-1') for name, value in scope['headers']}
+        self.body = body
+
+    # Like Flask's get_json(): None unless the body is sent as JSON
+    def get_json(self):
+        if not self.headers.get('content-type', '').startswith(
+                'application/json'):
+            return None
+        try:
+            return json.loads(self.body.decode('utf-8'))
+        except ValueError:
+            raise HTTPError(400)
+
+    def arg(self, name, default):
+        try:
+            return int(self.args[name])
+        except (KeyError, ValueError):
+            return default
+
+    # Like flaskr.flag_arg
+    def flag(self, name, default=False):
+        value = self.args.get(name)
+        if value is None:
+            return default
+        return value.lower() in ('1', 'true')
+
+    # Question keys of the "fields" argument, see services.parse_fields
+    def fields(self):
+        try:
+            return parse_fields(self.args.get('fields'))
+        except ValueError:
+            raise HTTPError(400)
+
+
+# ASGI version of the quiz and question routes of create_app, handlers
+# await an async database driver instead of holding a worker thread per
+# request, so one process can serve many concurrent quiz and search
+# requests
+# It serves GET /categories, GET and POST /questions (fields,
+# include_categories, cursors, search and duplicates included),
+# DELETE /questions/<id>, GET /categories/<id>/questions, POST /quizzes
+# and POST /quizzes/answer with the JSON of the Flask app (the ASGI tests
+# compare both), reusing its parsers, cursors and in-memory indexes,
+# which it loads through its driver and keeps current with its own writes
+# Every other route, the response cache, compression, admission control
+# and Server-Timing headers are only served by the Flask (WSGI) app
+class TriviaASGI:
+    def __init__(self, database_url=None, config=None):
+        self.database_url = database_url
+        self.config = config
+        self.db = None
+        # Loaded from the database by refresh_buckets() and check_answer()
+        self.buckets = QuestionBuckets()
+        self.answers = AnswerIndex()
+        self.search_index = QuestionIndex()
+        self.duplicates = DuplicateIndex()
+        self.quiz_sessions = QuizSessionStore(
+            QUIZ_SESSION_TTL, QUIZ_MAX_SESSIONS, self.buckets)
+        self._connecting = None
+        self.routes = [
+            (re.compile(r'^/categories$'), {
+                'GET': self.get_categories}),
+            (re.compile(r'^/questions$'), {
+                'GET': self.get_questions,
+                'POST': self.questions_router}),
+            (re.compile(r'^/questions/(?P<quest_id>[^/]+)$'), {
+                'DELETE': self.delete_question}),
+            (re.compile(r'^/categories/(?P<cat_id>[^/]+)/questions$'), {
+                'GET': self.get_questions_by_category}),
+            (re.compile(r'^/quizzes$'), {
+                'POST': self.play_quiz}),
+            (re.compile(r'^/quizzes/answer$'), {
+                'POST': self.check_answer}),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+
+    async def startup(self):
+        # Servers without lifespan support connect on the first request
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._connect())
+        await self._connecting
+
+    async def _connect(self):
+        # Relative SQLite paths are of the flaskr package, the root path
+        # of the Flask app
+        db = database_from_url(
+            self.database_url or get_database_path(), self.config,
+            os.path.dirname(os.path.abspath(__file__)))
+        await db.connect()
+        self.db = db
+
+    async def shutdown(self):
+        if self.db is not None:
+            await self.db.close()
+        self.db = None
+        self._connecting = None
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed',
+                                'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        request = Request(scope, body)
+        try:
+            handler, params = self.match(request)
+            if self.db is None:
+                await self.startup()
+            status, payload = 200, await handler(request, **params)
+        except HTTPError as e:
+            status, payload = e.status, {
+                'success': False,
+                'message': ERROR_MESSAGES[e.status]
+            }
+            payload.update(e.extra)
+        except Exception:
+            logger.exception('Unhandled error on %s %s',
+                             request.method, request.path)
+            status, payload = 500, {
+                'success': False,
+                'message': ERROR_MESSAGES[500]
+            }
+
+        # Same body and headers as jsonify and the after_request hook
+        body = dumps(payload) + b'\n'
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'access-control-allow-origin', b'*'),
+                (b'access-allow-control-headers',
+                 b'Content-Type,Authorization,true'),
+                (b'access-allow-control-methods',
+                 b'GET,POST,DELETE,OPTIONS')
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    # Returns the handler of a request and its path parameters
+    def match(self, request):
+        for pattern, handlers in self.routes:
+            found = pattern.match(request.path)
+            if found:
+                if request.method not in handlers:
+                    raise HTTPError(405)
+                return handlers[request.method], found.groupdict()
+        raise HTTPError(404)
+
+    async def categories(self):
+        rows = await self.db.fetch('SELECT id, type FROM categories')
+        return {row['id']: row['type'] for row in rows}
+
+    async def total_questions(self):
+        return await self.db.fetchval('SELECT COUNT(*) FROM questions')
+
+    # Keeps the in-memory indexes current with this app's writes,
+    # as the question change listeners do for the Flask app
+    def question_changed(self, action, quests):
+        for index in (self.buckets, self.answers, self.search_index,
+                      self.duplicates):
+            index.question_changed(action, quests)
+
+    # GET route that returns all categories
+    async def get_categories(self, request):
+        return {
+            'success': True,
+            'categories': await self.categories()
+        }
+
+    # GET route to retrieve paginated questions and categories
+    # as well as total number of questions
+    async def get_questions(self, request):
+        if request.args.get('cursor') is not None:
+            return await self.get_questions_by_cursor(request)
+
+        page = request.arg('page', 1)
+        fields = request.fields()
+        # Pages out of range are not found, like Flask-SQLAlchemy's paginate
+        if page < 1:
+            raise HTTPError(404)
+        quests = await self.db.fetch(
+            f"SELECT {', '.join(fields)} FROM questions "
+            'ORDER BY category ASC, id ASC LIMIT $1 OFFSET $2',
+            QUESTIONS_PER_PAGE, (page - 1) * QUESTIONS_PER_PAGE)
+        if not quests and page != 1:
+            raise HTTPError(404)
+        body = {
+            'success': True,
+            'questions': quests,
+            'total_questions': await self.total_questions(),
+            'current_category': question_categories(quests)
+        }
+        if request.flag('include_categories', True):
+            body['categories'] = await self.categories()
+        return body
+
+    # GET function that pages questions by their (category, id) keyset,
+    # same reads and cursors as pagination.keyset_page
+    async def get_questions_by_cursor(self, request):
+        cursor = request.args.get('cursor')
+        limit = request.arg('limit', QUESTIONS_PER_PAGE)
+        if limit < 1:
+            raise HTTPError(400)
+        limit = min(limit, MAX_QUESTIONS_PER_PAGE)
+        fields = request.fields()
+        queried = fields
+        if 'category' not in fields:
+            queried = fields + ('category',)
+        try:
+            direction, segments = keyset_segments(cursor)
+        except ValueError:
+            raise HTTPError(400)
+
+        # One extra row tells whether there is a page after this one
+        quests = []
+        for categorized, bound, descending in segments:
+            order = 'DESC' if descending else 'ASC'
+            params = []
+            if categorized:
+                where = 'category IS NOT NULL'
+                if bound is not None:
+                    params = list(bound)
+                    where += ' AND (category, id) {} ($1, $2)'.format(
+                        '<' if descending else '>')
+                order_by = f'category {order}, id {order}'
+            else:
+                where = 'category IS NULL'
+                if bound is not None:
+                    params = [bound[1]]
+                    where += ' AND id {} $1'.format(
+                        '<' if descending else '>')
+                order_by = f'id {order}'
+            quests.extend(await self.db.fetch(
+                f"SELECT {', '.join(queried)} FROM questions WHERE {where} "
+                f'ORDER BY {order_by} LIMIT ${len(params) + 1}',
+                *params, limit + 1 - len(quests)))
+            if len(quests) > limit:
+                break
+        quests, next_cursor, prev_cursor = cursor_page(
+            quests, limit, direction, cursor)
+        if queried is not fields:
+            for quest in quests:
+                del quest['category']
+
+        total_quests = None
+        if request.flag('include_total'):
+            total_quests = await self.total_questions()
+        body = {
+            'success': True,
+            'questions': quests,
+            'total_questions': total_quests,
+            'current_category': question_categories(quests),
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor
+        }
+        if request.flag('include_categories', True):
+            body['categories'] = await self.categories()
+        return body
+
+    # DELETE route that deletes the question of the ID in the URL
+    async def delete_question(self, request, quest_id):
+        try:
+            deleted = await self.db.execute(
+                'DELETE FROM questions WHERE id = $1', int(quest_id))
+        except ValueError:
+            raise HTTPError(400)
+        if not deleted:
+            raise HTTPError(404)
+        self.question_changed('delete', [{'id': int(quest_id)}])
+        return {
+            'success': True,
+            'question': quest_id
+        }
+
+    # POST route of /questions, searches when the body has a searchTerm
+    # and adds a question otherwise
+    async def questions_router(self, request):
+        data = request.get_json()
+        if isinstance(data, dict) and 'searchTerm' in data:
+            return await self.search_questions(request, data)
+        return await self.add_question(data)
+
+    # Loads the in-memory index of "name" through the driver, again once
+    # it is older than its ttl, "columns" are those its load() takes
+    async def loaded_index(self, name, columns):
+        index = getattr(self, name)
+        if index.expired():
+            rows = await self.db.fetch(
+                f"SELECT {', '.join(columns)} FROM questions")
+            index.load([tuple(row[column] for column in columns)
+                        for row in rows])
+        return index
+
+    async def add_question(self, data):
+        cats = await self.categories()
+        try:
+            row = parse_question(
+                data, lambda cat_id: int(cat_id) in cats)
+        except ValueError:
+            raise HTTPError(400)
+        # Questions much like it are listed, or refused with 409 when
+        # duplicates are rejected, as by the Flask app
+        duplicates = []
+        mode = config_value(self.config or {}, 'DUPLICATE_MODE',
+                            DUPLICATE_MODE)
+        if mode != 'off':
+            index = await self.loaded_index(
+                'duplicates', ('id', 'question'))
+            duplicates = index.find(row['question'])
+        if duplicates and mode == 'reject':
+            raise HTTPError(409, duplicates=duplicates)
+        row['id'] = await self.db.insert(
+            'INSERT INTO questions (question, answer, category, difficulty) '
+            'VALUES ($1, $2, $3, $4)', row['question'], row['answer'],
+            row['category'], row['difficulty'])
+        quest = {key: row[key] for key in QUESTION_KEYS}
+        self.question_changed('insert', [quest])
+        return {
+            'success': True,
+            'question': quest,
+            'duplicates': duplicates
+        }
+
+    async def search_questions(self, request, data):
+        try:
+            words = tokenize(data['searchTerm'])
+            searchAnswers = bool(data.get('searchAnswers', False))
+            page = int(data.get('page', 1))
+            limit = min(int(data.get('limit', QUESTIONS_PER_PAGE)),
+                        MAX_QUESTIONS_PER_PAGE)
+        except (TypeError, ValueError):
+            raise HTTPError(400)
+        if page < 1 or limit < 1:
+            raise HTTPError(400)
+        fields = request.fields()
+        columns = ', '.join(fields)
+        offset = (page - 1) * limit
+
+        if words and self.db.dialect != 'postgresql':
+            # The in-memory index of search.full_text_search ranks the
+            # matches where the database has no full-text search
+            index = await self.loaded_index(
+                'search_index', ('id', 'question', 'answer'))
+            ranked_ids = index.search(words, searchAnswers)
+            total_results = len(ranked_ids)
+            page_ids = ranked_ids[offset:offset + limit]
+            resultQuests = []
+            if page_ids:
+                rows = await self.db.fetch(
+                    f'SELECT {columns} FROM questions WHERE id IN ('
+                    + ', '.join(f'${number + 1}'
+                                for number in range(len(page_ids)))
+                    + ')', *page_ids)
+                by_id = {row['id']: row for row in rows}
+                resultQuests = [by_id[quest_id] for quest_id in page_ids
+                                if quest_id in by_id]
+        else:
+            match, rank, params = self.search_clause(words, searchAnswers)
+            total_results = await self.db.fetchval(
+                f'SELECT COUNT(*) FROM questions WHERE {match}', *params)
+            number = len(params)
+            resultQuests = await self.db.fetch(
+                f'SELECT {columns} FROM questions WHERE {match} '
+                f'ORDER BY {rank}id ASC LIMIT ${number + 1} '
+                f'OFFSET ${number + 2}', *params, limit, offset)
+        return {
+            'success': True,
+            'questions': resultQuests,
+            'total_questions': await self.total_questions(),
+            'total_results': total_results,
+            'page': page,
+            'current_category': question_categories(resultQuests)
+        }
+
+    # Returns the (WHERE condition, ORDER BY prefix, parameters) of a
+    # PostgreSQL search, the same prefix tsquery and ranking as
+    # search.full_text_search, an empty search matches every question
+    @staticmethod
+    def search_clause(words, include_answers):
+        if not words:
+            return '1 = 1', '', []
+        columns = ['question'] + (['answer'] if include_answers else [])
+        vectors = [f"to_tsvector('simple', coalesce({column}, ''))"
+                   for column in columns]
+        tsquery = "to_tsquery('simple', $1)"
+        match = ' OR '.join(f'{vector} @@ {tsquery}' for vector in vectors)
+        rank = f'ts_rank({vectors[0]}, {tsquery})'
+        if include_answers:
+            rank += f' + {ANSWER_WEIGHT} * ts_rank({vectors[1]}, {tsquery})'
+        return (f'({match})', f'{rank} DESC, ',
+                [' & '.join(word + ':*' for word in words)])
+
+    # GET route that returns all questions of a category
+    async def get_questions_by_category(self, request, cat_id):
+        try:
+            category = int(cat_id)
+        except ValueError:
+            raise HTTPError(400)
+        if category not in await self.categories():
+            raise HTTPError(404)
+        fields = request.fields()
+        catQuests = await self.db.fetch(
+            f"SELECT {', '.join(fields)} FROM questions WHERE category = $1",
+            category)
+        return {
+            'success': True,
+            'questions': catQuests,
+            'total_questions': await self.total_questions(),
+            'total_results': len(catQuests),
+            'current_category': cat_id
+        }
+
+    # Loads the quiz buckets, again once they are older than their ttl
+    async def refresh_buckets(self):
+        if self.buckets.expired():
+            rows = await self.db.fetch(
+                'SELECT id, category, difficulty FROM questions')
+            self.buckets.load([(row['id'], row['category'],
+                                row['difficulty']) for row in rows])
+
+    # POST route that draws the next question of a quiz session,
+    # starting one from the quiz filters and previous questions
+    async def play_quiz(self, request):
+        data = request.get_json()
+        await self.refresh_buckets()
+        try:
+            session = self.quiz_sessions.play(data)
+        except (AttributeError, ValueError):
+            raise HTTPError(400)
+
+        # IDs of questions deleted by other processes are skipped
+        randQuizQuest = None
+        quest_id = session.draw()
+        while quest_id is not None:
+            rows = await self.db.fetch(
+                f"SELECT {', '.join(QUESTION_KEYS)} FROM questions "
+                'WHERE id = $1', quest_id)
+            if rows:
+                randQuizQuest = rows[0]
+                break
+            quest_id = session.draw()
+        # A finished quiz keeps its session until it expires, as in the
+        # Flask app where its result may still be posted
+        if randQuizQuest is not None and data.get('hide_answer'):
+            del randQuizQuest['answer']
+        return {
+            'success': True,
+            'question': randQuizQuest,
+            'quiz_session': session.id,
+            'remaining_questions': session.remaining
+        }
+
+    # POST route that checks the answer given to a quiz question
+    async def check_answer(self, request):
+        data = request.get_json()
+        try:
+            quest_id = int(data['question_id'])
+            submitted = data['answer']
+            fuzzy = bool(data.get('fuzzy', True))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(400)
+        if not isinstance(submitted, str) or \
+                not isinstance(data.get('quiz_session') or '', str):
+            raise HTTPError(400)
+        if not self.answers.cached(quest_id):
+            answer = await self.db.fetchval(
+                'SELECT answer FROM questions WHERE id = $1', quest_id)
+            if answer is None:
+                raise HTTPError(404)
+            self.answers.put(quest_id, answer)
+        correct, answer = self.answers.check(quest_id, submitted, fuzzy)
+
+        score = None
+        if data.get('quiz_session'):
+            session = self.quiz_sessions.get(data['quiz_session'])
+            if session is not None:
+                session.record_answer(quest_id, correct)
+                score = session.score
+        return {
+            'success': True,
+            'question_id': quest_id,
+            'correct': correct,
+            'answer': answer,
+            'score': score
+        }
+
+
+# Returns the ASGI app on "database_url" (the same database as
+# models.setup_db by default), it connects on lifespan startup
+def create_asgi_app(database_url=None, config=None):
+    return TriviaASGI(database_url, config)
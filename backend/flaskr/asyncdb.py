@@ -0,0 +1,126 @@
+import os
+import re
+
+from models import config_value
+
+# Numbered PostgreSQL parameters ($1, $2...)
+PARAM_RE = re.compile(r'\$(\d+)')
+
+
+# Async database of the ASGI app on a pool of asyncpg connections,
+# rows are returned as dicts
+class PostgresDatabase:
+    dialect = 'postgresql'
+
+    def __init__(self, dsn, min_size=5, max_size=15, statement_timeout=None):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_timeout = statement_timeout
+        self.pool = None
+
+    async def connect(self):
+        # asyncpg is only needed when the ASGI app runs on PostgreSQL
+        import asyncpg
+        settings = {}
+        if self.statement_timeout:
+            settings['statement_timeout'] = str(self.statement_timeout)
+        self.pool = await asyncpg.create_pool(
+            self.dsn, min_size=self.min_size, max_size=self.max_size,
+            server_settings=settings)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def fetch(self, sql, *args):
+        return [dict(row) for row in await self.pool.fetch(sql, *args)]
+
+    async def fetchval(self, sql, *args):
+        return await self.pool.fetchval(sql, *args)
+
+    # Returns the number of rows the statement changed
+    async def execute(self, sql, *args):
+        status = await self.pool.execute(sql, *args)
+        return int(status.split()[-1]) if status[-1:].isdigit() else 0
+
+    # Inserts a row and returns its ID
+    async def insert(self, sql, *args):
+        return await self.pool.fetchval(sql + ' RETURNING id', *args)
+
+
+# Async database of the ASGI app on a single aiosqlite connection,
+# meant for local development and tests, the same SQL runs on it
+# once the $n parameters are rewritten to SQLite's ?n ones
+class SQLiteDatabase:
+    dialect = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+
+    async def connect(self):
+        # aiosqlite is only needed when the ASGI app runs on SQLite
+        import aiosqlite
+        self.connection = await aiosqlite.connect(self.path)
+        self.connection.row_factory = aiosqlite.Row
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+    @staticmethod
+    def _sql(sql):
+        return PARAM_RE.sub(r'?\1', sql)
+
+    async def fetch(self, sql, *args):
+        async with self.connection.execute(self._sql(sql), args) as cursor:
+            return [dict(row) for row in await cursor.fetchall()]
+
+    async def fetchval(self, sql, *args):
+        async with self.connection.execute(self._sql(sql), args) as cursor:
+            row = await cursor.fetchone()
+        return None if row is None else row[0]
+
+    async def execute(self, sql, *args):
+        async with self.connection.execute(self._sql(sql), args) as cursor:
+            count = cursor.rowcount
+        await self.connection.commit()
+        return count
+
+    async def insert(self, sql, *args):
+        async with self.connection.execute(self._sql(sql), args) as cursor:
+            row_id = cursor.lastrowid
+        await self.connection.commit()
+        return row_id
+
+
+# Returns the async database for a SQLAlchemy database URL,
+# pool settings are the DB_* ones of models.engine_options
+# Relative SQLite paths are resolved against "root_path" like
+# Flask-SQLAlchemy resolves them against the app's root path,
+# so both apps open the same file whatever the working directory
+# Raises ValueError for databases without an async driver
+def database_from_url(url, config=None, root_path=None):
+    config = config or {}
+    scheme, _, rest = url.partition('://')
+    # Drops a SQLAlchemy driver suffix such as +psycopg2
+    scheme = scheme.split('+')[0]
+    if scheme in ('postgres', 'postgresql'):
+        pool_size = config_value(config, 'DB_POOL_SIZE', 5, int)
+        return PostgresDatabase(
+            'postgresql://' + rest,
+            min_size=pool_size,
+            max_size=pool_size + config_value(
+                config, 'DB_MAX_OVERFLOW', 10, int),
+            statement_timeout=config_value(
+                config, 'DB_STATEMENT_TIMEOUT', None, int))
+    if scheme == 'sqlite':
+        # sqlite:///relative.db, sqlite:////absolute.db or sqlite:// (memory)
+        path = rest[1:] or ':memory:'
+        if path != ':memory:' and root_path and not os.path.isabs(path):
+            path = os.path.join(root_path, path)
+        return SQLiteDatabase(path)
+    raise ValueError(f'no async driver for {scheme} databases')
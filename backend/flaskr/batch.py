@@ -0,0 +1,111 @@
+import json
+
+from flask import current_app, request
+from werkzeug.exceptions import HTTPException, InternalServerError, \
+    MethodNotAllowed, NotFound
+
+from models import category_registry
+
+# Sub-requests of one batch at most
+MAX_BATCH_REQUESTS = 20
+
+# Routes a batch can't reach: itself, streamed and non JSON responses
+EXCLUDED_ENDPOINTS = frozenset(
+    ['batch', 'export_all_questions', 'get_metrics', 'static'])
+
+# Routes whose POST only reads the database,
+# POST /questions is only the search (with a searchTerm)
+READ_POST_ENDPOINTS = frozenset(['play_quiz', 'check_answer'])
+
+
+# Reads the sub-requests of the JSON body of POST /batch,
+# {"requests": [{"method": "GET", "path": "/categories"}, ...]} with an
+# optional JSON "body" per sub-request, into (method, path, body) tuples
+# Raises ValueError on a malformed batch
+def parse_batch(data):
+    subrequests = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(subrequests, list) or \
+            not 0 < len(subrequests) <= MAX_BATCH_REQUESTS:
+        raise ValueError('malformed batch')
+    parsed = []
+    for subrequest in subrequests:
+        if not isinstance(subrequest, dict):
+            raise ValueError('malformed sub-request')
+        method = subrequest.get('method', 'GET')
+        path = subrequest.get('path')
+        if not isinstance(method, str) or not isinstance(path, str) \
+                or not path.startswith('/'):
+            raise ValueError('malformed sub-request')
+        parsed.append((method.upper(), path, subrequest.get('body')))
+    return parsed
+
+
+# Refuses sub-requests that would write, or that a batch can't reach
+def check_subrequest(method, body):
+    if request.routing_exception is not None:
+        raise request.routing_exception
+    endpoint = request.url_rule.endpoint
+    if endpoint in EXCLUDED_ENDPOINTS:
+        raise NotFound()
+    if method == 'GET':
+        return
+    if method == 'POST' and (endpoint in READ_POST_ENDPOINTS or (
+            endpoint == 'questions_router' and isinstance(body, dict)
+            and 'searchTerm' in body)):
+        return
+    raise MethodNotAllowed()
+
+
+# Runs one sub-request through the route it targets in the current app
+# context, so it shares the database session of the batch, errors are
+# rendered by the app's error handlers as for any request
+# Returns (status code, JSON body)
+def run_subrequest(method, path, body, remote_addr=None):
+    app = current_app._get_current_object()
+    options = {'method': method,
+               'environ_base': {'REMOTE_ADDR': remote_addr}}
+    if body is not None:
+        options['data'] = json.dumps(body)
+        options['content_type'] = 'application/json'
+    with app.test_request_context(path, **options):
+        try:
+            check_subrequest(method, body)
+            rv = app.dispatch_request()
+        except HTTPException as e:
+            rv = app.handle_http_exception(e)
+        except Exception:
+            app.log_exception(None)
+            rv = app.handle_http_exception(InternalServerError())
+        response = app.make_response(rv)
+        return response.status_code, response.get_json()
+
+
+# Runs the sub-requests of parse_batch in order, identical GET requests
+# only once, and returns the body of POST /batch
+# The {id: type} categories map returned by several routes is sent once:
+# it is moved to the envelope and left out of the responses, other
+# "categories" (e.g. of /categories/stats) are left as they are
+def run_batch(subrequests, remote_addr=None):
+    responses = []
+    done = {}
+    for method, path, body in subrequests:
+        if method == 'GET' and path in done:
+            status, result = done[path]
+        else:
+            status, result = run_subrequest(method, path, body, remote_addr)
+            if method == 'GET':
+                done[path] = (status, result)
+        responses.append({'status': status, 'body': result})
+
+    envelope = {'success': True, 'responses': responses}
+    # The bodies were read back from JSON, so the IDs are strings
+    cats = {str(cat_id): cat_type
+            for cat_id, cat_type in category_registry.all().items()}
+    for response in responses:
+        result = response['body']
+        if not isinstance(result, dict) or result.get('categories') != cats:
+            continue
+        envelope['categories'] = cats
+        response['body'] = dict(result)
+        del response['body']['categories']
+    return envelope
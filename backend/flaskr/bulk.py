@@ -0,0 +1,184 @@
+import json
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import Question, category_registry, db, notify_question_change
+from .serialization import dumps
+from .services import QUESTION_KEYS, question_rows, question_dicts
+
+# Difficulties a question can be rated with
+DIFFICULTIES = range(1, 6)
+
+# Only the first errors are reported back so the response stays small
+MAX_REPORTED_ERRORS = 100
+
+# Most questions a single batch delete or update may change
+MAX_BATCH_WRITE = 1000
+
+# Fields of a question that can be written
+QUESTION_FIELDS = ('question', 'answer', 'category', 'difficulty')
+
+
+def _parse_int(value, name):
+    # bool is a subclass of int but never a valid value here
+    if isinstance(value, bool):
+        raise ValueError(f"'{name}' must be an integer")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be an integer")
+
+
+# Validates one field of a question and returns its column value
+def _parse_field(data, key, category_exists):
+    if key in ('question', 'answer'):
+        if not isinstance(data.get(key), str) or not data[key].strip():
+            raise ValueError(f"'{key}' must be a non-empty string")
+        return data[key]
+    value = _parse_int(data.get(key), key)
+    if key == 'category' and not category_exists(value):
+        raise ValueError(f"category {value} does not exist")
+    if key == 'difficulty' and value not in DIFFICULTIES:
+        raise ValueError("'difficulty' must be between 1 and 5")
+    return value
+
+
+# Validates the JSON data of a question and returns the column values
+# to insert, raises ValueError describing the first invalid field
+# "category_exists" tells whether a category ID is known
+def parse_question(data, category_exists=None):
+    if not isinstance(data, dict):
+        raise ValueError('a question must be a JSON object')
+    if category_exists is None:
+        category_exists = category_registry.exists
+    return {key: _parse_field(data, key, category_exists)
+            for key in QUESTION_FIELDS}
+
+
+# Validates a partial update of a question, its 'id' and the fields
+# to change, and returns them as column values
+def parse_question_update(data, category_exists=None):
+    if not isinstance(data, dict):
+        raise ValueError('an update must be a JSON object')
+    if category_exists is None:
+        category_exists = category_registry.exists
+    fields = [key for key in data if key != 'id']
+    for key in fields:
+        if key not in QUESTION_FIELDS:
+            raise ValueError(f"'{key}' can't be updated")
+    if not fields:
+        raise ValueError('an update must change at least one field')
+    row = {'id': _parse_int(data.get('id'), 'id')}
+    for key in fields:
+        row[key] = _parse_field(data, key, category_exists)
+    return row
+
+
+# Validates a JSON list of question IDs, returns them without duplicates
+def parse_ids(ids):
+    if not isinstance(ids, list) or not ids:
+        raise ValueError("'ids' must be a non-empty list")
+    if len(ids) > MAX_BATCH_WRITE:
+        raise ValueError(f'at most {MAX_BATCH_WRITE} IDs at once')
+    # A dict keeps the first occurrence of each ID in order
+    return list(dict.fromkeys(_parse_int(quest_id, 'ids') for quest_id in ids))
+
+
+# Inserts the questions of a stream of JSON lines (one question per line)
+# in transactions of "batch_size" rows, invalid lines are skipped and
+# reported, a batch the database rejects is rolled back and reported
+# Returns (number of inserted questions, number of errors, errors)
+def import_questions(lines, batch_size):
+    inserted = 0
+    total_errors = 0
+    errors = []
+
+    def report(line_no, message):
+        nonlocal total_errors
+        total_errors += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'line': line_no, 'message': message})
+
+    def flush(batch):
+        nonlocal inserted
+        try:
+            db.session.bulk_insert_mappings(
+                Question, [row for line_no, row in batch])
+            db.session.commit()
+            inserted += len(batch)
+        except SQLAlchemyError:
+            db.session.rollback()
+            for line_no, row in batch:
+                report(line_no, 'rejected by the database')
+
+    batch = []
+    for line_no, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        if not line.strip():
+            continue
+        try:
+            batch.append((line_no, parse_question(json.loads(line))))
+        except ValueError as e:
+            # json.JSONDecodeError is a ValueError too
+            report(line_no, str(e))
+            continue
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    # Bulk inserts don't load the new IDs back,
+    # so whatever was derived from the questions table is rebuilt
+    if inserted:
+        notify_question_change('reset', [])
+    return inserted, total_errors, errors
+
+
+# Deletes the questions of a list of IDs with a single DELETE ... IN
+# statement in one transaction
+# Returns (IDs of the deleted questions, IDs without a question)
+def delete_questions(quest_ids):
+    # The rows are read first for the question change listeners
+    quests = question_dicts(
+        question_rows().filter(Question.id.in_(quest_ids)))
+    found = {quest['id'] for quest in quests}
+    if quests:
+        Question.query.filter(Question.id.in_(found)).delete(
+            synchronize_session=False)
+        db.session.commit()
+        notify_question_change('delete', quests)
+    return ([quest_id for quest_id in quest_ids if quest_id in found],
+            [quest_id for quest_id in quest_ids if quest_id not in found])
+
+
+# Applies partial updates (from parse_question_update) to their questions
+# with a bulk UPDATE in one transaction, updates of the same ID are merged
+# Returns (IDs of the updated questions, IDs without a question)
+def update_questions(updates):
+    changes = {}
+    for row in updates:
+        changes.setdefault(row['id'], {}).update(row)
+    old_quests = {quest['id']: quest for quest in question_dicts(
+        question_rows().filter(Question.id.in_(list(changes))))}
+    mappings = [row for quest_id, row in changes.items()
+                if quest_id in old_quests]
+    if mappings:
+        db.session.bulk_update_mappings(Question, mappings)
+        db.session.commit()
+        notify_question_change(
+            'delete', [old_quests[row['id']] for row in mappings])
+        notify_question_change(
+            'insert', [dict(old_quests[row['id']], **row)
+                       for row in mappings])
+    return ([quest_id for quest_id in changes if quest_id in old_quests],
+            [quest_id for quest_id in changes if quest_id not in old_quests])
+
+
+# Yields every question as a JSON line, "batch_size" rows are fetched
+# from the database at a time so memory stays flat at any table size
+def export_questions(batch_size):
+    rows = question_rows().order_by(Question.id.asc()).yield_per(batch_size)
+    for row in rows:
+        yield dumps(dict(zip(QUESTION_KEYS, row))) + b'\n'
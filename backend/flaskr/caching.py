@@ -0,0 +1,150 @@
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from flask import current_app, make_response, request
+
+from models import data_generation
+
+
+# Default in-process backend, a least recently used map
+# of at most "max_entries" entries that expire after their timeout
+class LRUBackend:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    # Entries are only shared by this process, so its own generation
+    # tells whether they are current
+    def generation(self):
+        return data_generation.value
+
+
+# Backend over any client with the redis-py get/set(ex=)/incr/delete
+# interface, so several processes can share one cache
+# The data generation is kept in Redis as well: every process increments
+# it on its writes (bump() is a data_generation listener) and reads it per
+# request, so entries cached by one process are never served for another
+# process' data
+class RedisBackend:
+    def __init__(self, client, prefix='trivia:response:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        # redis is only needed when this backend is configured
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        head, body = raw.split(b'\n', 1)
+        etag, mimetype = json.loads(head.decode())
+        return etag, body, mimetype
+
+    def set(self, key, value, timeout):
+        etag, body, mimetype = value
+        head = json.dumps([etag, mimetype]).encode()
+        self.client.set(self.prefix + key, head + b'\n' + body,
+                        ex=max(int(timeout), 1))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+    def generation(self):
+        return int(self.client.get(self.prefix + 'generation') or 0)
+
+    def bump(self):
+        self.client.incr(self.prefix + 'generation')
+
+
+# The RedisBackend of a Redis URL, one per process however many apps use
+# it, so its bump() is added to the data_generation listeners only once
+@functools.lru_cache(maxsize=None)
+def redis_backend(url):
+    backend = RedisBackend.from_url(url)
+    data_generation.listeners.append(backend.bump)
+    return backend
+
+
+# Caches successful GET responses keyed on the route and its arguments,
+# versioned by the backend's data generation so every question or category
+# write makes older entries unreachable, each response carries a content
+# ETag and conditional requests (If-None-Match) are answered with 304
+# With the in-process backend other processes' writes don't bump this
+# process' generation, so "timeout" bounds how long a shared database
+# change can go unseen, the Redis backend shares the generation
+class ResponseCache:
+    def __init__(self, backend, timeout=60):
+        self.backend = backend
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+    # Arguments are encoded, so "&" or "=" in a value can't make the key
+    # of another query
+    def key(self):
+        return '{}:{}?{}'.format(
+            self.backend.generation(), request.path,
+            urlencode(sorted(request.args.items(multi=True))))
+
+    def cached(self, view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = self.key()
+            entry = self.backend.get(key)
+            if entry is None:
+                self.misses += 1
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body = response.get_data()
+                entry = (hashlib.sha1(body).hexdigest(), body,
+                         response.mimetype)
+                self.backend.set(key, entry, self.timeout)
+            else:
+                self.hits += 1
+            return self.respond(entry)
+        return wrapper
+
+    @staticmethod
+    def respond(entry):
+        etag, body, mimetype = entry
+        response = current_app.response_class(body, mimetype=mimetype)
+        response.set_etag(etag)
+        # Clients may keep the response but must revalidate it each time
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
@@ -0,0 +1,97 @@
+import gzip
+
+from flask import request
+
+# brotli is optional, responses are only gzipped without it
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies of these types are compressed, others (e.g. images) already are
+COMPRESSIBLE_MIMETYPES = frozenset([
+    'application/json', 'application/x-ndjson', 'text/plain', 'text/html',
+    'text/css', 'application/javascript'])
+
+
+# Encodings of an Accept-Encoding header mapped to their quality,
+# encodings with a quality of 0 are refused by the client
+def accepted_encodings(header):
+    encodings = {}
+    for part in (header or '').split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name] = quality
+    return encodings
+
+
+# Compresses responses with brotli (when installed) or gzip, whichever
+# the client's Accept-Encoding prefers, once their body is at least
+# "min_size" bytes, smaller bodies cost more to compress than they save
+# Streamed responses (e.g. the JSON Lines export) are left as they are
+class ResponseCompression:
+    def __init__(self, min_size=500, gzip_level=6, brotli_quality=4):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.compressed = 0
+        self.saved_bytes = 0
+
+    def init_app(self, app):
+        app.extensions['compression'] = self
+        app.after_request(self.after_request)
+
+    # Picks the encoding of a request's Accept-Encoding,
+    # None when the client accepts none of them
+    def choose(self, header):
+        encodings = accepted_encodings(header)
+        wildcard = encodings.get('*', 0.0)
+        supported = ['br', 'gzip'] if brotli is not None else ['gzip']
+        best = None
+        best_quality = 0.0
+        for name in supported:
+            quality = encodings.get(name, wildcard)
+            if quality > best_quality:
+                best, best_quality = name, quality
+        return best
+
+    def compress(self, body, encoding):
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    def after_request(self, response):
+        if (response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or response.is_streamed or response.direct_passthrough
+                or 'Content-Encoding' in response.headers):
+            return response
+        # Caches must keep one copy of the response per encoding
+        response.vary.add('Accept-Encoding')
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return response
+        encoding = self.choose(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < self.min_size:
+            return response
+        compressed = self.compress(body, encoding)
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        # The entity tag is of the uncompressed body, the compressed one
+        # is only semantically equivalent
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        self.compressed += 1
+        self.saved_bytes += len(body) - len(compressed)
+        return response
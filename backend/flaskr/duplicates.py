@@ -0,0 +1,328 @@
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+
+from werkzeug.exceptions import Conflict
+
+from models import Question, db, on_question_change
+from .search import tokenize
+
+# Questions are compared by their sets of 4 character shingles
+SHINGLE_SIZE = 4
+
+# MinHash signatures of 64 values cut into 16 bands of 4 for LSH, two
+# questions share a band bucket with a probability of 1 - (1 - s^4)^16
+# for a shingle similarity s: 99.8% at 0.75, 64% at 0.5
+SIGNATURE_SIZE = 64
+BANDS = 16
+ROWS = SIGNATURE_SIZE // BANDS
+
+# Shingle similarity (Jaccard index) from which questions are duplicates
+SIMILARITY_THRESHOLD = 0.75
+
+# Duplicates returned for one question, and distinct signatures
+# sharing one of its buckets compared with it at most
+MAX_DUPLICATES = 10
+MAX_CANDIDATES = 200
+
+# Members of a band bucket each question is compared with in the report,
+# so a bucket shared by many questions doesn't cost quadratic time
+MAX_BUCKET_COMPARISONS = 10
+
+# Question pairs compared by one report at most, about 8 per question,
+# so the report takes a few seconds at most on any corpus, the pairs left
+# over are reported as incomplete
+MAX_REPORT_COMPARISONS = 500000
+
+# A shingle hash is split into the bin it falls in and its value in it
+VALUE_BITS = 58
+VALUE_MASK = (1 << VALUE_BITS) - 1
+HASH_MASK = (1 << 64) - 1
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+
+
+# Raised when a question much like existing ones is added
+# while duplicates are rejected
+class DuplicateQuestion(Conflict):
+    def __init__(self, duplicates):
+        super().__init__()
+        self.duplicates = duplicates
+
+
+# Overlapping 4 character pieces of the lower case words of a question,
+# shorter texts are a single shingle
+def shingles(text):
+    text = ' '.join(tokenize(text))
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[start:start + SHINGLE_SIZE]
+            for start in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+# MinHash signature of a shingle set with one permutation hashing: each
+# shingle is hashed once into one of SIGNATURE_SIZE bins which keep their
+# smallest value, empty bins take the value of the next filled bin to
+# their right shifted by the distance (densification)
+# Returns None for an empty set
+def signature(shingle_set):
+    hashes = sorted([
+        (hashed * HASH_MULTIPLIER) & HASH_MASK
+        for hashed in map(zlib.crc32, map(str.encode, shingle_set))],
+        reverse=True)
+    # Hashes are set from the largest so each bin keeps its smallest
+    bins = {hashed >> VALUE_BITS: hashed & VALUE_MASK for hashed in hashes}
+    if not bins:
+        return None
+    if len(bins) == SIGNATURE_SIZE:
+        return tuple(bins[index] for index in range(SIGNATURE_SIZE))
+    sig = [None] * SIGNATURE_SIZE
+    following_index = min(bins)
+    following = bins[following_index]
+    following_index += SIGNATURE_SIZE
+    for index in reversed(range(SIGNATURE_SIZE)):
+        value = bins.get(index)
+        if value is not None:
+            following, following_index = value, index
+            sig[index] = value
+        else:
+            sig[index] = following + (
+                (following_index - index) << VALUE_BITS)
+    return tuple(sig)
+
+
+# Keys of the LSH buckets of a signature, one per band
+def band_keys(sig):
+    return [hash((band,) + sig[band * ROWS:(band + 1) * ROWS])
+            for band in range(BANDS)]
+
+
+# In-memory MinHash/LSH index of the question texts that finds questions
+# much like a given one by comparing it only with the questions sharing
+# one of its band buckets instead of with every question
+# Questions with the same signature (e.g. imported twice) are kept as
+# one entry of the buckets, so they are compared only once
+# It is built from "loader" (rows of (id, question)) in one pass on first
+# use, kept up to date through the question change listeners and rebuilt
+# after "ttl" seconds to pick up writes of other processes
+class DuplicateIndex:
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, ttl=60, loader=None):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.loader = loader
+        self.buckets = None
+        self.members = {}
+        self.texts = {}
+        self.signatures = {}
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def expired(self):
+        return (self.buckets is None
+                or time.monotonic() - self._loaded_at > self.ttl)
+
+    def build(self):
+        with self._lock:
+            self._load(self.loader())
+
+    # Replaces the index with rows of (id, question), e.g. read by the
+    # ASGI app through its async driver
+    def load(self, rows):
+        with self._lock:
+            self._load(rows)
+
+    def _load(self, rows):
+        self.buckets = defaultdict(set)
+        self.members = {}
+        self.texts = {}
+        self.signatures = {}
+        # Repeated texts are hashed once
+        known = {}
+        for quest_id, question in rows:
+            if question not in known:
+                known[question] = signature(shingles(question))
+            self._add(quest_id, question, known[question])
+        self._loaded_at = time.monotonic()
+
+    def _add(self, quest_id, question, sig):
+        self.texts[quest_id] = question
+        if sig is None:
+            return
+        self.signatures[quest_id] = sig
+        members = self.members.get(sig)
+        if members is None:
+            members = self.members[sig] = []
+            for key in band_keys(sig):
+                self.buckets[key].add(sig)
+        members.append(quest_id)
+
+    def _remove(self, quest_id):
+        self.texts.pop(quest_id, None)
+        sig = self.signatures.pop(quest_id, None)
+        if sig is None:
+            return
+        members = self.members[sig]
+        members.remove(quest_id)
+        if members:
+            return
+        del self.members[sig]
+        for key in band_keys(sig):
+            bucket = self.buckets[key]
+            bucket.discard(sig)
+            if not bucket:
+                del self.buckets[key]
+
+    def _ensure_loaded(self):
+        if self.expired() and self.loader is not None:
+            self._load(self.loader())
+
+    # Returns up to "limit" {"id", "question", "similarity"} questions
+    # much like "text", most similar first, "exclude" is left out
+    # Only the MAX_CANDIDATES signatures sharing the most buckets with it
+    # are compared with it
+    def find(self, text, limit=MAX_DUPLICATES, exclude=None):
+        text_shingles = shingles(text)
+        sig = signature(text_shingles)
+        if sig is None:
+            return []
+        with self._lock:
+            self._ensure_loaded()
+            if self.buckets is None:
+                return []
+            # Signatures sharing the most bands are the most similar
+            shared = Counter()
+            for key in band_keys(sig):
+                shared.update(self.buckets.get(key, ()))
+            matches = []
+            for candidate, _ in shared.most_common(MAX_CANDIDATES):
+                members = self.members[candidate]
+                similarity = jaccard(
+                    text_shingles, shingles(self.texts[members[0]]))
+                if similarity < self.threshold:
+                    continue
+                matches.extend((-similarity, quest_id)
+                               for quest_id in members
+                               if quest_id != exclude)
+            matches.sort()
+            return [{'id': quest_id, 'question': self.texts[quest_id],
+                     'similarity': round(-similarity, 3)}
+                    for similarity, quest_id in matches[:limit]]
+
+    # Groups of duplicate questions of the whole index, largest first
+    # Each signature is compared with the previous MAX_BUCKET_COMPARISONS
+    # signatures of its buckets, so the time is near linear in the number
+    # of questions even when many share a bucket
+    # Only copying the index holds the lock, so questions are looked up
+    # and added while the report is built
+    # Returns (groups, complete), groups are [{"questions": [{"id",
+    # "question"}], "similarity"}] where "similarity" is the highest of the
+    # group, complete is False when "max_comparisons" cut the report short
+    def groups(self, max_comparisons=MAX_REPORT_COMPARISONS):
+        with self._lock:
+            self._ensure_loaded()
+            if self.buckets is None:
+                return [], True
+            texts = dict(self.texts)
+            members = [list(quest_ids) for quest_ids in self.members.values()]
+            firsts = {sig: quest_ids[0]
+                      for sig, quest_ids in self.members.items()}
+            buckets = [[firsts[sig] for sig in bucket]
+                       for bucket in self.buckets.values() if len(bucket) > 1]
+        return group_duplicates(texts, members, buckets, self.threshold,
+                                max_comparisons)
+
+    def question_changed(self, action, quests):
+        with self._lock:
+            # Not built yet, the first use builds it
+            if self.buckets is None:
+                return
+            if action == 'reset':
+                self.buckets = None
+            elif action == 'insert':
+                for quest in quests:
+                    self._remove(quest['id'])
+                    self._add(quest['id'], quest['question'],
+                              signature(shingles(quest['question'])))
+            elif action == 'delete':
+                for quest in quests:
+                    self._remove(quest['id'])
+
+
+# Groups the duplicates of a copy of a DuplicateIndex: the texts per
+# question ID, the question IDs per signature and the first question ID
+# of the signatures per bucket, see DuplicateIndex.groups
+def group_duplicates(texts, members, buckets, threshold, max_comparisons):
+    shingled = {}
+
+    def shingles_of(quest_id):
+        text = texts[quest_id]
+        if text not in shingled:
+            shingled[text] = shingles(text)
+        return shingled[text]
+
+    # Union-find of the question IDs, rooted at the smallest ID
+    parents = {}
+    best = {}
+
+    def root(quest_id):
+        while parents.get(quest_id, quest_id) != quest_id:
+            quest_id = parents[quest_id]
+        return quest_id
+
+    def join(quest_id, other_id, similarity):
+        first, second = root(quest_id), root(other_id)
+        group = min(first, second)
+        if first != second:
+            parents[max(first, second)] = group
+        best[group] = max(similarity, best.get(first, 0),
+                          best.get(second, 0))
+
+    # Questions of the same signature, then signatures sharing a bucket
+    # through their first question
+    def pairs():
+        for quest_ids in members:
+            for quest_id in quest_ids[1:]:
+                yield quest_ids[0], quest_id
+        compared = set()
+        for bucket in buckets:
+            firsts = sorted(bucket)
+            for position, quest_id in enumerate(firsts):
+                start = max(position - MAX_BUCKET_COMPARISONS, 0)
+                for other_id in firsts[start:position]:
+                    if (other_id, quest_id) not in compared:
+                        compared.add((other_id, quest_id))
+                        yield other_id, quest_id
+
+    complete = True
+    for count, (quest_id, other_id) in enumerate(pairs()):
+        if count >= max_comparisons:
+            complete = False
+            break
+        similarity = jaccard(shingles_of(quest_id), shingles_of(other_id))
+        if similarity >= threshold:
+            join(quest_id, other_id, similarity)
+
+    grouped = defaultdict(list)
+    for quest_id in parents:
+        grouped[root(quest_id)].append(quest_id)
+    groups = []
+    for group, quest_ids in grouped.items():
+        groups.append({
+            'questions': [{'id': quest_id, 'question': texts[quest_id]}
+                          for quest_id in sorted(quest_ids + [group])],
+            'similarity': round(best[group], 3)
+        })
+    groups.sort(key=lambda group: (-len(group['questions']),
+                                   group['questions'][0]['id']))
+    return groups, complete
+
+
+duplicate_index = DuplicateIndex(loader=lambda: db.session.query(
+    Question.id, Question.question))
+on_question_change(duplicate_index.question_changed)
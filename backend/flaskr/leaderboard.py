@@ -0,0 +1,199 @@
+import atexit
+import threading
+import time
+import weakref
+from datetime import datetime
+
+from sqlalchemy import DateTime, Integer, func, literal, select
+
+from models import QuizResult, LeaderboardEntry, db
+
+# Longest player name kept with a result
+MAX_PLAYER_LENGTH = 50
+
+# Postgres advisory lock taken by a leaderboard rebuild, so the writer
+# threads of several worker processes rebuild it one after the other
+REFRESH_LOCK_KEY = 0x74726976696120
+
+# Leaderboards whose writer thread runs, the results they still buffer
+# are written at exit by a single handler for the whole process
+running_leaderboards = weakref.WeakSet()
+
+
+@atexit.register
+def close_leaderboards():
+    for leaderboard in list(running_leaderboards):
+        leaderboard.close()
+
+
+# Reads a quiz result from the JSON body of POST /quizzes/results: the
+# player name of the quiz played in "session", whose answers checked by
+# the server are the score, so clients can't report scores of their own
+# Raises ValueError on an invalid result
+def parse_result(data, session):
+    player = data.get('player')
+    if not isinstance(player, str) or not player.strip():
+        raise ValueError('missing player name')
+    player = player.strip()
+    if len(player) > MAX_PLAYER_LENGTH:
+        raise ValueError('player name too long')
+
+    score, questions = session.result()
+    category_ids = session.category_ids or ()
+    category = next(iter(category_ids)) if len(category_ids) == 1 else None
+    return {
+        'player': player,
+        'score': score,
+        'questions': questions,
+        'category': category
+    }
+
+
+# Query of the top "size" players by total score, with their rank,
+# over all results (as category 0) or per category
+def ranked_players(size, by_category):
+    total = func.sum(QuizResult.score)
+    games = func.count(QuizResult.id)
+    keys = [QuizResult.category] if by_category else []
+    rank = func.row_number().over(
+        partition_by=keys or None,
+        order_by=[total.desc(), games, QuizResult.player])
+    query = db.session.query(
+        QuizResult.category if by_category else literal(0, Integer),
+        QuizResult.player, total, games, func.max(QuizResult.score), rank)
+    if by_category:
+        query = query.filter(QuizResult.category.isnot(None))
+    ranked = query.group_by(*keys, QuizResult.player).subquery()
+    category, player, total, games, best, rank = ranked.c
+    return select([category, rank, player, total, games, best]).where(
+        rank <= size)
+
+
+# Quiz results and the leaderboard built from them
+# Results are buffered in memory and written by a background thread in
+# batches of up to "batch_size", at least every "flush_interval" seconds,
+# at most "max_pending" results wait so a database outage can't take
+# all the memory
+# Leaderboard reads come from the materialized top "size" players per
+# category (leaderboard table), rebuilt by the same thread at most every
+# "refresh_interval" seconds once new results were written
+class Leaderboard:
+    def __init__(self, app, size=100, batch_size=500, flush_interval=1.0,
+                 refresh_interval=10.0, max_pending=100000):
+        self.app = app
+        self.size = size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+        self.max_pending = max_pending
+        self.pending = []
+        self.written = 0
+        self.refreshed_at = 0
+        self._stale = False
+        self._closed = False
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    # Queues a result of parse_result for writing,
+    # returns False when too many results are waiting already
+    def record(self, result):
+        result = dict(result, created_at=datetime.utcnow())
+        with self._lock:
+            if len(self.pending) >= self.max_pending:
+                return False
+            self.pending.append(result)
+            full = len(self.pending) >= self.batch_size
+            if self._thread is None:
+                self._start()
+        if full:
+            self._wake.set()
+        return True
+
+    # The writer thread starts with the first result
+    def _start(self):
+        self._thread = threading.Thread(
+            target=self._run, name='leaderboard-writer', daemon=True)
+        self._thread.start()
+        # Results still buffered at exit are written before it
+        running_leaderboards.add(self)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if (self._stale and time.monotonic() - self.refreshed_at
+                        >= self.refresh_interval):
+                    self.refresh()
+            except Exception:
+                self.app.logger.exception('Writing quiz results failed')
+
+    # Writes the buffered results in one batch insert, returns their
+    # number, results of a failed batch are queued again
+    def flush(self):
+        with self._write_lock:
+            with self._lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            with self.app.app_context():
+                try:
+                    db.session.bulk_insert_mappings(QuizResult, batch)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    with self._lock:
+                        self.pending[:0] = batch
+                        del self.pending[:-self.max_pending]
+                    raise
+            self.written += len(batch)
+            self._stale = True
+            return len(batch)
+
+    # Rebuilds the leaderboard table from the results in one transaction,
+    # readers see the previous leaderboard until it commits
+    # Other processes' rebuilds wait for it on Postgres, SQLite runs one
+    # write transaction at a time anyway
+    def refresh(self):
+        with self._write_lock:
+            columns = ['category', 'rank', 'player', 'total_score', 'games',
+                       'best_score', 'refreshed_at']
+            refreshed_at = literal(datetime.utcnow(), DateTime)
+            table = LeaderboardEntry.__table__
+            with self.app.app_context():
+                try:
+                    if db.engine.dialect.name == 'postgresql':
+                        db.session.execute(
+                            select([func.pg_advisory_xact_lock(
+                                REFRESH_LOCK_KEY)]))
+                    db.session.query(LeaderboardEntry).delete(
+                        synchronize_session=False)
+                    for by_category in (False, True):
+                        ranked = ranked_players(self.size, by_category)
+                        db.session.execute(table.insert().from_select(
+                            columns,
+                            ranked.column(refreshed_at)))
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+            self._stale = False
+            self.refreshed_at = time.monotonic()
+
+    # Returns the top "limit" leaderboard entries of a category
+    # (0 for all) and when they were materialized (None if never)
+    def top(self, category=0, limit=10):
+        entries = LeaderboardEntry.query.filter(
+            LeaderboardEntry.category == category).order_by(
+            LeaderboardEntry.rank).limit(min(limit, self.size)).all()
+        refreshed_at = entries[0].refreshed_at if entries else None
+        return [entry.format() for entry in entries], refreshed_at
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        running_leaderboards.discard(self)
+        self.flush()
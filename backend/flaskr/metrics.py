@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app, g, has_app_context, has_request_context, \
+    request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (in seconds) of the request duration histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                    5.0, 10.0)
+
+_engine_events_installed = False
+_install_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"'
+                          for name, value in sorted(labels.items())) + '}'
+
+
+# Records how many SQL queries each request issues, how long they took and
+# how long the whole handler took, exposes them per request as a
+# Server-Timing header and aggregated per route in Prometheus text format,
+# queries slower than "slow_query_ms" are logged as warnings
+class RequestMetrics:
+    def __init__(self, slow_query_ms=500):
+        self.slow_query_ms = slow_query_ms
+        self.slow_queries = 0
+        self._routes = defaultdict(lambda: {
+            'requests': defaultdict(int),
+            'buckets': [0] * len(DURATION_BUCKETS),
+            'duration': 0.0,
+            'count': 0,
+            'queries': 0,
+            'db_duration': 0.0
+        })
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.extensions['metrics'] = self
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        install_engine_events()
+
+    # Adds a metric computed when scraped, "collect" returns either a number
+    # or a list of (labels dict, number) samples
+    def add_metric(self, name, kind, help_text, collect):
+        self._collectors.append((name, kind, help_text, collect))
+
+    def before_request(self):
+        g.metrics_started = time.perf_counter()
+        g.db_queries = 0
+        g.db_duration = 0.0
+
+    def after_request(self, response):
+        if 'metrics_started' not in g:
+            return response
+        duration = time.perf_counter() - g.metrics_started
+        response.headers['Server-Timing'] = (
+            'db;dur={:.2f};desc="{} queries", app;dur={:.2f}'.format(
+                g.db_duration * 1000, g.db_queries, duration * 1000))
+
+        route = request.endpoint or 'unmatched'
+        with self._lock:
+            stats = self._routes[route]
+            stats['requests'][(request.method, response.status_code)] += 1
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    stats['buckets'][index] += 1
+            stats['duration'] += duration
+            stats['count'] += 1
+            stats['queries'] += g.db_queries
+            stats['db_duration'] += g.db_duration
+        return response
+
+    def query_finished(self, statement, duration):
+        if has_request_context() and 'db_queries' in g:
+            g.db_queries += 1
+            g.db_duration += duration
+        if duration * 1000 >= self.slow_query_ms:
+            with self._lock:
+                self.slow_queries += 1
+            current_app.logger.warning(
+                'Slow query (%.1f ms): %s', duration * 1000, statement)
+
+    # Renders every metric in the Prometheus text exposition format
+    def render(self):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for suffix, labels, value in samples:
+                lines.append(f'{name}{suffix}{_labels(labels)} {value}')
+
+        with self._lock:
+            routes = sorted(self._routes.items())
+            metric('trivia_requests_total', 'counter', 'Requests handled',
+                   [('', {'endpoint': route, 'method': method,
+                          'status': status}, count)
+                    for route, stats in routes
+                    for (method, status), count
+                    in sorted(stats['requests'].items())])
+            samples = []
+            for route, stats in routes:
+                for bound, count in zip(DURATION_BUCKETS, stats['buckets']):
+                    samples.append(('_bucket', {'endpoint': route,
+                                                'le': bound}, count))
+                samples.append(('_bucket', {'endpoint': route, 'le': '+Inf'},
+                                stats['count']))
+                samples.append(('_sum', {'endpoint': route},
+                                round(stats['duration'], 6)))
+                samples.append(('_count', {'endpoint': route},
+                                stats['count']))
+            metric('trivia_request_duration_seconds', 'histogram',
+                   'Time spent handling requests', samples)
+            metric('trivia_db_queries_total', 'counter',
+                   'SQL queries issued while handling requests',
+                   [('', {'endpoint': route}, stats['queries'])
+                    for route, stats in routes])
+            metric('trivia_db_duration_seconds_total', 'counter',
+                   'Time spent in SQL queries while handling requests',
+                   [('', {'endpoint': route}, round(stats['db_duration'], 6))
+                    for route, stats in routes])
+            metric('trivia_slow_queries_total', 'counter',
+                   'SQL queries slower than the slow query threshold',
+                   [('', {}, self.slow_queries)])
+
+        for name, kind, help_text, collect in self._collectors:
+            value = collect()
+            if not isinstance(value, list):
+                value = [({}, value)]
+            metric(name, kind, help_text,
+                   [('', labels, sample) for labels, sample in value])
+        return '\n'.join(lines) + '\n'
+
+
+# SQLAlchemy engine events are installed once for every engine,
+# each query is then reported to the metrics of the current app
+def install_engine_events():
+    global _engine_events_installed
+    with _install_lock:
+        if _engine_events_installed:
+            return
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _engine_events_installed = True
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = conn.info['query_started'].pop()
+    if not has_app_context():
+        return
+    metrics = current_app.extensions.get('metrics')
+    if metrics is not None:
+        metrics.query_finished(statement, time.perf_counter() - started)
+
+
+# A failed query never reaches after_cursor_execute
+def _handle_error(context):
+    if context.connection is not None:
+        started = context.connection.info.get('query_started')
+        if started:
+            started.pop()
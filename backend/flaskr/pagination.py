@@ -0,0 +1,121 @@
+import base64
+import json
+
+from sqlalchemy import tuple_
+
+from models import Question
+from .services import question_rows, question_dicts, QUESTION_KEYS
+
+# Direction markers stored inside a cursor
+NEXT = 'n'
+PREV = 'p'
+
+
+# Encodes the (category, id) keyset of a question into an opaque cursor
+def encode_cursor(direction, quest):
+    raw = json.dumps([direction, quest['category'], quest['id']])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+# Decodes a cursor into (direction, category, id),
+# raises ValueError if the cursor is malformed
+def decode_cursor(cursor):
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode((cursor + padding).encode())
+        direction, category, quest_id = json.loads(raw.decode())
+        quest_id = int(quest_id)
+        if category is not None:
+            category = int(category)
+    except (TypeError, ValueError):
+        raise ValueError('malformed cursor')
+    if direction not in (NEXT, PREV):
+        raise ValueError('malformed cursor')
+    return direction, category, quest_id
+
+
+# Plans the reads of one keyset page in the order they are made:
+# returns (direction, segments) where each segment is (categorized, bound,
+# descending), the questions with a category ordered by (category, id) or
+# those without one ordered by id, after (before when descending) the
+# (category, id) keyset "bound" if any
+# Questions without a category (their category was deleted) come after
+# all the others: NULL never compares in a row value, so they are read
+# apart on "category IS NULL", which the (category, id) index serves too
+def keyset_segments(cursor):
+    if not cursor:
+        return NEXT, [(True, None, False), (False, None, False)]
+    direction, category, quest_id = decode_cursor(cursor)
+    bound = (category, quest_id)
+    if direction == NEXT and category is None:
+        return NEXT, [(False, bound, False)]
+    if direction == NEXT:
+        return NEXT, [(True, bound, False), (False, None, False)]
+    if category is None:
+        return PREV, [(False, bound, True), (True, None, True)]
+    return PREV, [(True, bound, True)]
+
+
+# Cuts the questions read for a page, one more than "limit" when there is
+# a page after it, into (questions, next_cursor, prev_cursor)
+def cursor_page(quests, limit, direction, cursor):
+    has_more = len(quests) > limit
+    quests = quests[:limit]
+    if direction == PREV:
+        quests.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, bool(cursor)
+
+    next_cursor = None
+    prev_cursor = None
+    if quests and has_next:
+        next_cursor = encode_cursor(NEXT, quests[-1])
+    if quests and has_prev:
+        prev_cursor = encode_cursor(PREV, quests[0])
+    return quests, next_cursor, prev_cursor
+
+
+# Queries one page of at most "limit" questions ordered by (category, id)
+# that come after (or before, for a previous cursor) the cursor's keyset,
+# an empty cursor starts at the first page
+# Returns (questions, next_cursor, prev_cursor), a missing cursor is None
+# Only the question keys of "fields" are returned, the category is
+# queried anyway since cursors are made of it
+def keyset_page(cursor, limit, fields=QUESTION_KEYS):
+    queried = fields
+    if 'category' not in fields:
+        queried = fields + ('category',)
+    direction, segments = keyset_segments(cursor)
+
+    # One extra row tells whether there is a page after this one
+    quests = []
+    for categorized, bound, descending in segments:
+        quests_query = question_rows(queried)
+        if categorized:
+            quests_query = quests_query.filter(Question.category.isnot(None))
+            order = [Question.category, Question.id]
+            keyset = tuple_(Question.category, Question.id)
+            key = bound and tuple_(*bound)
+        else:
+            quests_query = quests_query.filter(Question.category.is_(None))
+            order = [Question.id]
+            keyset = Question.id
+            key = bound and bound[1]
+        if bound is not None:
+            quests_query = quests_query.filter(
+                keyset < key if descending else keyset > key)
+        quests_query = quests_query.order_by(*[
+            column.desc() if descending else column.asc()
+            for column in order])
+        quests.extend(question_dicts(
+            quests_query.limit(limit + 1 - len(quests)), queried))
+        if len(quests) > limit:
+            break
+
+    quests, next_cursor, prev_cursor = cursor_page(
+        quests, limit, direction, cursor)
+    if queried is not fields:
+        for quest in quests:
+            del quest['category']
+    return quests, next_cursor, prev_cursor
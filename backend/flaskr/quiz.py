@@ -0,0 +1,353 @@
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from models import Question, db, on_question_change
+from .bulk import DIFFICULTIES
+
+# Random draws that may hit an already asked question
+# before the remaining candidates are listed instead
+MAX_RANDOM_TRIES = 8
+
+
+# Question IDs of one (category, difficulty) pair, a list plus the
+# position of each ID in it so adding, removing and drawing are all O(1)
+class Bucket:
+    def __init__(self):
+        self.ids = []
+        self.positions = {}
+
+    def add(self, quest_id):
+        if quest_id in self.positions:
+            return
+        self.positions[quest_id] = len(self.ids)
+        self.ids.append(quest_id)
+
+    # The last ID takes the place of the removed one
+    def remove(self, quest_id):
+        position = self.positions.pop(quest_id, None)
+        if position is None:
+            return
+        last = self.ids.pop()
+        if last != quest_id:
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def __len__(self):
+        return len(self.ids)
+
+
+# In-memory index of question IDs bucketed by (category, difficulty)
+# that quizzes draw from, so a draw costs the same at any corpus size
+# It is loaded from "loader" (rows of (id, category, difficulty)) on first
+# use, kept current by the question change listeners and reloaded after
+# "ttl" seconds to pick up writes of other processes
+class QuestionBuckets:
+    def __init__(self, ttl=60, loader=None):
+        self.ttl = ttl
+        self.loader = loader
+        self._buckets = None
+        self._keys = {}
+        self._loaded_at = 0
+        self._lock = threading.RLock()
+
+    def expired(self):
+        return (self._buckets is None
+                or time.monotonic() - self._loaded_at > self.ttl)
+
+    # Replaces the index with rows of (id, category, difficulty)
+    def load(self, rows):
+        buckets = defaultdict(Bucket)
+        keys = {}
+        for quest_id, category, difficulty in rows:
+            keys[quest_id] = (category, difficulty)
+            buckets[(category, difficulty)].add(quest_id)
+        with self._lock:
+            self._buckets = buckets
+            self._keys = keys
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self.expired() and self.loader is not None:
+            self.load(self.loader())
+
+    def add(self, quest_id, category, difficulty):
+        with self._lock:
+            if self._buckets is None:
+                return
+            self.remove(quest_id)
+            self._keys[quest_id] = (category, difficulty)
+            self._buckets[(category, difficulty)].add(quest_id)
+
+    def remove(self, quest_id):
+        with self._lock:
+            if self._buckets is None:
+                return
+            key = self._keys.pop(quest_id, None)
+            if key is not None:
+                self._buckets[key].remove(quest_id)
+
+    def question_changed(self, action, quests):
+        with self._lock:
+            # Not loaded yet, the first draw loads the current table
+            if self._buckets is None:
+                return
+            if action == 'reset':
+                self._buckets = None
+            elif action == 'insert':
+                for quest in quests:
+                    self.add(quest['id'], quest['category'],
+                             quest['difficulty'])
+            elif action == 'delete':
+                for quest in quests:
+                    self.remove(quest['id'])
+
+    # Buckets of the categories (None for all) and difficulties
+    def _selected(self, category_ids, difficulties):
+        return [bucket for (category, difficulty), bucket
+                in self._buckets.items()
+                if (category_ids is None or category in category_ids)
+                and difficulty in difficulties and len(bucket)]
+
+    def count(self, category_ids, difficulties):
+        with self._lock:
+            self._ensure_loaded()
+            return sum(len(bucket) for bucket
+                       in self._selected(category_ids, difficulties))
+
+    def matches(self, quest_id, category_ids, difficulties):
+        with self._lock:
+            self._ensure_loaded()
+            key = self._keys.get(quest_id)
+            return key is not None and key[1] in difficulties and (
+                category_ids is None or key[0] in category_ids)
+
+    # Returns a random question ID of the categories (None for all) and
+    # difficulties that isn't in "exclude", None when there is none left
+    def random_id(self, category_ids, difficulties, exclude=()):
+        with self._lock:
+            self._ensure_loaded()
+            buckets = self._selected(category_ids, difficulties)
+            total = sum(len(bucket) for bucket in buckets)
+            if not total:
+                return None
+            for _ in range(MAX_RANDOM_TRIES):
+                pick = random.randrange(total)
+                for bucket in buckets:
+                    if pick < len(bucket):
+                        quest_id = bucket.ids[pick]
+                        break
+                    pick -= len(bucket)
+                if quest_id not in exclude:
+                    return quest_id
+            # Most candidates were asked already, so the others are listed
+            candidates = [quest_id for bucket in buckets
+                          for quest_id in bucket.ids
+                          if quest_id not in exclude]
+            return random.choice(candidates) if candidates else None
+
+
+question_buckets = QuestionBuckets(loader=lambda: db.session.query(
+    Question.id, Question.category, Question.difficulty))
+on_question_change(question_buckets.question_changed)
+
+
+# Reads the filters of a new quiz from the JSON body of POST /quizzes:
+# the quiz_category ({"id": 0} for all) or a list of quiz_categories,
+# a difficulty range ({"min": 1, "max": 5}), the adaptive flag and
+# the previous_questions to leave out
+# Returns (category IDs or None for all, difficulties, adaptive,
+# previous question IDs), raises ValueError on invalid filters
+def parse_quiz_filters(data):
+    try:
+        if data.get('quiz_categories'):
+            if not isinstance(data['quiz_categories'], list):
+                raise ValueError('quiz_categories is not a list')
+            category_ids = frozenset(
+                int(cat_id) for cat_id in data['quiz_categories'])
+        else:
+            category_ids = frozenset([int(data['quiz_category']['id'])])
+        difficulty = data.get('difficulty') or {}
+        low = int(difficulty.get('min', DIFFICULTIES[0]))
+        high = int(difficulty.get('max', DIFFICULTIES[-1]))
+        previous = [int(quest_id)
+                    for quest_id in data.get('previous_questions', [])]
+    except (AttributeError, KeyError, TypeError):
+        raise ValueError('malformed quiz filters')
+    if low not in DIFFICULTIES or high not in DIFFICULTIES or low > high:
+        raise ValueError('invalid difficulty range')
+    # When selecting "ALL" the value 0 is sent
+    if 0 in category_ids:
+        category_ids = None
+    return (category_ids, tuple(range(low, high + 1)),
+            bool(data.get('adaptive', False)), previous)
+
+
+# A single quiz being played: its filters and the IDs that were
+# already asked, questions are drawn at random from the buckets
+# In adaptive mode questions are drawn from the current difficulty level,
+# which goes up after a correct answer and down after a wrong one
+# The score counts the correct answers checked by the server
+# Requests of one client may overlap, so a session changes under its lock
+class QuizSession:
+    def __init__(self, session_id, buckets, category_ids, difficulties,
+                 adaptive=False, asked=()):
+        self.id = session_id
+        self.buckets = buckets
+        self.category_ids = category_ids
+        self.difficulties = difficulties
+        self.adaptive = adaptive
+        self.level = difficulties[0]
+        self.asked = set(asked)
+        self.current = None
+        self.answers = {}
+        self.score = 0
+        self.last_seen = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Draws a question ID that wasn't asked yet,
+    # returns None once every question was asked
+    def draw(self):
+        with self._lock:
+            return self._draw()
+
+    def _draw(self):
+        if self.adaptive:
+            # The nearest levels stand in for an exhausted one
+            levels = [(level,) for level in sorted(
+                self.difficulties,
+                key=lambda level: (abs(level - self.level), level))]
+        else:
+            levels = [self.difficulties]
+        for difficulties in levels:
+            quest_id = self.buckets.random_id(
+                self.category_ids, difficulties, self.asked)
+            if quest_id is not None:
+                self.asked.add(quest_id)
+                self.current = quest_id
+                return quest_id
+        self.current = None
+        return None
+
+    # Records the checked answer of the question just drawn, answers to
+    # other questions or given again don't count
+    # Returns whether the answer was recorded
+    def record_answer(self, quest_id, correct):
+        with self._lock:
+            if quest_id != self.current or quest_id in self.answers:
+                return False
+            self.answers[quest_id] = correct
+            self.score += correct
+            self._answered(correct)
+            return True
+
+    # The score and the number of answered questions
+    def result(self):
+        with self._lock:
+            return self.score, len(self.answers)
+
+    def answered(self, correct):
+        with self._lock:
+            self._answered(correct)
+
+    def _answered(self, correct):
+        if correct:
+            self.level = min(self.level + 1, self.difficulties[-1])
+        else:
+            self.level = max(self.level - 1, self.difficulties[0])
+
+    @property
+    def remaining(self):
+        with self._lock:
+            asked = list(self.asked)
+        asked = sum(1 for quest_id in asked if self.buckets.matches(
+            quest_id, self.category_ids, self.difficulties))
+        return self.buckets.count(
+            self.category_ids, self.difficulties) - asked
+
+
+# In-process store of running quiz sessions, sessions that were not used
+# for "ttl" seconds expire and the least recently used session is evicted
+# once "max_sessions" are held so memory stays bounded
+class QuizSessionStore:
+    def __init__(self, ttl=3600, max_sessions=10000, buckets=None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.buckets = question_buckets if buckets is None else buckets
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Creates a session drawing from the filters of parse_quiz_filters,
+    # one that isn't "stored" has no ID and lasts a single request
+    def create(self, category_ids, difficulties, adaptive=False, asked=(),
+               stored=True):
+        if not stored:
+            return QuizSession(None, self.buckets, category_ids,
+                               difficulties, adaptive, asked)
+        session = QuizSession(
+            secrets.token_urlsafe(16), self.buckets, category_ids,
+            difficulties, adaptive, asked)
+        with self._lock:
+            self._expire()
+            self._sessions[session.id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session
+
+    # Returns the session with that ID, or None if it is unknown or expired
+    # (or not an ID string at all)
+    def get(self, session_id):
+        if not isinstance(session_id, str):
+            return None
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_seen = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    # Returns the session a POST /quizzes body plays: the one of its
+    # quiz_session ID, else a new one from its filters which is stored
+    # when the body sends "quiz_session" (null to start one) or is
+    # adaptive, as following the answers needs the session
+    # Clients only sending previous_questions get a session that isn't
+    # stored, so their calls don't evict the sessions of real quizzes
+    # Raises ValueError on invalid filters
+    def play(self, data):
+        session = None
+        if data.get('quiz_session'):
+            if not isinstance(data['quiz_session'], str):
+                raise ValueError('malformed quiz session')
+            session = self.get(data['quiz_session'])
+        # Adaptive quizzes follow how the last question was answered
+        if session is not None and 'last_answer_correct' in data:
+            session.answered(bool(data['last_answer_correct']))
+        # No (or an expired) session, so one starts from the filters
+        # excluding the previous questions' IDs
+        if session is None:
+            category_ids, difficulties, adaptive, previous = \
+                parse_quiz_filters(data)
+            session = self.create(
+                category_ids, difficulties, adaptive, previous,
+                stored='quiz_session' in data or adaptive)
+        return session
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    # Sessions are kept in least recently used order
+    # so expired ones are always at the front
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_seen >= deadline:
+                break
+            self._sessions.popitem(last=False)
@@ -0,0 +1,228 @@
+import bisect
+import re
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import func, literal_column, or_
+
+from models import Question, db, on_question_change, question_counts
+from .services import question_rows, question_dicts, get_questions, \
+    count_questions, QUESTION_KEYS
+
+# Words are runs of letters and digits, matched case insensitively
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Answer matches count for less than question matches when ranking
+ANSWER_WEIGHT = 0.5
+
+# The 'simple' configuration neither stems nor drops stop words, so
+# short words such as "what" can still be searched for like with ILIKE
+TS_CONFIG = literal_column("'simple'")
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+# Searches questions whose words start with every word of "term"
+# (prefix matching like a search box expects), optionally matching
+# answers too, and returns (total_results, questions) for the requested
+# slice of the ranked results, an empty term matches every question
+# Only the question keys of "fields" are queried and returned
+def full_text_search(term, include_answers=False, offset=0,
+                     limit=None, fields=QUESTION_KEYS):
+    words = tokenize(term)
+    if not words:
+        return question_counts.total(), question_dicts(
+            question_rows(fields).order_by(
+                Question.id.asc()).offset(offset).limit(limit), fields)
+    if db.engine.dialect.name == 'postgresql':
+        return _search_postgres(words, include_answers, offset, limit,
+                                fields)
+    return _search_memory(words, include_answers, offset, limit, fields)
+
+
+# Same expression as the GIN indexes of the search indexes migration,
+# Postgres keeps them up to date on every insert and delete
+def _tsvector(column):
+    return func.to_tsvector(
+        TS_CONFIG, func.coalesce(column, literal_column("''")))
+
+
+def _search_postgres(words, include_answers, offset, limit, fields):
+    # Words only hold \w characters so they can't break the tsquery syntax
+    tsquery = func.to_tsquery(
+        TS_CONFIG, ' & '.join(word + ':*' for word in words))
+    question_tsv = _tsvector(Question.question)
+    match = question_tsv.op('@@')(tsquery)
+    rank = func.ts_rank(question_tsv, tsquery)
+    if include_answers:
+        answer_tsv = _tsvector(Question.answer)
+        match = or_(match, answer_tsv.op('@@')(tsquery))
+        rank = rank + ANSWER_WEIGHT * func.ts_rank(answer_tsv, tsquery)
+
+    total = count_questions(match)
+    return total, question_dicts(
+        question_rows(fields).filter(match).order_by(
+            rank.desc(), Question.id.asc()).offset(offset).limit(limit),
+        fields)
+
+
+def _search_memory(words, include_answers, offset, limit, fields):
+    ranked_ids = question_index.search(words, include_answers)
+    end = None if limit is None else offset + limit
+    return len(ranked_ids), get_questions(ranked_ids[offset:end], fields)
+
+
+# Postings of one text column: word -> {question id: occurrences},
+# words are also kept sorted so all words with a prefix are found by bisect
+class FieldIndex:
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.lengths = {}
+        self.words = []
+
+    def add(self, quest_id, text):
+        for word in self._add(quest_id, text):
+            bisect.insort(self.words, word)
+
+    # Adds the (id, text) rows to an index built in one go, its words are
+    # sorted once instead of inserted in order one at a time
+    def load(self, rows):
+        for quest_id, text in rows:
+            self._add(quest_id, text)
+        self.words = sorted(self.postings)
+
+    # Returns the words that weren't indexed yet
+    def _add(self, quest_id, text):
+        tokens = tokenize(text)
+        self.lengths[quest_id] = len(tokens) or 1
+        new_words = []
+        for word in tokens:
+            postings = self.postings[word]
+            if not postings:
+                new_words.append(word)
+            postings[quest_id] = postings.get(quest_id, 0) + 1
+        return new_words
+
+    def remove(self, quest_id, text):
+        self.lengths.pop(quest_id, None)
+        for word in set(tokenize(text)):
+            postings = self.postings.get(word)
+            if postings is None:
+                continue
+            postings.pop(quest_id, None)
+            if not postings:
+                del self.postings[word]
+                index = bisect.bisect_left(self.words, word)
+                if index < len(self.words) and self.words[index] == word:
+                    del self.words[index]
+
+    # Returns {question id: score} of questions with a word
+    # starting with "prefix", scored by occurrences per word
+    def match_prefix(self, prefix):
+        scores = defaultdict(float)
+        index = bisect.bisect_left(self.words, prefix)
+        while index < len(self.words) and \
+                self.words[index].startswith(prefix):
+            for quest_id, count in self.postings[self.words[index]].items():
+                scores[quest_id] += count / self.lengths[quest_id]
+            index += 1
+        return scores
+
+
+# In-memory inverted index over questions and answers used where the
+# database has no full-text search, it is built from "loader" (rows of
+# (id, question, answer)) on first use, kept up to date through the
+# question change listeners and rebuilt after "ttl" seconds to pick up
+# writes of other processes
+class QuestionIndex:
+    def __init__(self, ttl=60, loader=None):
+        self.ttl = ttl
+        self.loader = loader
+        self.question = None
+        self.answer = None
+        self.texts = {}
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    # Replaces the index with rows of (id, question, answer), e.g. read
+    # by the ASGI app through its async driver
+    def load(self, rows):
+        with self._lock:
+            self._load(rows)
+
+    def expired(self):
+        return (self.question is None
+                or time.monotonic() - self._loaded_at > self.ttl)
+
+    def _ensure_loaded(self):
+        if self.expired() and self.loader is not None:
+            self._load(self.loader())
+
+    def _load(self, rows):
+        self.texts = {quest_id: (question, answer)
+                      for quest_id, question, answer in rows}
+        self.question = FieldIndex()
+        self.question.load((quest_id, question) for quest_id, (question, _)
+                           in self.texts.items())
+        self.answer = FieldIndex()
+        self.answer.load((quest_id, answer) for quest_id, (_, answer)
+                         in self.texts.items())
+        self._loaded_at = time.monotonic()
+
+    def _add(self, quest_id, question, answer):
+        self.texts[quest_id] = (question, answer)
+        self.question.add(quest_id, question)
+        self.answer.add(quest_id, answer)
+
+    def _remove(self, quest_id):
+        if quest_id not in self.texts:
+            return
+        question, answer = self.texts.pop(quest_id)
+        self.question.remove(quest_id, question)
+        self.answer.remove(quest_id, answer)
+
+    # Returns the IDs of questions matching every word, best match first
+    def search(self, words, include_answers=False):
+        with self._lock:
+            self._ensure_loaded()
+            if self.question is None:
+                return []
+            scores = None
+            for word in words:
+                word_scores = self.question.match_prefix(word)
+                if include_answers:
+                    for quest_id, score in \
+                            self.answer.match_prefix(word).items():
+                        word_scores[quest_id] += ANSWER_WEIGHT * score
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {quest_id: score + word_scores[quest_id]
+                              for quest_id, score in scores.items()
+                              if quest_id in word_scores}
+                if not scores:
+                    return []
+            return sorted(scores, key=lambda quest_id:
+                          (-scores[quest_id], quest_id))
+
+    def question_changed(self, action, quests):
+        with self._lock:
+            # Not built yet, the first search loads the current table
+            if self.question is None:
+                return
+            if action == 'reset':
+                self.question = None
+            elif action == 'insert':
+                for quest in quests:
+                    self._add(quest['id'], quest['question'], quest['answer'])
+            elif action == 'delete':
+                for quest in quests:
+                    self._remove(quest['id'])
+
+
+question_index = QuestionIndex(loader=lambda: db.session.query(
+    Question.id, Question.question, Question.answer))
+on_question_change(question_index.question_changed)
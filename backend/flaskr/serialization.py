@@ -0,0 +1,40 @@
+import json
+
+from flask import current_app
+
+# orjson is optional, the standard library encoder is used without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Serializes "obj" to JSON bytes, with orjson when it is installed which
+# is several times faster on long question lists, keys are sorted like
+# jsonify does by default so identical data gives identical bodies (ETags)
+def dumps(obj, sort_keys=True):
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=option)
+        # e.g. integers beyond 64 bits, which the standard library handles
+        except TypeError:
+            pass
+    return json.dumps(obj, sort_keys=sort_keys,
+                      separators=(',', ':')).encode()
+
+
+# Drop-in replacement of flask.jsonify serializing with dumps()
+def jsonify(*args, **kwargs):
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both '
+                        'args and kwargs')
+    if len(args) == 1:
+        data = args[0]
+    else:
+        data = args or kwargs
+    return current_app.response_class(
+        dumps(data, current_app.config['JSON_SORT_KEYS']) + b'\n',
+        mimetype=current_app.config['JSONIFY_MIMETYPE'])
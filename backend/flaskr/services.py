@@ -0,0 +1,89 @@
+from sqlalchemy import func
+from werkzeug.exceptions import NotFound
+
+from models import Question, db
+
+# Columns of a formatted question, in the order of Question.format()
+QUESTION_COLUMNS = (Question.id, Question.question, Question.answer,
+                    Question.category, Question.difficulty)
+QUESTION_KEYS = tuple(column.key for column in QUESTION_COLUMNS)
+COLUMNS_BY_KEY = dict(zip(QUESTION_KEYS, QUESTION_COLUMNS))
+
+
+# Reads the "fields" argument of the question list routes, a comma
+# separated list of question keys, into the keys to query and return in
+# Question.format() order, the ID is always included
+# A missing argument selects every key, raises ValueError on unknown keys
+def parse_fields(value):
+    if value is None:
+        return QUESTION_KEYS
+    names = set(name.strip() for name in value.split(',') if name.strip())
+    if names - set(QUESTION_KEYS):
+        raise ValueError('unknown question fields')
+    return tuple(key for key in QUESTION_KEYS
+                 if key == 'id' or key in names)
+
+
+# Query of the question columns only, its rows are plain tuples so no
+# Question objects are built nor tracked by the session's identity map
+# "fields" narrows it to some columns (see parse_fields)
+def question_rows(fields=QUESTION_KEYS):
+    return db.session.query(*(COLUMNS_BY_KEY[key] for key in fields))
+
+
+# Formats rows of question_rows() the way Question.format() does
+def question_dicts(rows, fields=QUESTION_KEYS):
+    return [dict(zip(fields, row)) for row in rows]
+
+
+# Categories of formatted questions in order of first appearance,
+# empty when their category wasn't selected
+def question_categories(quests):
+    current_cats = []
+    for quest in quests:
+        cat = quest.get('category')
+        if cat is not None and cat not in current_cats:
+            current_cats.append(cat)
+    return current_cats
+
+
+# Returns the formatted question of an ID, None if there is none
+def get_question(quest_id):
+    row = question_rows().filter(Question.id == quest_id).first()
+    return None if row is None else dict(zip(QUESTION_KEYS, row))
+
+
+# Returns the formatted questions of some IDs, in the order of the IDs,
+# IDs without a question are left out
+def get_questions(quest_ids, fields=QUESTION_KEYS):
+    if not quest_ids:
+        return []
+    quests = {quest['id']: quest for quest in question_dicts(
+        question_rows(fields).filter(Question.id.in_(quest_ids)), fields)}
+    return [quests[quest_id] for quest_id in quest_ids
+            if quest_id in quests]
+
+
+# Returns one page of formatted questions ordered by category then ID,
+# raises NotFound for pages past the last one like paginate() did
+def questions_page(page, per_page, fields=QUESTION_KEYS):
+    if page < 1:
+        raise NotFound()
+    quests = question_dicts(question_rows(fields).order_by(
+        Question.category.asc(), Question.id.asc()).limit(per_page).offset(
+        (page - 1) * per_page), fields)
+    if not quests and page != 1:
+        raise NotFound()
+    return quests
+
+
+# Returns the formatted questions of a category
+def category_questions(cat_id, fields=QUESTION_KEYS):
+    return question_dicts(
+        question_rows(fields).filter(Question.category == cat_id), fields)
+
+
+# Counts the questions matching a filter
+def count_questions(*criteria):
+    return db.session.query(func.count(Question.id)).filter(
+        *criteria).scalar()
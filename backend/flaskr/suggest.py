@@ -0,0 +1,130 @@
+import bisect
+import threading
+import time
+
+from models import Question, db, on_question_change
+from .search import FieldIndex, tokenize
+
+# Suggestions returned by default and at most
+SUGGESTIONS_PER_PREFIX = 10
+MAX_SUGGESTIONS = 20
+
+# Questions considered for one suggestion list before ranking them,
+# and postings looked at to find them, so a prefix shared by most
+# questions costs no more than a rare one
+MAX_CANDIDATES = 200
+MAX_SCANNED = 2000
+
+
+# In-memory prefix index of the words of questions and answers for the
+# search box typeahead: the sorted words of a FieldIndex are bisected to
+# the prefix and their postings are read in word order until enough
+# candidates are found
+# It is built from the questions table before the first request, kept up
+# to date through the question change listeners and rebuilt after "ttl"
+# seconds to pick up writes of other processes
+class SuggestionIndex:
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.terms = None
+        self.titles = {}
+        self.tokens = {}
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def expired(self):
+        return (self.terms is None
+                or time.monotonic() - self._loaded_at > self.ttl)
+
+    def build(self):
+        with self._lock:
+            self._build()
+
+    def _build(self):
+        self.terms = FieldIndex()
+        self.titles = {}
+        self.tokens = {}
+        quests = db.session.query(
+            Question.id, Question.question, Question.answer)
+        self.terms.load(self._indexed(quest_id, question, answer)
+                        for quest_id, question, answer in quests)
+        self._loaded_at = time.monotonic()
+
+    def _add(self, quest_id, question, answer):
+        self.terms.add(*self._indexed(quest_id, question, answer))
+
+    # Keeps the title and words of a question,
+    # returns its (id, text) for the FieldIndex
+    def _indexed(self, quest_id, question, answer):
+        text = '{} {}'.format(question or '', answer or '')
+        self.titles[quest_id] = question
+        self.tokens[quest_id] = frozenset(tokenize(text))
+        return quest_id, text
+
+    def _remove(self, quest_id):
+        if quest_id not in self.titles:
+            return
+        self.terms.remove(
+            quest_id, ' '.join(self.tokens.pop(quest_id)))
+        del self.titles[quest_id]
+
+    # Returns up to "limit" {"id", "question"} suggestions for the text
+    # typed so far: its last word may be incomplete, the words before it
+    # must appear whole in the question or its answer
+    # Questions with the exact word come first, then shorter questions
+    def suggest(self, text, limit=SUGGESTIONS_PER_PREFIX):
+        words = tokenize(text)
+        if not words:
+            return []
+        *complete, prefix = words
+        complete = frozenset(complete)
+        limit = min(limit, MAX_SUGGESTIONS)
+        with self._lock:
+            if self.expired():
+                self._build()
+            sorted_words = self.terms.words
+            candidates = []
+            seen = set()
+            scanned = 0
+            index = bisect.bisect_left(sorted_words, prefix)
+            while (index < len(sorted_words)
+                   and sorted_words[index].startswith(prefix)
+                   and len(candidates) < MAX_CANDIDATES
+                   and scanned < MAX_SCANNED):
+                word = sorted_words[index]
+                for quest_id in self.terms.postings[word]:
+                    scanned += 1
+                    if (quest_id in seen
+                            or not complete <= self.tokens[quest_id]):
+                        continue
+                    seen.add(quest_id)
+                    candidates.append((word != prefix,
+                                       len(self.titles[quest_id] or ''),
+                                       quest_id))
+                    if (len(candidates) >= MAX_CANDIDATES
+                            or scanned >= MAX_SCANNED):
+                        break
+                index += 1
+            candidates.sort()
+            return [{'id': quest_id, 'question': self.titles[quest_id]}
+                    for _, _, quest_id in candidates[:limit]]
+
+    def question_changed(self, action, quests):
+        with self._lock:
+            # Not built yet, the first request builds it
+            if self.terms is None:
+                return
+            if action == 'reset':
+                self.terms = None
+            elif action == 'insert':
+                for quest in quests:
+                    self._remove(quest['id'])
+                    self._add(quest['id'], quest['question'],
+                              quest['answer'])
+            elif action == 'delete':
+                for quest in quests:
+                    self._remove(quest['id'])
+
+
+suggestion_index = SuggestionIndex()
+on_question_change(suggestion_index.question_changed)
@@ -0,0 +1,18 @@
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '127.0.0.1:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('THREADS', 1))
+
+# The app is imported and created once in the master, workers are forked
+# with it instead of each importing it again
+preload_app = True
+
+
+# Database connections must not be shared across processes, a worker
+# drops any connection the master opened and opens its own on first use
+def post_fork(server, worker):
+    from models import dispose_engines
+    from wsgi import app
+    dispose_engines(app)
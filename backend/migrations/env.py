@@ -0,0 +1,55 @@
+import os
+import sys
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine
+
+# models lives in the backend directory, one level up
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from models import get_database_path, db  # noqa: E402
+
+config = context.config
+target_metadata = db.metadata
+
+# models.migrate_db hands over its own connection, the alembic command line
+# connects to get_database_path() (DATABASE_URL or the .env credentials)
+connection = config.attributes.get('connection')
+
+# Logging is only configured when run from the alembic command line
+# so the app's loggers are left alone
+if connection is None and config.config_file_name:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+
+def run_migrations_offline():
+    context.configure(
+        url=get_database_path(),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=True
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online(connection):
+    # Batch mode lets SQLite alter columns and constraints
+    # by copying the table
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        render_as_batch=True
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+elif connection is not None:
+    run_migrations_online(connection)
+else:
+    with create_engine(get_database_path()).connect() as connection:
+        run_migrations_online(connection)
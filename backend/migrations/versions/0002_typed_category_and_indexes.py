@@ -0,0 +1,63 @@
+"""integer category with a foreign key, question indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:01
+
+questions.category becomes an integer referencing categories (trivia.psql
+already declares both, db.create_all() made it a string without a key),
+and the category and difficulty lookups get indexes
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# (category, id) serves category filters, the category ordering of
+# GET /questions and its keyset pagination
+INDEXES = [
+    ('ix_questions_category_id', ['category', 'id']),
+    ('ix_questions_category_difficulty', ['category', 'difficulty']),
+    ('ix_questions_difficulty', ['difficulty']),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {column['name']: column
+               for column in inspector.get_columns('questions')}
+    retype = not isinstance(columns['category']['type'], sa.Integer)
+    add_key = not any(key['referred_table'] == 'categories'
+                      for key in inspector.get_foreign_keys('questions'))
+    if retype or add_key:
+        with op.batch_alter_table('questions') as batch_op:
+            if retype:
+                batch_op.alter_column(
+                    'category', type_=sa.Integer(),
+                    existing_type=sa.String(),
+                    postgresql_using='category::integer')
+            if add_key:
+                batch_op.create_foreign_key(
+                    'category', 'categories', ['category'], ['id'],
+                    onupdate='CASCADE', ondelete='SET NULL')
+
+    existing = {index['name'] for index in inspector.get_indexes('questions')}
+    for name, columns in INDEXES:
+        if name not in existing:
+            op.create_index(name, 'questions', columns)
+
+
+def downgrade():
+    for name, columns in reversed(INDEXES):
+        op.drop_index(name, table_name='questions')
+    with op.batch_alter_table('questions') as batch_op:
+        batch_op.drop_constraint('category', type_='foreignkey')
+        batch_op.alter_column(
+            'category', type_=sa.String(), existing_type=sa.Integer(),
+            postgresql_using='category::varchar')
@@ -0,0 +1,39 @@
+"""full-text search indexes
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:02
+
+Expression GIN indexes the Postgres question search runs against,
+other databases search through the in-memory index instead
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_questions_question_tsv', 'question'),
+    ('ix_questions_answer_tsv', 'answer'),
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name, column in INDEXES:
+        op.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON questions "
+            f"USING GIN (to_tsvector('simple', coalesce({column}, '')))")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name, column in INDEXES:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
@@ -0,0 +1,50 @@
+"""quiz results and materialized leaderboard
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:03
+
+quiz_results holds every submitted quiz score, leaderboard the top players
+per category rebuilt from it, so scoreboard reads never scan the results
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'quiz_results',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('player', sa.String(50), nullable=False),
+        sa.Column('score', sa.Integer(), nullable=False),
+        sa.Column('questions', sa.Integer(), nullable=False),
+        sa.Column('category', sa.Integer(),
+                  sa.ForeignKey('categories.id', name='quiz_result_category',
+                                onupdate='CASCADE', ondelete='SET NULL')),
+        sa.Column('created_at', sa.DateTime(), nullable=False)
+    )
+    op.create_table(
+        'leaderboard',
+        sa.Column('category', sa.Integer(), primary_key=True,
+                  autoincrement=False),
+        sa.Column('rank', sa.Integer(), primary_key=True,
+                  autoincrement=False),
+        sa.Column('player', sa.String(50), nullable=False),
+        sa.Column('total_score', sa.Integer(), nullable=False),
+        sa.Column('games', sa.Integer(), nullable=False),
+        sa.Column('best_score', sa.Integer(), nullable=False),
+        sa.Column('refreshed_at', sa.DateTime(), nullable=False)
+    )
+
+
+def downgrade():
+    op.drop_table('leaderboard')
+    op.drop_table('quiz_results')
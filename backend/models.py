@@ -1,27 +1,206 @@
 # pylint: disable=no-member
 
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
-import json
+import threading
+import time
+from datetime import datetime
+from functools import lru_cache
+from sqlalchemy import Column, String, Integer, DateTime, ForeignKey, Index, event, inspect, func
+from sqlalchemy import orm
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
 from dotenv import load_dotenv
 
-load_dotenv()
 database_name = "trivia"
-database_path = "postgresql://{}:{}@{}/{}".format(os.getenv('DB_USER'),os.getenv('DB_PASSWORD'),'localhost:5432', database_name)
 
-db = SQLAlchemy()
+'''
+load_settings()
+    loads the .env file into the environment the first time settings are
+    read rather than when models is imported, variables already set win
+'''
+@lru_cache(maxsize=None)
+def load_settings():
+    load_dotenv()
+
+'''
+get_database_path()
+    the database URL, DATABASE_URL or one built from the DB_* credentials
+'''
+def get_database_path():
+    load_settings()
+    return os.getenv('DATABASE_URL') or "postgresql://{}:{}@{}/{}".format(os.getenv('DB_USER'),os.getenv('DB_PASSWORD'),os.getenv('DB_HOST', 'localhost:5432'), os.getenv('DB_NAME', database_name))
+
+'''
+RoutingSession
+    session that reads from the 'replica' bind while handling GET and HEAD
+    requests, or requests that set g.read_only (POST /batch), when a read
+    replica is configured (DB_REPLICA_URL), as long as it has nothing
+    pending to write, the primary otherwise
+'''
+class RoutingSession(SignallingSession):
+  def get_bind(self, mapper=None, clause=None):
+    binds = self.app.config.get('SQLALCHEMY_BINDS') or {}
+    if ('replica' in binds and has_request_context()
+        and (request.method in ('GET', 'HEAD') or g.get('read_only'))
+        and not (self.new or self.dirty or self.deleted)):
+      return get_state(self.app).db.get_engine(self.app, bind='replica')
+    return SignallingSession.get_bind(self, mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+db = RoutingSQLAlchemy()
+
+migrations_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
 
 '''
-setup_db(app)
-    binds a flask application and a SQLAlchemy service
+setup_db(app, database_path)
+    binds a flask application and a SQLAlchemy service, the database is
+    "database_path", else the app's SQLALCHEMY_DATABASE_URI, else the
+    environment's, the engine is tuned by the DB_* settings (engine_options)
+    the engine is only created on first use and the schema is left as is,
+    migrate_db (the init-db command) brings it up to date
 '''
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None):
+    database_path = database_path or app.config.get("SQLALCHEMY_DATABASE_URI") or get_database_path()
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config, database_path)
+    replica_path = config_value(app.config, 'DB_REPLICA_URL')
+    if replica_path:
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        binds['replica'] = replica_path
+        app.config["SQLALCHEMY_BINDS"] = binds
     db.app = app
     db.init_app(app)
-    db.create_all()
+    # Anything cached from a previously bound database is stale now
+    category_registry.invalidate()
+    question_counts.clear()
+    notify_question_change('reset', [])
+
+'''
+config_value(config, key, default, cast)
+    the "key" setting of the app config, else of the environment (.env),
+    converted by "cast", or "default" when it is set in neither
+'''
+def config_value(config, key, default=None, cast=str):
+    load_settings()
+    value = config.get(key, os.getenv(key))
+    if value is None or value == '':
+        return default
+    return cast(value)
+
+def as_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+'''
+engine_options(config, database_path)
+    the SQLAlchemy engine options of the app config's SQLALCHEMY_ENGINE_OPTIONS
+    completed with the settings:
+      DB_POOL_SIZE         connections kept open per process (5)
+      DB_MAX_OVERFLOW      extra connections opened under load (10)
+      DB_POOL_TIMEOUT      seconds to wait for a free connection (30)
+      DB_POOL_RECYCLE      seconds after which a connection is replaced (1800)
+      DB_POOL_PRE_PING     test connections before using them (off)
+      DB_STATEMENT_TIMEOUT milliseconds a PostgreSQL statement may run (none)
+    SQLite manages its own pool, so only pre-ping applies to it
+'''
+def engine_options(config, database_path):
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    if not database_path.startswith('sqlite'):
+        options.setdefault('pool_size', config_value(config, 'DB_POOL_SIZE', 5, int))
+        options.setdefault('max_overflow', config_value(config, 'DB_MAX_OVERFLOW', 10, int))
+        options.setdefault('pool_timeout', config_value(config, 'DB_POOL_TIMEOUT', 30, float))
+        options.setdefault('pool_recycle', config_value(config, 'DB_POOL_RECYCLE', 1800, int))
+    options.setdefault('pool_pre_ping', config_value(config, 'DB_POOL_PRE_PING', False, as_bool))
+    statement_timeout = config_value(config, 'DB_STATEMENT_TIMEOUT', None, int)
+    if statement_timeout and database_path.startswith('postgres'):
+        connect_args = dict(options.get('connect_args') or {})
+        connect_args['options'] = '-c statement_timeout={}'.format(statement_timeout)
+        options['connect_args'] = connect_args
+    return options
+
+'''
+pool_status(app)
+    the connections of each bind's pool ('primary' and 'replica') by state,
+    size (kept open), checkedin (idle), checkedout (in use) and overflow
+'''
+def pool_status(app):
+    status = {}
+    for bind in [None] + list(app.config.get("SQLALCHEMY_BINDS") or ()):
+        pool = db.get_engine(app, bind=bind).pool
+        status[bind or 'primary'] = {
+            state: getattr(pool, state)()
+            for state in ('size', 'checkedin', 'checkedout', 'overflow')
+            # only queue pools (not SQLite's) count their connections
+            if hasattr(pool, state)}
+    return status
+
+'''
+dispose_engines(app)
+    closes the connections of each bind's pool, a process forked after
+    they were opened (e.g. a preloaded gunicorn worker) opens its own
+'''
+def dispose_engines(app):
+    for bind in [None] + list(app.config.get("SQLALCHEMY_BINDS") or ()):
+        db.get_engine(app, bind=bind).dispose()
+
+'''
+migrate_db(revision)
+    upgrades the bound database schema to "revision" by running the
+    migrations of the migrations directory, which replaces db.create_all()
+'''
+def migrate_db(revision='head'):
+    # alembic is only imported by the commands that change the schema
+    from alembic import command
+    from alembic.config import Config
+    config = Config(os.path.join(migrations_path, 'alembic.ini'))
+    config.set_main_option('script_location', migrations_path)
+    with db.engine.begin() as connection:
+        config.attributes['connection'] = connection
+        command.upgrade(config, revision)
+
+'''
+on_question_change(listener)
+    registers listener(action, quests), called after questions are committed
+    with action 'insert' or 'delete' and the list of formatted questions,
+    an update is reported as a delete of the old row then an insert of the
+    new one, action 'reset' (with an empty list) means any question may have
+    changed and listeners should drop what they derived from the table
+'''
+question_listeners = []
+
+def on_question_change(listener):
+    question_listeners.append(listener)
+    return listener
+
+def notify_question_change(action, quests):
+    for listener in question_listeners:
+        listener(action, quests)
+
+'''
+DataGeneration
+    counter bumped after every committed question or category write,
+    whatever was derived from the tables stays valid while it is unchanged,
+    listeners are called after each bump (e.g. to bump a shared counter)
+'''
+class DataGeneration:
+    def __init__(self):
+        self.value = 0
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def bump(self, *args):
+        with self._lock:
+            self.value += 1
+        for listener in self.listeners:
+            listener()
+
+data_generation = DataGeneration()
+on_question_change(data_generation.bump)
 
 '''
 Question
@@ -29,11 +208,16 @@ Question
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  __table_args__ = (
+    Index('ix_questions_category_id', 'category', 'id'),
+    Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+    Index('ix_questions_difficulty', 'difficulty'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
-  category = Column(String)
+  category = Column(Integer, ForeignKey('categories.id', name='category', onupdate='CASCADE', ondelete='SET NULL'))
   difficulty = Column(Integer)
 
   def __init__(self, question, answer, category, difficulty):
@@ -45,13 +229,25 @@ class Question(db.Model):
   def insert(self):
     db.session.add(self)
     db.session.commit()
+    notify_question_change('insert', [self.format()])
   
   def update(self):
+    # the row as it was committed, before the pending changes
+    state = inspect(self)
+    old_quest = self.format()
+    for key in old_quest:
+      history = state.attrs[key].history
+      if history.deleted:
+        old_quest[key] = history.deleted[0]
     db.session.commit()
+    notify_question_change('delete', [old_quest])
+    notify_question_change('insert', [self.format()])
 
   def delete(self):
+    quest = self.format()
     db.session.delete(self)
     db.session.commit()
+    notify_question_change('delete', [quest])
 
   def rollback(self):
     db.session.rollback()
@@ -82,4 +278,195 @@ class Category(db.Model):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+QuizResult
+    the final score of a played quiz, category is null for quizzes
+    of all (or several) categories
+'''
+class QuizResult(db.Model):
+  __tablename__ = 'quiz_results'
+
+  id = Column(Integer, primary_key=True)
+  player = Column(String(50), nullable=False)
+  score = Column(Integer, nullable=False)
+  questions = Column(Integer, nullable=False)
+  category = Column(Integer, ForeignKey('categories.id', name='quiz_result_category', onupdate='CASCADE', ondelete='SET NULL'))
+  created_at = Column(DateTime, nullable=False)
+
+  def format(self):
+    return {
+      'player': self.player,
+      'score': self.score,
+      'questions': self.questions,
+      'category': self.category
+    }
+
+'''
+LeaderboardEntry
+    a row of the materialized leaderboard, the top players by total score
+    of all results (category 0) or of the results of one category,
+    rebuilt from quiz_results by flaskr.leaderboard
+'''
+class LeaderboardEntry(db.Model):
+  __tablename__ = 'leaderboard'
+
+  category = Column(Integer, primary_key=True, autoincrement=False)
+  rank = Column(Integer, primary_key=True, autoincrement=False)
+  player = Column(String(50), nullable=False)
+  total_score = Column(Integer, nullable=False)
+  games = Column(Integer, nullable=False)
+  best_score = Column(Integer, nullable=False)
+  refreshed_at = Column(DateTime, nullable=False)
+
+  def format(self):
+    return {
+      'rank': self.rank,
+      'player': self.player,
+      'total_score': self.total_score,
+      'games': self.games,
+      'best_score': self.best_score
+    }
+
+'''
+CategoryRegistry
+    in-process cache of the {id: type} categories map shared by all routes,
+    it is loaded once and reloaded after "ttl" seconds or after invalidate()
+'''
+class CategoryRegistry:
+
+  def __init__(self, ttl=300):
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self._categories = None
+    self._loaded_at = 0
+    self._lock = threading.Lock()
+
+  def all(self):
+    with self._lock:
+      if (self._categories is None
+          or time.monotonic() - self._loaded_at > self.ttl):
+        self.misses += 1
+        self._categories = dict(db.session.query(Category.id, Category.type))
+        self._loaded_at = time.monotonic()
+      else:
+        self.hits += 1
+      return self._categories
+
+  # raises ValueError if cat_id is not an integer
+  def exists(self, cat_id):
+    return int(cat_id) in self.all()
+
+  def invalidate(self):
+    with self._lock:
+      self._categories = None
+
+  def stats(self):
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'size': len(self._categories or {})
+    }
+
+category_registry = CategoryRegistry()
+
+'''
+invalidate_categories(mapper, connection, target)
+    drops the cached categories map whenever a category is written
+'''
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def invalidate_categories(mapper, connection, target):
+  category_registry.invalidate()
+  data_generation.bump()
+
+'''
+QuestionCounter
+    in-process summary of the questions per category: their count, how many
+    there are of each difficulty and when a question of the category was
+    last inserted or deleted (by this process, None before that), counts are
+    loaded with a single GROUP BY query and kept current by the question
+    change listeners, they are reloaded after "ttl" seconds to pick up
+    writes of other processes
+'''
+class QuestionCounter:
+
+  def __init__(self, ttl=60):
+    self.ttl = ttl
+    self._histograms = None
+    self._counts = {}
+    self._total = 0
+    self._modified = {}
+    self._loaded_at = 0
+    self._lock = threading.Lock()
+
+  def _ensure_loaded(self):
+    if (self._histograms is None
+        or time.monotonic() - self._loaded_at > self.ttl):
+      rows = db.session.query(
+        Question.category, Question.difficulty, func.count(Question.id)
+      ).group_by(Question.category, Question.difficulty)
+      self._histograms = {}
+      for cat, difficulty, count in rows:
+        self._histograms.setdefault(self._key(cat), {})[difficulty] = count
+      self._counts = {cat: sum(histogram.values())
+                      for cat, histogram in self._histograms.items()}
+      self._total = sum(self._counts.values())
+      self._loaded_at = time.monotonic()
+
+  @staticmethod
+  def _key(cat):
+    return None if cat is None else int(cat)
+
+  def total(self):
+    with self._lock:
+      self._ensure_loaded()
+      return self._total
+
+  # {category: {'total_questions', 'difficulties', 'last_modified'}}
+  # of every category that has questions or had some modified
+  def stats(self):
+    with self._lock:
+      self._ensure_loaded()
+      return {
+        cat: {
+          'total_questions': self._counts.get(cat, 0),
+          'difficulties': dict(self._histograms.get(cat, {})),
+          'last_modified': self._modified.get(cat)
+        }
+        for cat in set(self._histograms) | set(self._modified)}
+
+  # forgets the counts and modification times, e.g. of another database
+  def clear(self):
+    with self._lock:
+      self._histograms = None
+      self._modified = {}
+
+  # a reset (bulk import, seeding) reloads the counts but keeps
+  # the modification times
+  def question_changed(self, action, quests):
+    with self._lock:
+      if action == 'reset':
+        self._histograms = None
+        return
+      now = datetime.utcnow()
+      for quest in quests:
+        self._modified[self._key(quest['category'])] = now
+      if self._histograms is None:
+        return
+      step = 1 if action == 'insert' else -1
+      for quest in quests:
+        key = self._key(quest['category'])
+        histogram = self._histograms.setdefault(key, {})
+        difficulty = quest['difficulty']
+        histogram[difficulty] = histogram.get(difficulty, 0) + step
+        if histogram[difficulty] <= 0:
+          del histogram[difficulty]
+        self._counts[key] = self._counts.get(key, 0) + step
+        self._total += step
+
+question_counts = QuestionCounter()
+on_question_change(question_counts.question_changed)
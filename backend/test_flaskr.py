@@ -1,42 +1,176 @@
 import os
+import gzip
 import unittest
 import json
-from flask_sqlalchemy import SQLAlchemy
+import asyncio
+import shutil
+import tempfile
+from flask import g
+from flask_sqlalchemy import get_state
+from sqlalchemy import inspect
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from flaskr.asgi import create_asgi_app
+from flaskr.asyncdb import database_from_url
+from flaskr.services import questions_page, category_questions
+from flaskr.serialization import dumps
+from flaskr.quiz import QuestionBuckets
+from flaskr.answers import normalize_answer, edit_distance
+from flaskr.duplicates import duplicate_index
+from flaskr.suggest import suggestion_index
+from flaskr.search import FieldIndex, question_index
+from flaskr.caching import RedisBackend, redis_backend
+from flaskr.leaderboard import running_leaderboards
+from models import migrate_db, Question, Category, QuizResult, db, \
+    category_registry, engine_options, dispose_engines, notify_question_change, \
+    data_generation
+from fixtures import load_psql
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# The tests run on throwaway SQLite databases seeded from trivia.psql,
+# TEST_DATABASE_URL runs them on another database instead, such as
+# the Postgres trivia_test database restored from trivia.psql
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+
+# In-memory stand-in for the redis-py calls of the Redis cache backend,
+# one instance plays a Redis server shared by several processes
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def incr(self, key):
+        self.values[key] = str(int(self.values.get(key, 0)) + 1).encode()
+        return int(self.values[key])
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+    def scan_iter(self, pattern):
+        return [key for key in list(self.values) if key.startswith(pattern.rstrip('*'))]
+
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
+    @classmethod
+    def setUpClass(cls):
+        """Prepare the test database once for all tests."""
+        if TEST_DATABASE_URL:
+            app = create_app({'SQLALCHEMY_DATABASE_URI': TEST_DATABASE_URL})
+            with app.app_context():
+                migrate_db()
+            return
+
+        # Each test gets its own copy of a SQLite database seeded once
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.template_path = os.path.join(cls.directory.name, 'trivia.db')
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + cls.template_path})
+        with app.app_context():
+            migrate_db()
+            load_psql()
+            # The category without questions the category tests expect
+            category = Category(type='Empty')
+            category.id = 20
+            db.session.add(category)
+            db.session.commit()
+        dispose_engines(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        if not TEST_DATABASE_URL:
+            cls.directory.cleanup()
+
     def setUp(self):
         """Define test variables and initialize app."""
-        self.app = create_app()
+        database_path = TEST_DATABASE_URL
+        if not database_path:
+            path = os.path.join(self.directory.name, self.id() + '.db')
+            shutil.copyfile(self.template_path, path)
+            database_path = 'sqlite:///' + path
+        # The app only connects to the database on its first query
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': database_path})
         self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_path = "postgresql://{}:{}@{}/{}".format(os.getenv('DB_USER'),os.getenv('DB_PASSWORD'),'localhost:5432', self.database_name)
-        setup_db(self.app, self.database_path)
 
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-    
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        # Buffered quiz results are written before the database goes away
+        self.app.extensions['leaderboard'].close()
+        dispose_engines(self.app)
 
     """
     TODO
     Write at least one test for each test for successful operation and for expected errors.
     """
 
+    '''
+        Tests for the app startup and the init-db command
+    '''
+
+    # Tests that creating the app doesn't connect to the database
+    def test_create_app_is_lazy(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': 'postgresql://nobody@127.0.0.1:1/unreachable'})
+
+        self.assertEqual(get_state(app).connectors, {})
+
+    # Tests the init-db command creating the schema of an empty database
+    def test_init_db_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'trivia.db')})
+            result = app.test_cli_runner().invoke(args=['init-db'])
+            with app.app_context():
+                tables = inspect(db.engine).get_table_names()
+                db.engine.dispose()
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('questions', tables)
+        self.assertIn('leaderboard', tables)
+
+    '''
+        Tests for the GET /metrics route and request instrumentation
+    '''
+
+    # Tests that responses report their SQL queries and handler time in a Server-Timing header
+    def test_server_timing_header(self):
+        res = self.client().get('/categories/2/questions')
+        timing = res.headers['Server-Timing']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertRegex(timing, r'^db;dur=[0-9.]+;desc="[0-9]+ queries", app;dur=[0-9.]+$')
+
+    # Tests the GET route (/metrics) publishing aggregates in the Prometheus text format
+    def test_get_metrics_success(self):
+        self.client().get('/categories/2/questions')
+        res = self.client().get('/metrics')
+        text = res.data.decode()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'text/plain')
+        self.assertIn('trivia_requests_total{endpoint="get_questions_by_category",method="GET",status="200"} 1', text)
+        self.assertIn('trivia_request_duration_seconds_count{endpoint="get_questions_by_category"} 1', text)
+        self.assertRegex(text, r'trivia_db_queries_total\{endpoint="get_questions_by_category"\} [1-9]')
+
+    # Tests that queries slower than the threshold (SLOW_QUERY_MS of the config) are counted and logged
+    def test_slow_query_logged(self):
+        self.app.extensions['leaderboard'].close()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': self.app.config['SQLALCHEMY_DATABASE_URI'],
+                               'SLOW_QUERY_MS': 0})
+        self.client = self.app.test_client
+        with self.assertLogs(self.app.logger, level='WARNING') as logs:
+            self.client().get('/categories/2/questions')
+        res = self.client().get('/metrics')
+
+        self.assertIn('Slow query', logs.output[0])
+        self.assertRegex(res.data.decode(), r'trivia_slow_queries_total [1-9]')
+
     '''
         Tests for the GET /categories route
     '''
@@ -49,6 +183,157 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
 
+    # Tests the GET route (/categories/stats) against counting the questions
+    def test_get_category_stats(self):
+        res = self.client().get('/categories/stats')
+        data = json.loads(res.data)
+        with self.app.app_context():
+            science = Question.query.filter(Question.category == 1).count()
+            science_easy = Question.query.filter(Question.category == 1, Question.difficulty == 1).count()
+            total = Question.query.count()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_questions'], total)
+        self.assertEqual(data['categories']['1']['total_questions'], science)
+        self.assertEqual(data['categories']['1']['difficulties']['1'], science_easy)
+        self.assertEqual(data['categories']['20']['total_questions'], 0)
+        self.assertEqual(data['categories']['20']['difficulties'], {'1': 0, '2': 0, '3': 0, '4': 0, '5': 0})
+        self.assertIsNone(data['categories']['20']['last_modified'])
+
+    # Tests that the GET route (/categories/stats) follows added and deleted questions
+    def test_get_category_stats_updated(self):
+        before = json.loads(self.client().get('/categories/stats').data)['categories']['20']
+        body = {'question': 'Is this category empty?', 'answer': 'No', 'category': 20, 'difficulty': 3}
+        self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        after = json.loads(self.client().get('/categories/stats').data)['categories']['20']
+
+        self.assertEqual(before['total_questions'], 0)
+        self.assertEqual(after['total_questions'], 1)
+        self.assertEqual(after['difficulties']['3'], 1)
+        self.assertTrue(after['last_modified'])
+
+        # Reloading the counts (e.g. after a bulk import) keeps when the category was modified
+        with self.app.app_context():
+            notify_question_change('reset', [])
+        reloaded = json.loads(self.client().get('/categories/stats').data)['categories']['20']
+
+        self.assertEqual(reloaded['total_questions'], 1)
+        self.assertEqual(reloaded['last_modified'], after['last_modified'])
+
+    # Tests that categories are served from the category registry after the first load
+    def test_get_categories_cached(self):
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+        stats = category_registry.stats()
+        res = self.client().get('/categories/2/questions')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(category_registry.stats()['hits'], stats['hits'] + 1)
+        self.assertEqual(category_registry.stats()['misses'], stats['misses'])
+        self.assertEqual(len(data['categories']), stats['size'])
+
+    # Tests that writing a category invalidates the category registry
+    def test_get_categories_invalidated(self):
+        self.client().get('/categories')
+        with self.app.app_context():
+            category = Category(type='Music')
+            db.session.add(category)
+            db.session.commit()
+            cat_id = category.id
+        res = self.client().get('/categories')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['categories'][str(cat_id)], 'Music')
+
+        with self.app.app_context():
+            db.session.delete(Category.query.get(cat_id))
+            db.session.commit()
+
+    # Tests the GET route (/categories) answering a conditional request with 304 (not modified)
+    def test_get_categories_not_modified(self):
+        res = self.client().get('/categories')
+        etag = res.headers['ETag']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('no-cache', res.headers['Cache-Control'])
+
+        res = self.client().get('/categories', headers={'If-None-Match': etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
+
+    # Tests that a new question changes the cached GET route (/questions) response and its ETag
+    def test_get_questions_cache_invalidated(self):
+        res = self.client().get('/questions?page=2')
+        etag = res.headers['ETag']
+        total = json.loads(res.data)['total_questions']
+
+        question = {
+            'question': 'What is the boiling point of water in Celsius?',
+            'answer': '100',
+            'difficulty': 1,
+            'category': 1
+        }
+        self.client().post('/questions', data=json.dumps(question), headers={'Content-Type': 'application/json'})
+        res = self.client().get('/questions?page=2', headers={'If-None-Match': etag})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertEqual(data['total_questions'], total + 1)
+
+    # Tests that with the Redis backend a write of any process invalidates the entries cached by every process
+    def test_response_cache_redis_generation(self):
+        redis = FakeRedis()
+        backend, other_process = RedisBackend(redis), RedisBackend(redis)
+        response_cache = self.app.extensions['response_cache']
+        response_cache.backend = backend
+        data_generation.listeners.append(backend.bump)
+        try:
+            self.client().get('/categories')
+            self.client().get('/categories')
+            self.assertEqual((response_cache.misses, response_cache.hits), (1, 1))
+
+            # A write of another process
+            other_process.bump()
+            self.client().get('/categories')
+            self.assertEqual(response_cache.misses, 2)
+
+            # A write of this process
+            with self.app.app_context():
+                Question('Is the generation shared?', 'Yes', 1, 1).insert()
+            self.assertEqual(backend.generation(), 2)
+            self.client().get('/categories')
+            self.assertEqual(response_cache.misses, 3)
+        finally:
+            data_generation.listeners.remove(backend.bump)
+
+    # Tests that apps sharing a Redis URL share one backend, registered once as a data generation listener
+    def test_response_cache_redis_backend_once(self):
+        from_url = RedisBackend.from_url
+        RedisBackend.from_url = classmethod(lambda cls, url: cls(FakeRedis()))
+        listeners = list(data_generation.listeners)
+        try:
+            config = {'SQLALCHEMY_DATABASE_URI': self.app.config['SQLALCHEMY_DATABASE_URI'], 'RESPONSE_CACHE_REDIS_URL': 'redis://cache'}
+            backends = [create_app(config).extensions['response_cache'].backend for _ in range(2)]
+
+            self.assertIs(backends[0], backends[1])
+            self.assertEqual(data_generation.listeners, listeners + [backends[0].bump])
+        finally:
+            RedisBackend.from_url = from_url
+            data_generation.listeners[:] = listeners
+            redis_backend.cache_clear()
+
+    # Tests that arguments holding "&" or "=" don't share the cache entry of other arguments
+    def test_response_cache_key_encoded(self):
+        response_cache = self.app.extensions['response_cache']
+        self.client().get('/categories?a=1&b=2')
+        self.client().get('/categories?a=1%26b%3D2')
+        self.client().get('/categories?b=2&a=1')
+
+        self.assertEqual((response_cache.misses, response_cache.hits), (2, 1))
+
     '''
         Tests for the GET /questions route
     '''
@@ -77,6 +362,127 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertEqual(data['success'], False)
 
+    # Tests the GET route (/questions) walking every page with a keyset cursor, forwards then backwards
+    def test_get_questions_cursor_success(self):
+        res = self.client().get('/questions?cursor=&limit=5&include_total=true')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(len(data['questions']), 5)
+        self.assertIsNone(data['prev_cursor'])
+
+        total = data['total_questions']
+        pages = [[quest['id'] for quest in data['questions']]]
+        while data['next_cursor']:
+            res = self.client().get(f"/questions?cursor={data['next_cursor']}&limit=5")
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertIsNone(data['total_questions'])
+            pages.append([quest['id'] for quest in data['questions']])
+
+        ids = [quest_id for page in pages for quest_id in page]
+        self.assertEqual(len(ids), total)
+        self.assertEqual(len(set(ids)), total)
+
+        res = self.client().get(f"/questions?cursor={data['prev_cursor']}&limit=5")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([quest['id'] for quest in data['questions']], pages[-2])
+
+    # Tests the GET route (/questions) walking past questions whose category was deleted, forwards then backwards
+    def test_get_questions_cursor_null_category(self):
+        with self.app.app_context():
+            quests = [Question('Uncategorized {}?'.format(number), 'yes', None, 1) for number in range(3)]
+            for quest in quests:
+                quest.insert()
+            null_ids = [quest.id for quest in quests]
+
+        res = self.client().get('/questions?cursor=&limit=4&include_total=true')
+        data = json.loads(res.data)
+        total = data['total_questions']
+        pages = [[quest['id'] for quest in data['questions']]]
+        while data['next_cursor']:
+            res = self.client().get(f"/questions?cursor={data['next_cursor']}&limit=4")
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            pages.append([quest['id'] for quest in data['questions']])
+
+        ids = [quest_id for page in pages for quest_id in page]
+        self.assertEqual(len(ids), total)
+        self.assertEqual(len(set(ids)), total)
+        self.assertEqual(ids[-3:], null_ids)
+
+        for page in reversed(pages[:-1]):
+            res = self.client().get(f"/questions?cursor={data['prev_cursor']}&limit=4")
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual([quest['id'] for quest in data['questions']], page)
+        self.assertIsNone(data['prev_cursor'])
+
+        with self.app.app_context():
+            for quest_id in null_ids:
+                Question.query.get(quest_id).delete()
+
+    # Tests the GET route (/questions) with a page size above the cap
+    def test_get_questions_cursor_limit_capped(self):
+        res = self.client().get('/questions?cursor=&limit=100000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertLessEqual(len(data['questions']), 100)
+
+    # Tests the GET route (/questions) with a malformed cursor
+    def test_get_questions_cursor_bad_request(self):
+        res = self.client().get('/questions?cursor=break_the_server')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    # Tests the GET route (/questions) returning only the selected fields and no categories
+    def test_get_questions_fields(self):
+        res = self.client().get('/questions?fields=question,difficulty&include_categories=false')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertNotIn('categories', data)
+        self.assertEqual(data['current_category'], [])
+        for quest in data['questions']:
+            self.assertEqual(set(quest), {'id', 'question', 'difficulty'})
+
+        res = self.client().get('/questions')
+        data = json.loads(res.data)
+
+        self.assertIn('categories', data)
+        self.assertEqual(set(data['questions'][0]), {'id', 'question', 'answer', 'category', 'difficulty'})
+
+    # Tests the GET route (/questions) paging with a keyset cursor when the category isn't selected
+    def test_get_questions_cursor_fields(self):
+        res = self.client().get('/questions?cursor=&limit=5&fields=question')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(set(data['questions'][0]), {'id', 'question'})
+        first_ids = [quest['id'] for quest in data['questions']]
+
+        res = self.client().get(f"/questions?cursor={data['next_cursor']}&limit=5&fields=question")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['questions']), 5)
+        self.assertFalse(set(first_ids) & {quest['id'] for quest in data['questions']})
+
+    # Tests the GET route (/questions) with an unknown field
+    def test_get_questions_fields_bad_request(self):
+        res = self.client().get('/questions?fields=question,password')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     '''
         Tests for the DELETE /questions/<quest_id> route
     '''
@@ -109,7 +515,99 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data['success'], False)
 
-    
+
+    '''
+        Tests for the batch DELETE and PATCH /questions routes
+    '''
+
+    # Adds questions through the POST route (/questions) and returns their IDs
+    def add_questions(self, count, category=1):
+        quest_ids = []
+        for index in range(count):
+            res = self.client().post('/questions', data=json.dumps({
+                'question': f'Batch question {index}?',
+                'answer': f'Batch answer {index}',
+                'category': category,
+                'difficulty': 1
+            }), headers={'Content-Type': 'application/json'})
+            quest_ids.append(json.loads(res.data)['question']['id'])
+        return quest_ids
+
+    # Tests the DELETE route (/questions) deleting a list of questions and reporting missing IDs
+    def test_delete_many_questions_success(self):
+        quest_ids = self.add_questions(3)
+        res = self.client().delete('/questions', data=json.dumps({'ids': quest_ids + [100000, quest_ids[0]]}), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['deleted'], quest_ids)
+        self.assertEqual(data['missing'], [100000])
+        with self.app.app_context():
+            self.assertEqual(Question.query.filter(Question.id.in_(quest_ids)).count(), 0)
+
+    # Tests the DELETE route (/questions) without a list of IDs
+    def test_delete_many_questions_bad_request(self):
+        for body in ({}, {'ids': []}, {'ids': ['break_the_server']}):
+            res = self.client().delete('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data['success'], False)
+
+    # Tests the PATCH route (/questions) applying partial updates and reporting missing IDs
+    def test_patch_questions_success(self):
+        quest_ids = self.add_questions(2)
+        res = self.client().patch('/questions', data=json.dumps({'questions': [
+            {'id': quest_ids[0], 'difficulty': 5},
+            {'id': quest_ids[1], 'category': 2, 'answer': 'Patched answer'},
+            {'id': 100000, 'difficulty': 5}
+        ]}), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        catQuests = json.loads(self.client().get('/categories/2/questions').data)['questions']
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['updated'], quest_ids)
+        self.assertEqual(data['missing'], [100000])
+        self.assertIn({
+            'id': quest_ids[1],
+            'question': 'Batch question 1?',
+            'answer': 'Patched answer',
+            'category': 2,
+            'difficulty': 1
+        }, catQuests)
+        with self.app.app_context():
+            self.assertEqual(Question.query.get(quest_ids[0]).difficulty, 5)
+        self.client().delete('/questions', data=json.dumps({'ids': quest_ids}), headers={'Content-Type': 'application/json'})
+
+    # Tests that the search index follows the PATCH route (/questions)
+    def test_patch_questions_search(self):
+        quest_id, = self.add_questions(1)
+        self.client().patch('/questions', data=json.dumps({'questions': [
+            {'id': quest_id, 'question': 'Which zeppelinpatched airship?'}
+        ]}), headers={'Content-Type': 'application/json'})
+        res = self.client().post('/questions', data=json.dumps({'searchTerm': 'zeppelinpatch'}), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        self.client().delete(f'/questions/{quest_id}')
+
+        self.assertEqual([quest['id'] for quest in data['questions']], [quest_id])
+
+    # Tests that the PATCH route (/questions) rejects the whole request on an invalid update
+    def test_patch_questions_bad_request(self):
+        quest_id, = self.add_questions(1)
+        res = self.client().patch('/questions', data=json.dumps({'questions': [
+            {'id': quest_id, 'difficulty': 4},
+            {'id': quest_id, 'difficulty': 9}
+        ]}), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        with self.app.app_context():
+            self.assertEqual(Question.query.get(quest_id).difficulty, 1)
+        self.client().delete(f'/questions/{quest_id}')
+
     '''
         Tests for the POST /questions route
     '''
@@ -142,117 +640,643 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data['success'], False)
 
-    # Tests the POST route (/questions) with valid and complete JSON data to search for questions in the DB
-    def test_post_search_question_success(self):
+    # Tests the POST route (/questions) listing the existing questions much like an added one
+    def test_post_add_question_duplicates(self):
         body = {
-            'searchTerm': 'what'
+            'question': "What boxer's original name was Cassius Clay?",
+            'answer': 'Muhammad Ali',
+            'difficulty': 1,
+            'category': 4
         }
         res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
-    
-    '''
-        Tests for the GET /categories/<cat_id>/questions route
-    '''
+        self.assertEqual([quest['id'] for quest in data['duplicates']], [9])
+        self.assertGreaterEqual(data['duplicates'][0]['similarity'], 0.75)
 
-    # Tests the GET route (/categories/<cat_id>/questions) with a valid category ID (that has questions in it)
-    def test_get_questions_category_success(self):
-        cat_id = '2'
-        res = self.client().get(f'/categories/{cat_id}/questions')
+        # The added question is found as well from then on
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        self.assertEqual(len(data['duplicates']), 2)
+        self.assertEqual(data['duplicates'][0]['similarity'], 1.0)
+
+    # Tests the POST route (/questions) refusing a duplicate question with 409 when duplicates are rejected
+    def test_post_add_question_duplicate_rejected(self):
+        self.app.config['DUPLICATE_MODE'] = 'reject'
+        total = json.loads(self.client().get('/questions').data)['total_questions']
+        body = {
+            'question': "What boxer's original name is Cassius Clay??",
+            'answer': 'Ali',
+            'difficulty': 1,
+            'category': 4
+        }
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['duplicates'][0]['id'], 9)
+        self.assertEqual(json.loads(self.client().get('/questions').data)['total_questions'], total)
+
+        body['question'] = 'Who painted The Starry Night?'
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
-        self.assertEqual(data['success'], True)
+        self.assertEqual(data['duplicates'], [])
 
-    # Tests the GET route (/categories/<cat_id>/questions) with a valid category ID (that has NO questions in it)
-    def test_get_questions_category_empty_category(self):
-        cat_id = '20'
-        res = self.client().get(f'/categories/{cat_id}/questions')
+    # Tests that duplicates added by other processes are found once the index expires
+    def test_post_add_question_duplicates_reloaded(self):
+        body = {'question': 'Which fish is named after a zebra?', 'answer': 'Zebrafish', 'difficulty': 1, 'category': 1}
+        self.client().post('/questions', data=json.dumps(dict(body, question='Who painted The Starry Night?')), headers={'Content-Type': 'application/json'})
+        with self.app.app_context():
+            quest = Question(**body)
+            db.session.add(quest)
+            db.session.commit()
+            quest_id = quest.id
+        duplicate_index._loaded_at -= duplicate_index.ttl + 1
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual([quest['id'] for quest in data['duplicates']], [quest_id])
+
+    # Tests the GET route (/questions/duplicates) reporting groups of near-duplicate questions
+    def test_get_duplicate_questions(self):
+        res = self.client().get('/questions/duplicates')
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
-        
-    # Tests the GET route (/categories/<cat_id>/questions) with an invalid category ID
-    def test_get_questions_category_not_found(self):
-        cat_id = '2000'
-        res = self.client().get(f'/categories/{cat_id}/questions')
+        before = data['total_groups']
+
+        body = {
+            'question': "Whose autobiography is entitled 'I Know Why The Caged Bird Sings'",
+            'answer': 'Maya Angelou',
+            'difficulty': 2,
+            'category': 4
+        }
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        quest_id = json.loads(res.data)['question']['id']
+
+        res = self.client().get('/questions/duplicates')
         data = json.loads(res.data)
 
-        self.assertEqual(res.status_code, 404)
-        self.assertEqual(data['success'], False)
+        self.assertEqual(data['total_groups'], before + 1)
+        self.assertEqual(data['complete'], True)
+        self.assertIn([5, quest_id], [[quest['id'] for quest in group['questions']] for group in data['groups']])
 
-    # Tests the GET route (/categories/<cat_id>/questions) with an invalid category ID
-    def test_get_questions_category_bad_request(self):
-        cat_id = 'break_the_server'
-        res = self.client().get(f'/categories/{cat_id}/questions')
+        # A report cut short by its comparison cap says so
+        with self.app.app_context():
+            groups, complete = duplicate_index.groups(max_comparisons=0)
+        self.assertEqual((groups, complete), ([], False))
+
+        self.client().delete(f'/questions/{quest_id}')
+        res = self.client().get('/questions/duplicates')
+        data = json.loads(res.data)
+        self.assertEqual(data['total_groups'], before)
+
+    # Tests the GET route (/questions/duplicates) with an invalid limit
+    def test_get_duplicate_questions_bad_request(self):
+        res = self.client().get('/questions/duplicates?limit=0')
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data['success'], False)
 
-    '''
-        Tests for the POST /quizzes route
-    '''
-
-    # Tests the POST route (/quizzes) with valid and complete JSON data, with no previous questions asked
-    def test_post_play_quiz_success_no_prev(self):
+    # Tests the POST route (/questions) with valid and complete JSON data to search for questions in the DB
+    def test_post_search_question_success(self):
         body = {
-            'previous_questions': [],
-            'quiz_category': {
-                'id': 1,
-                'type': 'Science'
-            }
+            'searchTerm': 'what'
         }
-        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
-        self.assertTrue(data['question'])
-        
-    # Tests the POST route (/quizzes) with valid and complete JSON data, with previous questions asked
-    def test_post_play_quiz_success_prev(self):
+    
+    # Tests the POST route (/questions) searching with a word prefix, paginating the ranked results
+    def test_post_search_question_paginated(self):
         body = {
-            'previous_questions': [20],
-            'quiz_category': {
-                'id': 1,
-                'type': 'Science'
-            }
+            'searchTerm': 'wha',
+            'page': 2,
+            'limit': 2
         }
-        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
-        self.assertTrue(data['question'])
+        self.assertEqual(data['page'], 2)
+        self.assertEqual(len(data['questions']), 2)
+        self.assertGreater(data['total_results'], 4)
 
-    # Tests the POST route (/quizzes) with valid and complete JSON data but no remaining questions
-    def test_post_play_quiz_success_no_remaining(self):
+    # Tests the POST route (/questions) searching with the question fields selected in the URL
+    def test_post_search_question_fields(self):
         body = {
-            'previous_questions': [20, 21, 22],
-            'quiz_category': {
-                'id': 1,
-                'type': 'Science'
-            }
+            'searchTerm': 'what'
         }
-        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        res = self.client().post('/questions?fields=question', data=json.dumps(body), headers={'Content-Type': 'application/json'})
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 200)
-        self.assertEqual(data['success'], True)
-        self.assertFalse(data['question'])
-    
-    # Tests the POST route (/quizzes) with invalid JSON data
-    def test_post_play_quiz_bad_request(self):
+        self.assertGreater(len(data['questions']), 0)
+        for quest in data['questions']:
+            self.assertEqual(set(quest), {'id', 'question'})
+
+    # Tests the POST route (/questions) searching answers as well as questions
+    def test_post_search_question_answers(self):
         body = {
-            'previous_questions': [],
-            'quiz_category': {
-                'id': 'break_the_server',
-                'type': 'invalid category'
-            }
+            'searchTerm': 'fleming'
+        }
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_results'], 0)
+
+        body['searchAnswers'] = True
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['total_results'], 1)
+        self.assertEqual(data['questions'][0]['id'], 21)
+
+    # Tests that the POST route (/questions) finds questions added and no longer finds deleted ones
+    def test_post_search_question_after_insert_and_delete(self):
+        body = {
+            'searchTerm': 'zanzibar'
+        }
+        self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        question = {
+            'question': 'Which island is known as Zanzibar?',
+            'answer': 'Unguja',
+            'difficulty': 2,
+            'category': 3
+        }
+        res = self.client().post('/questions', data=json.dumps(question), headers={'Content-Type': 'application/json'})
+        quest_id = json.loads(res.data)['question']['id']
+
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        self.assertEqual([quest['id'] for quest in data['questions']], [quest_id])
+
+        self.client().delete(f'/questions/{quest_id}')
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        self.assertEqual(data['total_results'], 0)
+
+    # Tests that the POST route (/questions) finds questions added by other processes once the index expires
+    def test_post_search_question_reloaded(self):
+        body = {
+            'searchTerm': 'zanzibar'
+        }
+        self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        with self.app.app_context():
+            quest = Question(question='Which island is known as Zanzibar?', answer='Unguja', difficulty=2, category=3)
+            db.session.add(quest)
+            db.session.commit()
+            quest_id = quest.id
+        question_index._loaded_at -= question_index.ttl + 1
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual([quest['id'] for quest in data['questions']], [quest_id])
+
+    # Tests that a field index built in one go matches one built a question at a time
+    def test_field_index_load(self):
+        rows = [(1, 'Zebra crossing'), (2, 'a zebra and an aardvark'), (3, None)]
+        loaded = FieldIndex()
+        loaded.load(rows)
+        added = FieldIndex()
+        for quest_id, text in rows:
+            added.add(quest_id, text)
+
+        self.assertEqual(loaded.words, ['a', 'aardvark', 'an', 'and', 'crossing', 'zebra'])
+        self.assertEqual(loaded.words, added.words)
+        self.assertEqual(loaded.postings, added.postings)
+        self.assertEqual(dict(loaded.match_prefix('zeb')), dict(added.match_prefix('zeb')))
+
+    # Tests the POST route (/questions) searching with an invalid page
+    def test_post_search_question_bad_request(self):
+        body = {
+            'searchTerm': 'what',
+            'page': 0
+        }
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    '''
+        Tests for the GET /questions/suggest route
+    '''
+
+    # Tests the GET route (/questions/suggest) completing the last word typed
+    def test_suggest_questions(self):
+        res = self.client().get('/questions/suggest?prefix=whose%20autobio')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['suggestions'], [{'id': 5, 'question': "Whose autobiography is entitled 'I Know Why the Caged Bird Sings'?"}])
+
+    # Tests that the GET route (/questions/suggest) caps the number of suggestions
+    def test_suggest_questions_capped(self):
+        res = self.client().get('/questions/suggest?prefix=w&limit=2')
+        data = json.loads(res.data)
+        res_all = self.client().get('/questions/suggest?prefix=w&limit=1000')
+        data_all = json.loads(res_all.data)
+
+        self.assertEqual(len(data['suggestions']), 2)
+        self.assertLessEqual(len(data_all['suggestions']), 20)
+
+    # Tests that the GET route (/questions/suggest) follows added and deleted questions
+    def test_suggest_questions_updated(self):
+        self.client().get('/questions/suggest?prefix=zebra')
+        body = {'question': 'Which fish is named after a zebra?', 'answer': 'Zebrafish', 'category': 1, 'difficulty': 1}
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        quest_id = json.loads(res.data)['question']['id']
+        added = json.loads(self.client().get('/questions/suggest?prefix=zebraf').data)
+        self.client().delete(f'/questions/{quest_id}')
+        deleted = json.loads(self.client().get('/questions/suggest?prefix=zebraf').data)
+
+        self.assertEqual([quest['id'] for quest in added['suggestions']], [quest_id])
+        self.assertEqual(deleted['suggestions'], [])
+
+    # Tests that the GET route (/questions/suggest) picks up questions added by other processes once it expires
+    def test_suggest_questions_reloaded(self):
+        self.client().get('/questions/suggest?prefix=zebra')
+        with self.app.app_context():
+            quest = Question(question='Which fish is named after a zebra?', answer='Zebrafish', category=1, difficulty=1)
+            db.session.add(quest)
+            db.session.commit()
+            quest_id = quest.id
+        cached = json.loads(self.client().get('/questions/suggest?prefix=zebraf').data)
+        suggestion_index._loaded_at -= suggestion_index.ttl + 1
+        reloaded = json.loads(self.client().get('/questions/suggest?prefix=zebraf').data)
+
+        self.assertEqual(cached['suggestions'], [])
+        self.assertEqual([quest['id'] for quest in reloaded['suggestions']], [quest_id])
+
+    # Tests the GET route (/questions/suggest) without a prefix
+    def test_suggest_questions_bad_request(self):
+        res = self.client().get('/questions/suggest')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    '''
+        Tests for the POST /questions/bulk and GET /questions/export routes
+    '''
+
+    # Tests the POST route (/questions/bulk) importing JSON Lines with valid and invalid rows
+    def test_post_bulk_add_questions(self):
+        lines = [
+            json.dumps({'question': 'q1', 'answer': 'a1', 'difficulty': 1, 'category': 1}),
+            json.dumps({'question': 'q2', 'answer': 'a2', 'difficulty': 9, 'category': 1}),
+            '',
+            'not json',
+            json.dumps({'question': 'q3', 'answer': 'a3', 'difficulty': 2, 'category': 2000}),
+            json.dumps({'question': 'q4', 'answer': 'a4', 'difficulty': 5, 'category': 6})
+        ]
+        res = self.client().post('/questions/bulk', data='\n'.join(lines), headers={'Content-Type': 'application/x-ndjson'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['total_errors'], 3)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 4, 5])
+
+        body = {
+            'searchTerm': 'q4',
+            'searchAnswers': True
+        }
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        self.assertEqual(data['total_results'], 1)
+
+    # Tests the GET route (/questions/export) streaming every question as JSON Lines
+    def test_get_export_questions(self):
+        res = self.client().get('/questions/export')
+        quests = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertEqual(len(quests), json.loads(self.client().get('/questions').data)['total_questions'])
+        self.assertEqual(sorted(quests[0]), ['answer', 'category', 'difficulty', 'id', 'question'])
+
+    '''
+        Tests for the GET /categories/<cat_id>/questions route
+    '''
+
+    # Tests the GET route (/categories/<cat_id>/questions) with a valid category ID (that has questions in it)
+    def test_get_questions_category_success(self):
+        cat_id = '2'
+        res = self.client().get(f'/categories/{cat_id}/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+
+    # Tests the GET route (/categories/<cat_id>/questions) returning only the selected fields
+    def test_get_questions_category_fields(self):
+        res = self.client().get('/categories/2/questions?fields=answer')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertGreater(len(data['questions']), 0)
+        for quest in data['questions']:
+            self.assertEqual(set(quest), {'id', 'answer'})
+
+    # Tests that the GET route (/categories/<cat_id>/questions) counts follow added and deleted questions
+    def test_get_questions_category_counts(self):
+        res = self.client().get('/categories/2/questions')
+        before = json.loads(res.data)
+        self.assertEqual(before['total_results'], len(before['questions']))
+
+        question = {
+            'question': 'Who painted The Starry Night?',
+            'answer': 'Van Gogh',
+            'difficulty': 1,
+            'category': 2
+        }
+        res = self.client().post('/questions', data=json.dumps(question), headers={'Content-Type': 'application/json'})
+        quest_id = json.loads(res.data)['question']['id']
+
+        res = self.client().get('/categories/2/questions')
+        data = json.loads(res.data)
+        self.assertEqual(data['total_results'], before['total_results'] + 1)
+        self.assertEqual(data['total_questions'], before['total_questions'] + 1)
+
+        self.client().delete(f'/questions/{quest_id}')
+        res = self.client().get('/categories/2/questions')
+        data = json.loads(res.data)
+        self.assertEqual(data['total_results'], before['total_results'])
+        self.assertEqual(data['total_questions'], before['total_questions'])
+
+    # Tests the GET route (/categories/<cat_id>/questions) with a valid category ID (that has NO questions in it)
+    def test_get_questions_category_empty_category(self):
+        cat_id = '20'
+        res = self.client().get(f'/categories/{cat_id}/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        
+    # Tests the GET route (/categories/<cat_id>/questions) with an invalid category ID
+    def test_get_questions_category_not_found(self):
+        cat_id = '2000'
+        res = self.client().get(f'/categories/{cat_id}/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    # Tests the GET route (/categories/<cat_id>/questions) with an invalid category ID
+    def test_get_questions_category_bad_request(self):
+        cat_id = 'break_the_server'
+        res = self.client().get(f'/categories/{cat_id}/questions')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    '''
+        Tests for the POST /quizzes route
+    '''
+
+    # Tests the POST route (/quizzes) with valid and complete JSON data, with no previous questions asked
+    def test_post_play_quiz_success_no_prev(self):
+        body = {
+            'previous_questions': [],
+            'quiz_category': {
+                'id': 1,
+                'type': 'Science'
+            }
+        }
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['question'])
+        
+    # Tests the POST route (/quizzes) with valid and complete JSON data, with previous questions asked
+    def test_post_play_quiz_success_prev(self):
+        body = {
+            'previous_questions': [20],
+            'quiz_category': {
+                'id': 1,
+                'type': 'Science'
+            }
+        }
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['question'])
+
+    # Tests the POST route (/quizzes) with valid and complete JSON data but no remaining questions
+    def test_post_play_quiz_success_no_remaining(self):
+        body = {
+            'previous_questions': [20, 21, 22],
+            'quiz_category': {
+                'id': 1,
+                'type': 'Science'
+            }
+        }
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertFalse(data['question'])
+    
+    # Tests the POST route (/quizzes) serving clients that only send previous questions without storing sessions
+    def test_post_play_quiz_stateless(self):
+        body = {'previous_questions': [20, 21], 'quiz_category': {'id': 1}}
+        for _ in range(3):
+            res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        res = self.client().get('/metrics')
+
+        self.assertEqual(data['question']['id'], 22)
+        self.assertIsNone(data['quiz_session'])
+        self.assertEqual(data['remaining_questions'], 0)
+        self.assertIn('trivia_quiz_sessions 0', res.data.decode())
+
+    # Tests the POST route (/quizzes) drawing every question of a category through a quiz session
+    def test_post_play_quiz_session_success(self):
+        body = {
+            'quiz_session': None,
+            'previous_questions': [],
+            'quiz_category': {
+                'id': 1,
+                'type': 'Science'
+            }
+        }
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['quiz_session'])
+
+        asked = [data['question']['id']]
+        body = {'quiz_session': data['quiz_session']}
+        while True:
+            res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            if not data['question']:
+                break
+            self.assertNotIn(data['question']['id'], asked)
+            self.assertEqual(data['question']['category'], 1)
+            asked.append(data['question']['id'])
+
+        self.assertEqual(sorted(asked), [20, 21, 22])
+        self.assertEqual(data['remaining_questions'], 0)
+
+    # Tests the POST route (/quizzes) with an expired or unknown quiz session, falling back to the previous questions
+    def test_post_play_quiz_unknown_session(self):
+        body = {
+            'quiz_session': 'unknown',
+            'previous_questions': [20, 21],
+            'quiz_category': {
+                'id': 1,
+                'type': 'Science'
+            }
+        }
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['question']['id'], 22)
+        self.assertNotEqual(data['quiz_session'], 'unknown')
+
+    # Tests the POST route (/quizzes) restricted to a difficulty range
+    def test_post_play_quiz_difficulty_range(self):
+        body = {
+            'quiz_session': None,
+            'previous_questions': [],
+            'quiz_category': {'id': 1},
+            'difficulty': {'min': 4, 'max': 5}
+        }
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        asked = [data['question']['id']]
+        while data['question']:
+            res = self.client().post('/quizzes', data=json.dumps({'quiz_session': data['quiz_session']}), headers={'Content-Type': 'application/json'})
+            data = json.loads(res.data)
+            if data['question']:
+                self.assertGreaterEqual(data['question']['difficulty'], 4)
+                asked.append(data['question']['id'])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(sorted(asked), [20, 22])
+
+    # Tests the POST route (/quizzes) mixing several categories
+    def test_post_play_quiz_categories(self):
+        body = {
+            'quiz_session': None,
+            'previous_questions': [],
+            'quiz_categories': [1, 2]
+        }
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        cat_ids = {data['question']['category']}
+        while data['question']:
+            res = self.client().post('/quizzes', data=json.dumps({'quiz_session': data['quiz_session']}), headers={'Content-Type': 'application/json'})
+            data = json.loads(res.data)
+            if data['question']:
+                cat_ids.add(data['question']['category'])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(cat_ids, {1, 2})
+
+    # Tests the POST route (/quizzes) in adaptive mode, following correct and wrong answers
+    def test_post_play_quiz_adaptive(self):
+        body = {
+            'previous_questions': [],
+            'quiz_category': {'id': 0},
+            'adaptive': True
+        }
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        difficulties = [data['question']['difficulty']]
+        for correct in (True, True, False):
+            body = {'quiz_session': data['quiz_session'], 'last_answer_correct': correct}
+            res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+            data = json.loads(res.data)
+            difficulties.append(data['question']['difficulty'])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(difficulties, [1, 2, 3, 2])
+
+    # Tests the POST route (/quizzes) with an invalid difficulty range
+    def test_post_play_quiz_bad_difficulty(self):
+        body = {
+            'previous_questions': [],
+            'quiz_category': {'id': 1},
+            'difficulty': {'min': 4, 'max': 2}
+        }
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    # Tests the POST route (/quizzes) with quiz categories that aren't a list
+    def test_post_play_quiz_bad_categories(self):
+        body = {'previous_questions': [], 'quiz_categories': '12'}
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    # Tests that the quiz buckets follow additions and removals
+    def test_question_buckets(self):
+        buckets = QuestionBuckets()
+        buckets.load([(1, 1, 1), (2, 1, 2), (3, 2, 2)])
+        buckets.add(4, 2, 2)
+        buckets.remove(3)
+
+        self.assertEqual(buckets.count(None, (2,)), 2)
+        self.assertEqual(buckets.random_id(frozenset([2]), (1, 2)), 4)
+        self.assertIsNone(buckets.random_id(None, (2,), exclude={2, 4}))
+        self.assertTrue(buckets.matches(1, frozenset([1]), (1, 2)))
+        self.assertFalse(buckets.matches(3, None, (2,)))
+
+    # Tests the POST route (/quizzes) returning questions without their answer
+    def test_post_play_quiz_hide_answer(self):
+        body = {
+            'previous_questions': [],
+            'quiz_category': {'id': 1},
+            'hide_answer': True
+        }
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn('answer', data['question'])
+        self.assertTrue(data['question']['question'])
+
+    # Tests the POST route (/quizzes) with invalid JSON data
+    def test_post_play_quiz_bad_request(self):
+        body = {
+            'previous_questions': [],
+            'quiz_category': {
+                'id': 'break_the_server',
+                'type': 'invalid category'
+            }
         }
 
         res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
@@ -262,6 +1286,661 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
 
 
+    '''
+        Tests for the admission control of the expensive routes
+    '''
+
+    # Tests the POST route (/quizzes) refusing requests over a client's rate with 429 and Retry-After
+    def test_admission_rate_limited(self):
+        admission = self.app.extensions['admission']
+        admission.configure('play_quiz', rate=0.5, burst=2)
+        body = {
+            'previous_questions': [],
+            'quiz_category': {'id': 0}
+        }
+        for _ in range(2):
+            res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+            self.assertEqual(res.status_code, 200)
+
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 429)
+        self.assertEqual(data['success'], False)
+        self.assertIn(res.headers['Retry-After'], ('1', '2'))
+
+        # Other clients have their own rate
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'}, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        self.assertEqual(res.status_code, 200)
+
+        res = self.client().get('/metrics')
+        self.assertIn('trivia_admission_rejected_total{reason="rate",route="play_quiz"} 1', res.data.decode())
+        self.assertIn('trivia_admission_admitted_total{route="play_quiz"} 3', res.data.decode())
+
+    # Tests that client rates are off by default, and apply per forwarded address behind TRUSTED_PROXIES
+    def test_admission_behind_proxy(self):
+        self.assertEqual(self.app.extensions['admission'].limiters['play_quiz'].rate, 0)
+
+        self.app.extensions['leaderboard'].close()
+        self.app = create_app({'SQLALCHEMY_DATABASE_URI': self.app.config['SQLALCHEMY_DATABASE_URI'],
+                               'TRUSTED_PROXIES': 1, 'PLAY_QUIZ_RATE': 0.5, 'PLAY_QUIZ_BURST': 1})
+        self.client = self.app.test_client
+        body = {
+            'previous_questions': [],
+            'quiz_category': {'id': 0}
+        }
+        statuses = []
+        for client_addr in ('10.0.0.2', '10.0.0.3', '10.0.0.2'):
+            res = self.client().post('/quizzes', data=json.dumps(body), headers={
+                'Content-Type': 'application/json', 'X-Forwarded-For': client_addr})
+            statuses.append(res.status_code)
+
+        # Every request comes from the proxy's address, the clients are told apart by their forwarded one
+        self.assertEqual(statuses, [200, 200, 429])
+
+    # Tests the POST route (/questions) searching while the route is at its concurrency limit
+    def test_admission_overloaded(self):
+        admission = self.app.extensions['admission']
+        admission.configure('search_questions', concurrency=1, queue_timeout=0.05)
+        limiter = admission.limiters['search_questions']
+        body = {
+            'searchTerm': 'what'
+        }
+        # A request still being handled holds the only slot
+        limiter.acquire()
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(res.headers['Retry-After'], '1')
+        res = self.client().get('/metrics')
+        self.assertIn('trivia_admission_in_flight{route="search_questions"} 1', res.data.decode())
+
+        limiter.release()
+        res = self.client().post('/questions', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(limiter.in_flight, 0)
+        self.assertEqual(limiter.rejected['concurrency'], 1)
+
+    '''
+        Tests for the /quizzes/answer route
+    '''
+
+    # Tests the normal form answers are compared in and the edit distance
+    def test_normalize_answer(self):
+        self.assertEqual(normalize_answer('The Palace of  Versailles!'), 'palace of versailles')
+        self.assertEqual(normalize_answer('Pelé'), 'pele')
+        self.assertEqual(normalize_answer('The'), 'the')
+        self.assertEqual(edit_distance('angelou', 'angelu', 2), 1)
+        self.assertEqual(edit_distance('escher', 'uruguay', 2), 3)
+
+    # Tests the POST route (/quizzes/answer) with correct, misspelled and wrong answers
+    def test_check_answer(self):
+        answers = ['maya angelou', 'Maya Angelu', 'Maya', 'the MAYA ANGELOU.']
+        results = []
+        for answer in answers:
+            body = {'question_id': 5, 'answer': answer}
+            res = self.client().post('/quizzes/answer', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+            data = json.loads(res.data)
+            results.append(data['correct'])
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(results, [True, True, False, True])
+        self.assertEqual(data['answer'], 'Maya Angelou')
+        self.assertIsNone(data['score'])
+
+    # Tests the POST route (/quizzes/answer) with fuzzy matching turned off
+    def test_check_answer_exact(self):
+        body = {'question_id': 5, 'answer': 'Maya Angelu', 'fuzzy': False}
+        res = self.client().post('/quizzes/answer', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['correct'], False)
+
+    # Tests the POST route (/quizzes/answer) scoring the answers of a quiz session
+    def test_check_answer_quiz_session(self):
+        body = {
+            'previous_questions': [],
+            'quiz_category': {'id': 0},
+            'adaptive': True,
+            'hide_answer': True
+        }
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        quiz = json.loads(res.data)
+        with self.app.app_context():
+            answer = Question.query.get(quiz['question']['id']).answer
+        body = {'question_id': quiz['question']['id'], 'answer': answer, 'quiz_session': quiz['quiz_session']}
+        scores = []
+        for _ in range(2):
+            res = self.client().post('/quizzes/answer', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+            scores.append(json.loads(res.data)['score'])
+        res = self.client().post('/quizzes', data=json.dumps({'quiz_session': quiz['quiz_session']}), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(scores, [1, 1])
+        self.assertEqual(data['question']['difficulty'], 2)
+
+    # Tests the POST route (/quizzes/answer) with a question that doesn't exist
+    def test_check_answer_not_found(self):
+        body = {'question_id': 1000, 'answer': 'anything'}
+        res = self.client().post('/quizzes/answer', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+    # Tests the POST route (/quizzes/answer) with invalid JSON data
+    def test_check_answer_bad_request(self):
+        bodies = [
+            {'question_id': 5, 'answer': ['Maya Angelou']},
+            {'question_id': 5, 'answer': 'Maya Angelou', 'quiz_session': [1]},
+            {'question_id': 5, 'answer': 'Maya Angelou', 'quiz_session': {'a': 1}}
+        ]
+        responses = [self.client().post('/quizzes/answer', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+                     for body in bodies]
+        data = json.loads(responses[0].data)
+
+        self.assertEqual([res.status_code for res in responses], [400, 400, 400])
+        self.assertEqual(data['success'], False)
+
+
+    '''
+        Tests for the /quizzes/results and /leaderboard routes
+    '''
+
+    # Posts quiz results as (player, score, questions, category) tuples
+    # Plays a quiz session of category 1 answering its first question right
+    def play_session(self):
+        body = {'quiz_session': None, 'previous_questions': [], 'quiz_category': {'id': 1}, 'hide_answer': True}
+        res = self.client().post('/quizzes', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        quiz = json.loads(res.data)
+        with self.app.app_context():
+            answer = Question.query.get(quiz['question']['id']).answer
+        body = {'question_id': quiz['question']['id'], 'answer': answer, 'quiz_session': quiz['quiz_session']}
+        self.client().post('/quizzes/answer', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        return quiz['quiz_session']
+
+    # Tests the POST route (/quizzes/results) buffering results until they are flushed
+    def test_post_quiz_result(self):
+        body = {'player': 'ada', 'quiz_session': self.play_session()}
+        res = self.client().post('/quizzes/results', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        leaderboard = self.app.extensions['leaderboard']
+        pending = len(leaderboard.pending)
+        running = leaderboard in running_leaderboards
+        written = leaderboard.flush()
+        leaderboard.close()
+
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(data['result'], {'player': 'ada', 'score': 1, 'questions': 1, 'category': 1})
+        self.assertEqual((pending, written), (1, 1))
+        self.assertTrue(running)
+        self.assertNotIn(leaderboard, running_leaderboards)
+        with self.app.app_context():
+            self.assertEqual(db.session.query(QuizResult).count(), 1)
+
+    # Tests the POST route (/quizzes/results) scoring a quiz session
+    def test_post_quiz_result_session(self):
+        body = {'player': 'grace', 'quiz_session': self.play_session()}
+        res = self.client().post('/quizzes/results', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        res_again = self.client().post('/quizzes/results', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(data['result'], {'player': 'grace', 'score': 1, 'questions': 1, 'category': 1})
+        self.assertEqual(res_again.status_code, 404)
+
+    # Tests the POST route (/quizzes/results) with invalid results and scores reported by the client
+    def test_post_quiz_result_bad_request(self):
+        bodies = [
+            {'player': '', 'quiz_session': self.play_session()},
+            {'player': 'ada', 'score': 10 ** 9, 'questions': 10 ** 9, 'quiz_category': {'id': 1}},
+            {'player': 'ada', 'quiz_session': [1]},
+            {'player': 'ada', 'quiz_session': {'a': 1}}
+        ]
+        responses = [self.client().post('/quizzes/results', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+                     for body in bodies]
+
+        self.assertEqual([res.status_code for res in responses], [400, 400, 400, 400])
+        self.assertEqual(json.loads(responses[0].data)['success'], False)
+
+    # Tests the GET route (/leaderboard) serving the materialized top players
+    def test_get_leaderboard(self):
+        leaderboard = self.app.extensions['leaderboard']
+        for player, score, cat_id in (('ada', 4, 1), ('ada', 3, 2), ('grace', 5, 1), ('alan', 2, None)):
+            leaderboard.record({'player': player, 'score': score, 'questions': 5, 'category': cat_id})
+        leaderboard.flush()
+        before = json.loads(self.client().get('/leaderboard').data)
+        leaderboard.refresh()
+        res = self.client().get('/leaderboard')
+        data = json.loads(res.data)
+        science = json.loads(self.client().get('/leaderboard?category=1&limit=1').data)
+
+        self.assertEqual(before['leaderboard'], [])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([(entry['rank'], entry['player'], entry['total_score']) for entry in data['leaderboard']],
+                         [(1, 'ada', 7), (2, 'grace', 5), (3, 'alan', 2)])
+        self.assertEqual(data['leaderboard'][0]['games'], 2)
+        self.assertTrue(data['refreshed_at'])
+        self.assertEqual([entry['player'] for entry in science['leaderboard']], ['grace'])
+
+    # Tests the GET route (/leaderboard) of a category that doesn't exist
+    def test_get_leaderboard_not_found(self):
+        res = self.client().get('/leaderboard?category=1000')
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data['success'], False)
+
+
+    '''
+        Tests for the POST /batch route
+    '''
+
+    # Tests the POST route (/batch) running several read requests in one round trip
+    def test_post_batch_success(self):
+        body = {
+            'requests': [
+                {'path': '/questions?page=1'},
+                {'method': 'GET', 'path': '/categories'},
+                {'method': 'POST', 'path': '/quizzes', 'body': {'previous_questions': [], 'quiz_category': {'id': 1}}},
+                {'method': 'POST', 'path': '/questions', 'body': {'searchTerm': 'what'}}
+            ]
+        }
+        res = self.client().post('/batch', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual([response['status'] for response in data['responses']], [200, 200, 200, 200])
+        questions, categories, quiz, search = [response['body'] for response in data['responses']]
+
+        # The categories map is sent once for both routes returning it
+        self.assertEqual(data['categories'], json.loads(self.client().get('/categories').data)['categories'])
+        self.assertNotIn('categories', questions)
+        self.assertNotIn('categories', categories)
+        self.assertEqual(questions['questions'], json.loads(self.client().get('/questions?page=1').data)['questions'])
+        self.assertEqual(quiz['question']['category'], 1)
+        self.assertGreater(search['total_results'], 0)
+
+    # Tests the POST route (/batch) leaving categories other than the categories map in their responses
+    def test_post_batch_category_stats(self):
+        body = {'requests': [{'path': '/categories/stats'}, {'path': '/questions?page=1'}]}
+        res = self.client().post('/batch', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+        stats, questions = [response['body'] for response in data['responses']]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['categories'], json.loads(self.client().get('/categories').data)['categories'])
+        self.assertEqual(stats['categories'], json.loads(self.client().get('/categories/stats').data)['categories'])
+        self.assertNotIn('categories', questions)
+
+    # Tests the POST route (/batch) running identical GET requests once
+    def test_post_batch_dedupes_requests(self):
+        response_cache = self.app.extensions['response_cache']
+        body = {
+            'requests': [{'path': '/categories/2/questions'}] * 3
+        }
+        res = self.client().post('/batch', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(response_cache.misses + response_cache.hits, 1)
+        self.assertEqual(data['responses'][0], data['responses'][2])
+        self.assertGreater(len(data['responses'][0]['body']['questions']), 0)
+
+    # Tests the POST route (/batch) reporting the errors of sub-requests, and refusing writes
+    def test_post_batch_subrequest_errors(self):
+        total = json.loads(self.client().get('/questions').data)['total_questions']
+        body = {
+            'requests': [
+                {'path': '/questions?page=1000'},
+                {'path': '/no_such_route'},
+                {'path': '/questions/export'},
+                {'method': 'DELETE', 'path': '/questions/5'},
+                {'method': 'POST', 'path': '/questions', 'body': {'question': 'Q?', 'answer': 'A', 'category': 1, 'difficulty': 1}}
+            ]
+        }
+        res = self.client().post('/batch', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([response['status'] for response in data['responses']], [404, 404, 404, 405, 405])
+        self.assertEqual(data['responses'][3]['body']['success'], False)
+        self.assertEqual(json.loads(self.client().get('/questions').data)['total_questions'], total)
+
+    # Tests the POST route (/batch) with malformed batches
+    def test_post_batch_bad_request(self):
+        for body in ({}, {'requests': []}, {'requests': [{'path': 'questions'}]}, {'requests': [{'path': '/categories'}] * 21}):
+            res = self.client().post('/batch', data=json.dumps(body), headers={'Content-Type': 'application/json'})
+            data = json.loads(res.data)
+
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(data['success'], False)
+
+    '''
+        Tests for the questions table indexes (query plans)
+    '''
+
+    # Returns the query plan of a SQL query as text, sequential scans are
+    # disabled on Postgres so its planner picks an index whenever one applies
+    def explain(self, sql):
+        with self.app.app_context():
+            connection = db.engine.connect()
+            try:
+                if connection.dialect.name == 'postgresql':
+                    connection.execute('SET enable_seqscan = off')
+                    rows = connection.execute('EXPLAIN ' + sql)
+                else:
+                    rows = connection.execute('EXPLAIN QUERY PLAN ' + sql)
+                return '\n'.join(str(row[-1]) for row in rows)
+            finally:
+                if connection.dialect.name == 'postgresql':
+                    connection.execute('RESET enable_seqscan')
+                connection.close()
+
+    # Tests that filtering questions by category (as quizzes do) uses an index
+    def test_category_filter_uses_index(self):
+        plan = self.explain('SELECT id FROM questions WHERE category = 1')
+
+        self.assertRegex(plan, 'ix_questions_category_(id|difficulty)')
+
+    # Tests that the category ordering of GET /questions reads the (category, id) index instead of sorting
+    def test_category_order_uses_index(self):
+        plan = self.explain('SELECT * FROM questions ORDER BY category, id LIMIT 10')
+
+        self.assertIn('ix_questions_category_id', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    # Tests that the keyset pagination of GET /questions seeks into the (category, id) index
+    def test_keyset_page_uses_index(self):
+        plan = self.explain('SELECT * FROM questions WHERE (category, id) > (2, 5) ORDER BY category, id LIMIT 10')
+
+        self.assertIn('ix_questions_category_id', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    # Tests that filtering questions by difficulty uses an index
+    def test_difficulty_filter_uses_index(self):
+        plan = self.explain('SELECT id FROM questions WHERE difficulty = 3')
+
+        self.assertIn('ix_questions_difficulty', plan)
+
+
+    '''
+        Tests for the database engine configuration
+    '''
+
+    # Tests that the pool and statement timeout settings are read from the config
+    def test_engine_options_from_config(self):
+        options = engine_options({
+            'DB_POOL_SIZE': '20',
+            'DB_MAX_OVERFLOW': 0,
+            'DB_POOL_PRE_PING': 'true',
+            'DB_STATEMENT_TIMEOUT': '5000'
+        }, 'postgresql://localhost/trivia')
+
+        self.assertEqual(options['pool_size'], 20)
+        self.assertEqual(options['max_overflow'], 0)
+        self.assertEqual(options['pool_pre_ping'], True)
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=5000'})
+
+    # Tests that SQLite databases only get the options their pool accepts
+    def test_engine_options_sqlite(self):
+        options = engine_options({'DB_POOL_SIZE': '20'}, 'sqlite://')
+
+        self.assertNotIn('pool_size', options)
+        self.assertNotIn('connect_args', options)
+
+    # Tests that GET requests read from the replica while writes stay on the primary
+    def test_get_requests_use_replica(self):
+        uri = self.app.config['SQLALCHEMY_DATABASE_URI']
+        app = create_app({'SQLALCHEMY_DATABASE_URI': uri, 'DB_REPLICA_URL': uri})
+
+        with app.test_request_context('/questions', method='GET'):
+            self.assertIs(db.session.get_bind(), db.get_engine(app, bind='replica'))
+        with app.test_request_context('/questions', method='POST'):
+            self.assertIs(db.session.get_bind(), db.get_engine(app))
+        # Batches only read, whatever the method of their sub-requests
+        with app.test_request_context('/batch', method='POST'):
+            g.read_only = True
+            with app.test_request_context('/quizzes', method='POST'):
+                self.assertIs(db.session.get_bind(), db.get_engine(app, bind='replica'))
+
+    # Tests that the connection pools are reported on /metrics
+    def test_get_metrics_pool(self):
+        res = self.client().get('/metrics')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('# TYPE trivia_db_pool_connections gauge', res.data.decode())
+
+
+    '''
+        Tests for the question services and JSON serialization
+    '''
+
+    # Tests that the services format rows like Question.format() without loading Question objects
+    def test_services_skip_orm_objects(self):
+        with self.app.app_context():
+            quests = questions_page(1, 10) + category_questions(2)
+            loaded = len(db.session.identity_map)
+            expected = [Question.query.get(quest['id']).format() for quest in quests]
+
+        self.assertEqual(loaded, 0)
+        self.assertEqual(quests, expected)
+
+    # Tests that responses are gzipped for clients accepting it, once large enough
+    def test_response_compression(self):
+        res = self.client().get('/questions', headers={'Accept-Encoding': 'gzip, deflate'})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+        self.assertTrue(res.headers['ETag'].startswith('W/'))
+        data = json.loads(gzip.decompress(res.data))
+        self.assertEqual(data['success'], True)
+
+        # The weak ETag still validates the cached response
+        res = self.client().get('/questions', headers={'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+
+        res = self.client().get('/questions', headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertEqual(json.loads(res.data)['success'], True)
+
+        # Bodies under the threshold are sent as they are
+        res = self.client().get('/questions/suggest?prefix=zzz', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', res.headers)
+        self.assertIn('Accept-Encoding', res.headers['Vary'])
+
+    # Tests that JSON bodies have sorted keys and accept integer keys
+    def test_dumps(self):
+        data = json.loads(dumps({'b': 1, 'a': {2: 'two', 1: 'one'}}))
+
+        self.assertEqual(list(data), ['a', 'b'])
+        self.assertEqual(data['a'], {'1': 'one', '2': 'two'})
+
+    '''
+        Tests for the ASGI app (flaskr.asgi)
+    '''
+
+    # Sends requests to a fresh ASGI app on the test database,
+    # "requests" are (method, path, JSON body) and
+    # (status, JSON data) is returned for each
+    def asgi_requests(self, *requests, app=None):
+        if app is None:
+            app = create_asgi_app(self.app.config['SQLALCHEMY_DATABASE_URI'])
+
+        async def send_all():
+            responses = []
+            for method, path, body in requests:
+                path, _, query = path.partition('?')
+                scope = {
+                    'type': 'http',
+                    'method': method,
+                    'path': path,
+                    'query_string': query.encode(),
+                    'headers': [(b'content-type', b'application/json')]
+                }
+                raw = json.dumps(body).encode() if body is not None else b''
+                messages = []
+
+                async def receive():
+                    return {'type': 'http.request', 'body': raw}
+
+                async def send(message):
+                    messages.append(message)
+
+                await app(scope, receive, send)
+                responses.append((messages[0]['status'],
+                                  json.loads(messages[1]['body'])))
+            await app.shutdown()
+            return responses
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(send_all())
+        finally:
+            loop.close()
+
+    # Tests that the ASGI read routes answer with the same JSON as the Flask app
+    def test_asgi_reads_match_flask(self):
+        paths = ['/categories', '/categories/2/questions', '/questions?cursor=',
+                 '/questions?page=2&fields=question,category&include_categories=false',
+                 '/questions?cursor=&limit=3&fields=answer&include_total=true',
+                 '/categories/3/questions?fields=difficulty']
+        responses = self.asgi_requests(*[('GET', path, None) for path in paths])
+
+        for path, (status, data) in zip(paths, responses):
+            res = self.client().get(path)
+            self.assertEqual(status, res.status_code)
+            self.assertEqual(data, json.loads(res.data))
+
+    # Tests that the ASGI search ranks and pages its results as the Flask app does
+    def test_asgi_search_matches_flask(self):
+        bodies = [{'searchTerm': 'title'}, {'searchTerm': 'the', 'searchAnswers': True, 'limit': 3, 'page': 2},
+                  {'searchTerm': ''}, {'searchTerm': 'zzzzz'}]
+        responses = self.asgi_requests(*[('POST', '/questions?fields=question', body) for body in bodies])
+
+        for body, (status, data) in zip(bodies, responses):
+            res = self.client().post('/questions?fields=question', json=body)
+            self.assertEqual(status, res.status_code)
+            self.assertEqual(data, json.loads(res.data))
+
+    # Tests that adding a question through the ASGI app lists or rejects its duplicates as the Flask app does
+    def test_asgi_add_duplicate_question(self):
+        with self.app.app_context():
+            quest = Question.query.get(9)
+            body = {'question': quest.question, 'answer': 'Ali', 'category': 4, 'difficulty': 1}
+        (status, data), = self.asgi_requests(('POST', '/questions', body))
+
+        self.assertEqual(status, 200)
+        self.assertEqual([duplicate['id'] for duplicate in data['duplicates']], [9])
+
+        app = create_asgi_app(self.app.config['SQLALCHEMY_DATABASE_URI'], {'DUPLICATE_MODE': 'reject'})
+        (status, data), = self.asgi_requests(('POST', '/questions', body), app=app)
+
+        self.assertEqual(status, 409)
+        self.assertEqual(data['message'], 'Conflict')
+        self.assertEqual(len(data['duplicates']), 2)
+
+        added_id = max(duplicate['id'] for duplicate in data['duplicates'])
+        self.asgi_requests(('DELETE', f'/questions/{added_id}', None))
+
+    # Tests adding then deleting a question through the ASGI app
+    def test_asgi_add_and_delete_question(self):
+        body = {
+            'question': 'What is the ASGI question?',
+            'answer': 'This one',
+            'category': 1,
+            'difficulty': 2
+        }
+        (status, data), = self.asgi_requests(('POST', '/questions', body))
+        quest_id = data['question']['id']
+        responses = self.asgi_requests(
+            ('POST', '/quizzes/answer', {'question_id': quest_id, 'answer': 'this one'}),
+            ('DELETE', f'/questions/{quest_id}', None),
+            ('DELETE', f'/questions/{quest_id}', None),
+            ('POST', '/quizzes/answer', {'question_id': quest_id, 'answer': 'this one'}))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(data['question']['question'], body['question'])
+        self.assertEqual(data['duplicates'], [])
+        self.assertEqual(responses[0][1]['correct'], True)
+        self.assertEqual(responses[1], (200, {'success': True, 'question': str(quest_id)}))
+        self.assertEqual(responses[2][0], 404)
+        # The deleted question's answer isn't served from the answer cache
+        self.assertEqual(responses[3][0], 404)
+
+    # Tests playing a quiz session through the ASGI app
+    def test_asgi_play_quiz(self):
+        (status, data), = self.asgi_requests(('POST', '/quizzes', {
+            'quiz_session': None,
+            'previous_questions': [],
+            'quiz_category': {'id': 1}
+        }))
+
+        self.assertEqual(status, 200)
+        self.assertEqual(data['question']['category'], 1)
+        self.assertTrue(data['quiz_session'])
+
+    # Tests that a finished ASGI quiz keeps its session, as in the Flask app
+    def test_asgi_play_quiz_finished(self):
+        app = create_asgi_app(self.app.config['SQLALCHEMY_DATABASE_URI'])
+        (status, data), = self.asgi_requests(('POST', '/quizzes', {
+            'quiz_session': None, 'previous_questions': [],
+            'quiz_category': {'id': 20}}), app=app)
+
+        self.assertEqual(status, 200)
+        self.assertIsNone(data['question'])
+        self.assertIsNotNone(app.quiz_sessions.get(data['quiz_session']))
+
+    # Tests checking answers through the ASGI app
+    def test_asgi_check_answer(self):
+        responses = self.asgi_requests(
+            ('POST', '/quizzes/answer', {'question_id': 9, 'answer': 'muhammad ali'}),
+            ('POST', '/quizzes/answer', {'question_id': 1000, 'answer': 'anything'}))
+
+        self.assertEqual(responses[0][0], 200)
+        self.assertEqual(responses[0][1]['correct'], True)
+        self.assertEqual(responses[1][0], 404)
+
+    # Tests that the ASGI app resolves relative SQLite paths against the root path, as Flask-SQLAlchemy does
+    def test_asgi_sqlite_path(self):
+        root_path = os.path.join(os.sep, 'srv', 'flaskr')
+
+        self.assertEqual(database_from_url('sqlite:///trivia.db', root_path=root_path).path,
+                         os.path.join(root_path, 'trivia.db'))
+        self.assertEqual(database_from_url('sqlite:////tmp/trivia.db', root_path=root_path).path, '/tmp/trivia.db')
+        self.assertEqual(database_from_url('sqlite://', root_path=root_path).path, ':memory:')
+
+    # Tests the JSON error responses of the ASGI app
+    def test_asgi_errors(self):
+        responses = self.asgi_requests(
+            ('GET', '/categories/abc/questions', None),
+            ('GET', '/categories/1000/questions', None),
+            ('PUT', '/quizzes', None))
+
+        self.assertEqual([status for status, data in responses], [400, 404, 405])
+        self.assertEqual(responses[1][1], {'success': False, 'message': 'Not Found'})
+
+    # Tests that the ASGI app logs the errors of its handlers
+    def test_asgi_handler_error_logged(self):
+        app = create_asgi_app(self.app.config['SQLALCHEMY_DATABASE_URI'])
+
+        async def failing(request):
+            raise RuntimeError('handler failed')
+        app.routes[0][1]['GET'] = failing
+        with self.assertLogs('flaskr.asgi', 'ERROR') as logs:
+            (status, data), = self.asgi_requests(('GET', '/categories', None), app=app)
+
+        self.assertEqual(status, 500)
+        self.assertEqual(data['message'], 'Internal Server Error')
+        self.assertIn('GET /categories', logs.output[0])
+        self.assertIn('RuntimeError: handler failed', logs.output[0])
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
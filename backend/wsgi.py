@@ -0,0 +1,6 @@
+# WSGI entry point for production servers: gunicorn -c gunicorn.conf.py wsgi:app
+# Creating the app doesn't connect to the database, so it can be
+# preloaded once in the gunicorn master and shared by the forked workers
+from flaskr import create_app
+
+app = create_app()
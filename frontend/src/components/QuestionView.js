@@ -13,23 +13,73 @@ class QuestionView extends Component {
       page: 1,
       totalQuestions: 0,
       categories: {},
+      categoryStats: {},
       currentCategory: null,
     }
   }
 
   componentDidMount() {
-    this.getQuestions();
+    this.loadView();
+  }
+
+  // The first page and the category statistics in one round trip
+  loadView = () => {
+    $.ajax({
+      url: `/batch`,
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({requests: [
+        {method: 'GET', path: `/questions?page=${this.state.page}`},
+        {method: 'GET', path: `/categories/stats`}
+      ]}),
+      success: (result) => {
+        const [questions, stats] = result.responses;
+        if (questions.status !== 200 || stats.status !== 200) {
+          alert('Unable to load questions. Please try your request again')
+          return;
+        }
+        this.setState({
+          questions: questions.body.questions,
+          totalQuestions: questions.body.total_questions,
+          categories: questions.body.categories || result.categories,
+          categoryStats: stats.body.categories,
+          currentCategory: questions.body.current_category })
+        return;
+      },
+      error: (error) => {
+        alert('Unable to load questions. Please try your request again')
+        return;
+      }
+    })
+  }
+
+  getCategoryStats = () => {
+    $.ajax({
+      url: `/categories/stats`,
+      type: "GET",
+      success: (result) => {
+        this.setState({ categoryStats: result.categories })
+        return;
+      },
+      error: (error) => {
+        alert('Unable to load category statistics. Please try your request again')
+        return;
+      }
+    })
   }
 
   getQuestions = () => {
+    // The categories only need to be loaded with the first page
+    const includeCategories = Object.keys(this.state.categories).length === 0;
     $.ajax({
-      url: `/questions?page=${this.state.page}`, //TODO: update request URL
+      url: `/questions?page=${this.state.page}&include_categories=${includeCategories}`, //TODO: update request URL
       type: "GET",
       success: (result) => {
         this.setState({
           questions: result.questions,
           totalQuestions: result.total_questions,
-          categories: result.categories,
+          categories: result.categories || this.state.categories,
           currentCategory: result.current_category })
         return;
       },
@@ -109,6 +159,7 @@ class QuestionView extends Component {
           type: "DELETE",
           success: (result) => {
             this.getQuestions();
+            this.getCategoryStats();
           },
           error: (error) => {
             alert('Unable to load questions. Please try your request again')
@@ -128,6 +179,7 @@ class QuestionView extends Component {
             {Object.keys(this.state.categories).map((id, ) => (
               <li key={id} onClick={() => {this.getByCategory(id)}}>
                 {this.state.categories[id]}
+                {this.state.categoryStats[id] && ` (${this.state.categoryStats[id].total_questions})`}
                 <img className="category" src={`${this.state.categories[id]}.svg`}/>
               </li>
             ))}
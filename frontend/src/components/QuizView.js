@@ -10,12 +10,16 @@ class QuizView extends Component {
     super();
     this.state = {
         quizCategory: null,
+        quizSession: null,
         previousQuestions: [], 
         showAnswer: false,
         categories: {},
         numCorrect: 0,
         currentQuestion: {},
         guess: '',
+        result: null,
+        player: '',
+        scoreSaved: false,
         forceEnd: false
     }
   }
@@ -54,7 +58,9 @@ class QuizView extends Component {
       contentType: 'application/json',
       data: JSON.stringify({
         previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
+        quiz_category: this.state.quizCategory,
+        quiz_session: this.state.quizSession,
+        hide_answer: true
       }),
       xhrFields: {
         withCredentials: true
@@ -63,9 +69,11 @@ class QuizView extends Component {
       success: (result) => {
         this.setState({
           showAnswer: false,
+          quizSession: result.quiz_session,
           previousQuestions: previousQuestions,
           currentQuestion: result.question,
           guess: '',
+          result: null,
           forceEnd: result.question ? false : true
         })
         return;
@@ -79,22 +87,72 @@ class QuizView extends Component {
 
   submitGuess = (event) => {
     event.preventDefault();
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    let evaluate =  this.evaluateAnswer()
-    this.setState({
-      numCorrect: !evaluate ? this.state.numCorrect : this.state.numCorrect + 1,
-      showAnswer: true,
+    $.ajax({
+      url: '/quizzes/answer',
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        question_id: this.state.currentQuestion.id,
+        answer: this.state.guess,
+        quiz_session: this.state.quizSession
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({
+          numCorrect: !result.correct ? this.state.numCorrect : this.state.numCorrect + 1,
+          result: result,
+          showAnswer: true,
+        })
+        return;
+      },
+      error: (error) => {
+        alert('Unable to check your answer. Please try your request again')
+        return;
+      }
+    })
+  }
+
+  saveScore = (event) => {
+    event.preventDefault();
+    $.ajax({
+      url: '/quizzes/results',
+      type: "POST",
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        player: this.state.player,
+        quiz_session: this.state.quizSession
+      }),
+      xhrFields: {
+        withCredentials: true
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState({ scoreSaved: true })
+        return;
+      },
+      error: (error) => {
+        alert('Unable to save your score. Please try your request again')
+        return;
+      }
     })
   }
 
   restartGame = () => {
     this.setState({
       quizCategory: null,
+      quizSession: null,
       previousQuestions: [], 
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
+      result: null,
+      scoreSaved: false,
       forceEnd: false
     })
   }
@@ -125,25 +183,26 @@ class QuizView extends Component {
     return(
       <div className="quiz-play-holder">
         <div className="final-header"> Your Final Score is {this.state.numCorrect}</div>
+        {this.state.scoreSaved
+          ? <div className="score-saved">Your score was saved to the leaderboard</div>
+          : (
+            <form onSubmit={this.saveScore}>
+              <input type="text" name="player" placeholder="Your name" onChange={this.handleChange}/>
+              <input className="save-score button" type="submit" value="Save Score" />
+            </form>
+          )}
         <div className="play-again button" onClick={this.restartGame}> Play Again? </div>
       </div>
     )
   }
 
-  evaluateAnswer = () => {
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    const answerArray = this.state.currentQuestion.answer.toLowerCase().split(' ');
-    return answerArray.includes(formatGuess)
-  }
-
   renderCorrectAnswer(){
-    const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
-    let evaluate =  this.evaluateAnswer()
+    let evaluate = this.state.result.correct
     return(
       <div className="quiz-play-holder">
         <div className="quiz-question">{this.state.currentQuestion.question}</div>
         <div className={`${evaluate ? 'correct' : 'wrong'}`}>{evaluate ? "You were correct!" : "You were incorrect"}</div>
-        <div className="quiz-answer">{this.state.currentQuestion.answer}</div>
+        <div className="quiz-answer">{this.state.result.answer}</div>
         <div className="next-question button" onClick={this.getNextQuestion}> Next Question </div>
       </div>
     )
@@ -1,21 +1,54 @@
 import React, { Component } from 'react'
+import $ from 'jquery';
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
   }
 
   getInfo = (event) => {
     event.preventDefault();
+    this.setState({ suggestions: [] })
     this.props.submitSearch(this.state.query)
   }
 
   handleInputChange = () => {
     this.setState({
       query: this.search.value
+    }, this.getSuggestions)
+  }
+
+  // Suggestions come from the server's prefix index, cheap enough to ask on every keystroke
+  getSuggestions = () => {
+    const query = this.state.query
+    if (!query.trim()) {
+      this.setState({ suggestions: [] })
+      return;
+    }
+    $.ajax({
+      url: `/questions/suggest?prefix=${encodeURIComponent(query)}&limit=5`,
+      type: "GET",
+      success: (result) => {
+        // Answers to older keystrokes are ignored
+        if (query === this.state.query) {
+          this.setState({ suggestions: result.suggestions })
+        }
+        return;
+      },
+      error: (error) => {
+        this.setState({ suggestions: [] })
+        return;
+      }
     })
   }
 
+  selectSuggestion = (question) => {
+    this.search.value = question
+    this.setState({ query: question, suggestions: [] })
+    this.props.submitSearch(question)
+  }
+
   render() {
     return (
       <form onSubmit={this.getInfo}>
@@ -25,6 +58,13 @@ class Search extends Component {
           onChange={this.handleInputChange}
         />
         <input type="submit" value="Submit" className="button"/>
+        <ul className="search-suggestions">
+          {this.state.suggestions.map(suggestion => (
+            <li key={suggestion.id} onClick={() => this.selectSuggestion(suggestion.question)}>
+              {suggestion.question}
+            </li>
+          ))}
+        </ul>
       </form>
     )
   }